@@ -0,0 +1,140 @@
+import hashlib
+import ipaddress
+from bisect import bisect_right
+
+
+class AddressSet:
+    """
+    Immutable set of IPv4 addresses stored as sorted, merged, inclusive
+    integer intervals, plus any non-IP tokens (e.g. "any" or object names)
+    which are compared by name only.
+
+    Memory is proportional to the number of intervals, not the number of
+    addresses they cover.
+    """
+
+    __slots__ = ("intervals", "names", "_hash", "_fingerprint")
+
+    def __init__(self, intervals=(), names=()):
+        self.intervals = merge_intervals(intervals)
+        self.names = frozenset(names)
+        self._hash = None
+        self._fingerprint = None
+
+    @classmethod
+    def from_range(cls, start_ip, end_ip):
+        start = int(ipaddress.IPv4Address(start_ip))
+        end = int(ipaddress.IPv4Address(end_ip))
+        return cls([(start, end)])
+
+    @classmethod
+    def from_cidr(cls, cidr):
+        network = ipaddress.IPv4Network(cidr, strict=False)
+        return cls([(int(network.network_address), int(network.broadcast_address))])
+
+    @classmethod
+    def from_ips(cls, ips):
+        points = [int(ipaddress.IPv4Address(ip)) for ip in ips]
+        return cls([(p, p) for p in points])
+
+    @classmethod
+    def from_name(cls, name):
+        return cls(names=[name])
+
+    def __len__(self):
+        # Number of addresses and names contained, without materializing them
+        return sum(end - start + 1 for start, end in self.intervals) + len(self.names)
+
+    def __bool__(self):
+        return bool(self.intervals) or bool(self.names)
+
+    def __eq__(self, other):
+        if not isinstance(other, AddressSet):
+            return NotImplemented
+        return self.intervals == other.intervals and self.names == other.names
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.intervals, self.names))
+        return self._hash
+
+    def fingerprint(self):
+        """
+        Stable 16-byte digest of the normalized intervals and names. Unlike
+        hash() it does not change between processes, so it can be stored.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for start, end in self.intervals:
+                digest.update(start.to_bytes(4, "big"))
+                digest.update(end.to_bytes(4, "big"))
+            for name in sorted(self.names):
+                digest.update(b"\0")
+                digest.update(name.encode())
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+
+    def __repr__(self):
+        ranges = [f"{ipaddress.IPv4Address(s)}-{ipaddress.IPv4Address(e)}" for s, e in self.intervals]
+        return f"AddressSet({ranges + sorted(self.names)})"
+
+    def __contains__(self, address):
+        if isinstance(address, str) and address in self.names:
+            return True
+        try:
+            value = int(ipaddress.IPv4Address(address))
+        except (ipaddress.AddressValueError, ValueError):
+            return False
+        idx = bisect_right(self.intervals, (value, float("inf"))) - 1
+        return idx >= 0 and self.intervals[idx][1] >= value
+
+    def issubset(self, other):
+        if not self.names <= other.names:
+            return False
+
+        # Both interval lists are sorted and merged, so every interval of self
+        # must fall entirely inside a single interval of other
+        j = 0
+        theirs = other.intervals
+        for start, end in self.intervals:
+            while j < len(theirs) and theirs[j][1] < start:
+                j += 1
+            if j == len(theirs) or theirs[j][0] > start or theirs[j][1] < end:
+                return False
+
+        return True
+
+    def issuperset(self, other):
+        return other.issubset(self)
+
+    def overlaps(self, other):
+        if self.names & other.names:
+            return True
+
+        i, j = 0, 0
+        mine, theirs = self.intervals, other.intervals
+        while i < len(mine) and j < len(theirs):
+            if mine[i][0] <= theirs[j][1] and theirs[j][0] <= mine[i][1]:
+                return True
+            if mine[i][1] < theirs[j][1]:
+                i += 1
+            else:
+                j += 1
+
+        return False
+
+    def union(self, other):
+        return AddressSet(self.intervals + other.intervals, self.names | other.names)
+
+
+def merge_intervals(intervals):
+    # Sort and coalesce overlapping or adjacent inclusive intervals
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return tuple(merged)
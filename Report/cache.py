@@ -0,0 +1,210 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+import database
+from models import CacheGeneration
+
+
+# Seconds a cached value is served before it is reloaded from the database
+CACHE_TTL = database.get_setting("cacheTTL", 300)
+
+
+# ag_cache_generation is a report table, read through argos sessions as well
+SHARED_OPTIONS = {"schema_translate_map": {None: database.REPORT_SCHEMA}}
+
+
+class TTLCache:
+    """
+    Single-value cache with a time to live, used for small tables that are
+    read on every analysis but change rarely. Reads given a session also
+    compare the cache's ag_cache_generation row with the one the value was
+    loaded under, so an invalidation in any process is seen by all of them.
+    """
+
+    def __init__(self, name: str, ttl: float = CACHE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.value = None
+        self.shared = None
+        self.expires = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, loader, db=None):
+        shared = shared_generation(db, self.name) if db is not None else None
+        with self.lock:
+            if time.monotonic() < self.expires and shared == self.shared:
+                self.hits += 1
+                return self.value
+            self.misses += 1
+
+        # Loaded outside the lock, concurrent misses at worst load twice
+        value = loader()
+        with self.lock:
+            self.value = value
+            self.shared = shared
+            self.expires = time.monotonic() + self.ttl
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.value = None
+            self.shared = None
+            self.expires = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "cached": time.monotonic() < self.expires,
+                "ttl": self.ttl,
+            }
+
+
+class LRUCache:
+    """
+    Keyed cache holding the most recently used entries, for values that never
+    go stale such as decoded views of stored (immutable) reports. Bounded by
+    entry count and, when maxbytes is set, by the sizes given to store().
+    """
+
+    def __init__(self, name: str, maxsize: int, maxbytes: int = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def store(self, key, value, nbytes: int = 0):
+        with self.lock:
+            if self.maxbytes is not None and nbytes > self.maxbytes:
+                # Would evict everything else and still not fit
+                return
+            if key in self.entries:
+                self.nbytes -= self.sizes[key]
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.sizes[key] = nbytes
+            self.nbytes += nbytes
+            while len(self.entries) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                evicted, _ = self.entries.popitem(last=False)
+                self.nbytes -= self.sizes.pop(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+                "maxsize": self.maxsize,
+                "bytes": self.nbytes,
+                "maxbytes": self.maxbytes,
+            }
+
+
+def deep_size(value) -> int:
+    # Approximate memory of decoded JSON-like data. Dict keys are left out, the
+    # decoders share them between rows; other shared values are counted every
+    # time they are referenced, so it errs on the high side
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(v) for v in value)
+    return size
+
+
+def sampled_size(items: list, sample: int = 100) -> int:
+    # deep_size of a long list of similar items, extrapolated from an even sample
+    if not items:
+        return sys.getsizeof(items)
+    picked = items[::max(1, len(items) // sample)]
+    return sys.getsizeof(items) + sum(deep_size(item) for item in picked) * len(items) // len(picked)
+
+
+compliance_objects = TTLCache("compliance_objects")
+weights = TTLCache("weights")
+firewalls = TTLCache("firewalls")
+report_views = LRUCache(
+    "report_views",
+    database.get_setting("reportViewCacheSize", 8),
+    database.get_setting("reportViewCacheMB", 256) * 1024 * 1024,
+)
+
+CACHES = {cache.name: cache for cache in (compliance_objects, weights, firewalls, report_views)}
+
+# Bumped on every invalidation so job worker processes can drop their own copies
+_generation = 0
+
+
+def shared_generation(db, name: str) -> int:
+    return db.execute(select(CacheGeneration.generation).where(CacheGeneration.name == name), execution_options=SHARED_OPTIONS).scalar() or 0
+
+
+def invalidate(name: str = None, db=None):
+    """
+    Drops the named cache, or all of them, in this process. With a session
+    the TTL caches are also invalidated in every other process through
+    ag_cache_generation, once the caller commits. The report views hold
+    immutable reports and are only ever dropped locally.
+    """
+    global _generation
+    if name is not None and name not in CACHES:
+        raise KeyError(name)
+    for cache in CACHES.values():
+        if name is None or cache.name == name:
+            cache.clear()
+    _generation += 1
+
+    shared = [cache.name for cache in CACHES.values() if isinstance(cache, TTLCache) and (name is None or cache.name == name)]
+    if db is not None and shared:
+        stmt = insert(CacheGeneration).values([{"name": cacheName, "generation": 1} for cacheName in shared])
+        db.execute(
+            stmt.on_conflict_do_update(index_elements=[CacheGeneration.name], set_={"generation": CacheGeneration.generation + 1}),
+            execution_options=SHARED_OPTIONS,
+        )
+
+
+def generation() -> int:
+    return _generation
+
+
+def sync(parentGeneration: int):
+    # Called in worker processes with the parent's generation at submit time
+    global _generation
+    if parentGeneration != _generation:
+        for cache in CACHES.values():
+            cache.clear()
+        _generation = parentGeneration
+
+
+def stats() -> dict:
+    return {"generation": _generation, "caches": {name: cache.stats() for name, cache in CACHES.items()}}
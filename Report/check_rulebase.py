@@ -1,9 +1,14 @@
 import re
-from sqlalchemy.orm import aliased
-from sqlalchemy import Integer, String, cast, func, case, literal, and_, or_
-from datetime import datetime
+import hashlib
+from bisect import bisect_right
+from collections import defaultdict
 import ipaddress
-from models import SysLog, Rule, Service, Address, Analyze
+from address_set import AddressSet, merge_intervals
+from shadow_index import ShadowIndex, find_shadows, SHADOW, PARTIAL_SHADOW
+from policy_hits import retrieve_unused, retrieve_idle
+from unused_objects import retrieve_unused_objects
+from stage_metrics import stage, check
+from rule_columns import RuleColumns, SCALAR_TYPES
 
 
 class RuleTypes:
@@ -12,8 +17,10 @@ class RuleTypes:
         self.permanent = set()
         self.redundant = set()
         self.shadow = set()
+        self.partial_shadow = set()
         self.unused = set()
         self.unused_objects = set()
+        self.greater30days = set()
         self.dst_excessiveopen = set()
         self.port_excessiveopen = set()
         self.knownportopen = set()
@@ -29,6 +36,13 @@ class RuleTypes:
 
     def to_dict(self):
         return {k: list(v) for k, v in vars(self).items()}
+
+    def rule_types(self) -> dict:
+        """
+        Inverted index of to_dict(): rule id (as a string, since it is stored
+        as a JSON object key) to the names of the types the rule belongs to.
+        """
+        return invert_rule_types(self.to_dict())
     
     def score(self, weights: dict, total_rules: int) -> dict:
         """
@@ -53,7 +67,7 @@ class RuleTypes:
         """
         category_mapping = {
             "Period Management": ["expired", "permanent"],
-            "Policy Utilization": ["redundant", "shadow", "unused", "unused_objects"],
+            "Policy Utilization": ["redundant", "shadow", "partial_shadow", "unused", "unused_objects", "greater30days"],
             "Policy Scope": ["dst_excessiveopen", "port_excessiveopen"],
             "Service Safety": ["knownportopen", "virusportopen", "mgmtportopen"],
             "Security Compliance": ["src_anyopen", "dst_anyopen", "noevidence", "compliancecheck"],
@@ -75,6 +89,15 @@ class RuleTypes:
 
 
 
+def invert_rule_types(types: dict) -> dict:
+    ruleTypes = defaultdict(list)
+    for type_name, rule_ids in types.items():
+        for rule_id in rule_ids:
+            ruleTypes[str(rule_id)].append(type_name)
+
+    return dict(ruleTypes)
+
+
 def is_valid_cidr(cidr):
     # Check if the input is a valid CIDR format
     cidr_pattern = r'^([0-9]{1,3}\.){3}[0-9]{1,3}/[0-9]{1,2}$'
@@ -96,22 +119,17 @@ def parseIPRange(range_str):
     # IP range in format 'start_ip-end_ip'
 
     start_ip_str, end_ip_str = range_str[3:].split('-')
-    start_ip = ipaddress.IPv4Address(start_ip_str)
-    end_ip = ipaddress.IPv4Address(end_ip_str)
-    
-    # Generate the IPs in the range
-    return {ipaddress.IPv4Address(ip) for ip in range(int(start_ip), int(end_ip) + 1)}
+    return AddressSet.from_range(start_ip_str, end_ip_str)
 
 def parseCIDR(cidr_str):
     # IP range in format '192.168.1.0/24'
     
-    network = ipaddress.IPv4Network(cidr_str[3:], strict=False)
-    return set(network.hosts()) | {network.network_address, network.broadcast_address}
+    return AddressSet.from_cidr(cidr_str[3:])
 
 
 def parseIPList(list_str):
     ip_list = list_str.split(',')
-    return {ipaddress.IPv4Address(ip.strip()[3:]) for ip in ip_list}
+    return AddressSet.from_ips(ip.strip()[3:] for ip in ip_list)
 
 
 
@@ -159,321 +177,290 @@ def parseAddressMembers(members):
 
 
 
-def parseRuleIPs(rules):
-    ruleIPs = []
+def parseRuleAddress(address):
+    if not address.startswith("IP_"):
+        return AddressSet.from_name(address)  # This can be handled as a wildcard match, adjust as necessary
+    elif '-' in address:  # It's a range (starts with 'IP_')
+        return parseIPRange(address)
+    elif '/' in address:  # It's a CIDR (starts with 'IP_')
+        return parseCIDR(address)
+    else:  # It's a list of IPs (starts with 'IP_')
+        return parseIPList(address)
 
-    for rule in rules:
-        source = rule.source
-        destination = rule.destination
-
-        if not source.startswith("IP_"):
-            sourceIPs = {source}  # This can be handled as a wildcard match, adjust as necessary
-        elif '-' in source:  # It's a range (starts with 'IP_')
-            sourceIPs = parseIPRange(source)
-        elif '/' in source:  # It's a CIDR (starts with 'IP_')
-            sourceIPs = parseCIDR(source)
-        else:  # It's a list of IPs (starts with 'IP_')
-            sourceIPs = parseIPList(source)
-
-        if not destination.startswith("IP_"):
-            dstIPs = {destination}  # This can be handled as a wildcard match, adjust as necessary
-        elif '-' in destination:  # It's a range (starts with 'IP_')
-            dstIPs = parseIPRange(destination)
-        elif '/' in destination:  # It's a CIDR (starts with 'IP_')
-            dstIPs = parseCIDR(destination)
-        else:  # It's a list of IPs (starts with 'IP_')
-            dstIPs = parseIPList(destination)
-        
-        ruleIPs.append({"id": rule.id, "source": sourceIPs, "destination": dstIPs, "service": rule.service})
-    
-    return ruleIPs
 
+def parseRuleIP(rule_id, seq, source, destination, service):
+    return {"id": rule_id, "seq": seq, "source": parseRuleAddress(source), "destination": parseRuleAddress(destination), "service": service}
 
 
-def analyze(rules, analyses, complianceObjects, fw_id, db):
-    ruleIPs = parseRuleIPs(rules)
+def parseRuleIPs(rules):
+    return [parseRuleIP(rule.id, rule.seq, rule.source, rule.destination, rule.service) for rule in rules]
 
-    types = RuleTypes()
 
-    analyzeQuery = db.query(Analyze).filter(Analyze.fw_id == fw_id)
 
-    for rule in rules:
-        # THIS IS BETTER FOR SMALLER DATASETS
-        # ruleAnalysesPorts = list(filter(lambda r : r.rulebase_id == rule.id and r.ctype == 0, analyses))
+class CompliancePortIndex:
+    """
+    Compliance port ranges partitioned by type ("wn", "vi", "mn"), merged and
+    sorted once per run so a rule's ports are checked with a binary search.
+    """
 
-        # ruleAnalysesSource = list(filter(lambda r : r.rulebase_id == rule.id and r.ctype == 2, analyses))
-        # ruleAnalysesDest = list(filter(lambda r : r.rulebase_id == rule.id and r.ctype == 3, analyses))
+    def __init__(self, complianceObjects):
+        ranges = defaultdict(list)
+        for obj in complianceObjects:
+            if obj.start_object is None or obj.end_object is None:
+                continue
+            ranges[obj.type].append((obj.start_object, obj.end_object))
 
-        # OPTIMIZING FOR LARGER DATASETS
-        analyzeQuery = db.query(Analyze).filter(Analyze.fw_id == fw_id)
+        self.starts = {}
+        self.ends = {}
+        for type, intervals in ranges.items():
+            merged = merge_intervals(intervals)
+            self.starts[type] = [start for start, _ in merged]
+            self.ends[type] = [end for _, end in merged]
 
-        ruleAnalysesPorts = analyzeQuery.filter(Analyze.rulebase_id == rule.id and Analyze.ctype == 0).all()
-        ruleAnalysesSource = analyzeQuery.filter(Analyze.rulebase_id == rule.id and Analyze.ctype == 2).all()
-        ruleAnalysesDest = analyzeQuery.filter(Analyze.rulebase_id == rule.id and Analyze.ctype == 3).all()
+    def has(self, type):
+        return type in self.starts
+
+    def overlaps(self, type, start, end):
+        starts = self.starts.get(type)
+        if not starts:
+            return False
 
-        ruleSources = sorted([(a.start_object, a.end_object) for a in ruleAnalysesSource])
-        ruleDests = sorted([(a.start_object, a.end_object) for a in ruleAnalysesDest])
+        # The last merged range starting at or before end is the only candidate,
+        # every earlier range ends before it starts
+        idx = bisect_right(starts, end) - 1
+        return idx >= 0 and self.ends[type][idx] >= start
 
-        # EXPIRED RULE
-        if check_expired(rule):
-            types.expired.add(rule.id) 
 
-        # PERMANENT
-        if check_permanent(rule):
-            types.permanent.add(rule.id) 
+def index_analyses(analyses):
+    # Groups argos_analyze rows by (rulebase_id, ctype) so each rule is a dict lookup
+    index = defaultdict(list)
+    for analysis in analyses:
+        index[(analysis.rulebase_id, analysis.ctype)].append(analysis)
 
-        # UNUSED OBJECTS
-        if check_unused_objects(db, fw_id, rule.id):
-            types.unused_objects.add(rule.id)
+    return index
 
-        # DST_EXCESSIVEOPEN
-        if check_dst_excessiveopen(rule):
-            types.dst_excessiveopen.add(rule.id) 
 
-        # PORT_EXCESSIVEOPEN
-        if check_port_excessiveopen(rule, ruleAnalysesPorts):
-            types.port_excessiveopen.add(rule.id) 
-        
-        # KNOWNPORTOPEN
-        if check_portopen(rule, list(filter(lambda a : a.type == "wn", complianceObjects)), ruleAnalysesPorts):
-            types.knownportopen.add(rule.id) 
-        
-        # VIRUSPORTOPEN
-        if check_portopen(rule, list(filter(lambda a : a.type == "vi", complianceObjects)), ruleAnalysesPorts):
-            types.virusportopen.add(rule.id) 
-        
-        # MGMTPORTOPEN 
-        if check_portopen(rule, list(filter(lambda a : a.type == "mn", complianceObjects)), ruleAnalysesPorts):
-            types.mgmtportopen.add(rule.id) 
-        
-        # SRC_ANYOPEN 
-        if check_src_anyopen(rule, ruleSources):
-            types.src_anyopen.add(rule.id) 
-        
-        # DST_ANYOPEN 
-        if check_dst_anyopen(rule, ruleDests):
-            types.dst_anyopen.add(rule.id) 
-        
-        # NOEVIDENCE 
-        if check_noevidence(rule):
-            types.noevidence.add(rule.id) 
-        
-        # COMPLIANCECHECK 
-        if check_compliancecheck(rule):
-            types.compliancecheck.add(rule.id) 
-        
-        # DISABLED 
-        if check_disabled(rule):
-            types.disabled.add(rule.id) 
+# Bump when a check changes, so incremental runs do not reuse stale results
+ANALYSIS_VERSION = 1
 
-        # INVALID 
-        if check_invalid(rule):
-            types.invalid.add(rule.id) 
+# Rule fields that feed the checks; a change to any of them re-evaluates the rule
+STAMP_FIELDS = ("source", "destination", "service", "seq", "action", "expire", "comment", "apply_id", "rivision", "from_ip", "to_ip", "deleted", "sync", "ts")
 
-        # MANUAL 
-        if check_manual(rule):
-            types.manual.add(rule.id) 
+# Types recomputed for every rule on every run: they depend on the date or on the syslog
+FIREWALL_TYPES = ("expired", "unused", "greater30days", "unused_objects")
 
-    # UNUSED RULES AND OBJECTS
-    types.unused.update(retrieve_unused(db, fw_id))
+# Types that depend on other rules
+PAIRWISE_TYPES = ("redundant", "shadow", "partial_shadow")
 
-    types.unused_objects.update(retrieve_unused_objects(db, fw_id))
 
+def rule_stamps(rules, analyses):
+    """
+    Returns {rule id as str: digest} over every rule field and argos_analyze
+    row the checks read, used to find the rules changed since a report.
+    """
+    analysisIndex = defaultdict(list)
+    for analysis in analyses:
+        analysisIndex[analysis.rulebase_id].append((analysis.ctype, analysis.start_object, analysis.end_object))
 
-    seenRules = {}
+    stamps = {}
+    for rule in rules:
+        digest = hashlib.blake2b(digest_size=12)
+        digest.update(repr(tuple(getattr(rule, field) for field in STAMP_FIELDS)).encode())
+        digest.update(repr(sorted(analysisIndex.get(rule.id, []))).encode())
+        stamps[str(rule.id)] = digest.hexdigest()
+
+    return stamps
+
+
+def analysis_stamp(complianceObjects):
+    # Per-rule results can only be reused while the checks and compliance ranges are unchanged
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(str(ANALYSIS_VERSION).encode())
+    digest.update(repr(sorted((obj.type, obj.start_object, obj.end_object) for obj in complianceObjects)).encode())
+    return digest.hexdigest()
+
+
+class PreviousAnalysis:
+    """
+    Results of the previous report that an incremental run may reuse:
+    its rule -> types index, the ids of rules added or changed since, and
+    the stored versions (id, source, destination, service) of rules that
+    were changed or removed.
+    """
+
+    def __init__(self, ruleTypes, changed, oldRules):
+        self.ruleTypes = ruleTypes
+        self.changed = changed
+        self.oldRules = oldRules
+
+    def reuse(self, types, rule_id, typeNames):
+        for type_name in self.ruleTypes.get(str(rule_id), []):
+            if type_name in typeNames:
+                getattr(types, type_name).add(rule_id)
+
+
+def check_shadow_incremental(ruleIPs, previous):
+    """
+    Re-classifies only the rules whose shadow status can have changed: the
+    changed rules themselves (as shadowed rules) and every rule overlapping
+    a changed rule's new or old version (as shadowing rules). Everything
+    else keeps its previous result.
+    """
+    index = ShadowIndex(ruleIPs)
+    positions = {rule["id"]: idx for idx, rule in enumerate(ruleIPs)}
+
+    affected = {positions[rule_id] for rule_id in previous.changed if rule_id in positions}
+    for rule_id in previous.changed:
+        if rule_id in positions:
+            affected.update(index.overlapping(ruleIPs[positions[rule_id]]))
+    for old in previous.oldRules:
+        affected.update(index.overlapping(parseRuleIP(old["id"], None, old["source"], old["destination"], old["service"])))
+
+    shadow, partial = set(), set()
     for idx, rule in enumerate(ruleIPs):
-        # REDUNDANT
-        check_redundant(rule, seenRules, types.redundant)
+        if idx not in affected:
+            previousTypes = previous.ruleTypes.get(str(rule["id"]), [])
+            if "shadow" in previousTypes:
+                shadow.add(rule["id"])
+            elif "partial_shadow" in previousTypes:
+                partial.add(rule["id"])
+            continue
 
-        # SHADOW
-        if check_shadow(ruleIPs, idx):
-            types.shadow.add(rule["id"]) 
-    
+        result = index.classify(idx)
+        if result == SHADOW:
+            shadow.add(rule["id"])
+        elif result == PARTIAL_SHADOW:
+            partial.add(rule["id"])
 
-    return types
+    return shadow, partial
 
 
+def analyze(rules, analyses, complianceObjects, fw_id, db, previous=None):
+    """
+    Runs every check over the rulebase. With a PreviousAnalysis only the
+    changed rules go through the per-rule checks, shadowing is re-evaluated
+    around the changed rules, and the remaining results are reused. The
+    scalar checks (rule_columns) are cheap enough to always run in full.
+    """
+    with stage("index_rules"):
+        ruleIPs = parseRuleIPs(rules)
+        analysisIndex = index_analyses(analyses)
+        compliancePorts = CompliancePortIndex(complianceObjects)
 
+    types = RuleTypes()
 
-def retrieve_unused_objects(db, fw_id):
-    # Query to transform the SysLog "service" column into separate protocol and port columns 
-    syslogs = db.query(
-        SysLog.id,
-        SysLog.policyid,
-        SysLog.srcip,
-        SysLog.dstip,
-        case(
-            (SysLog.service.like('tcp/%') | SysLog.service.like('udp/%'), func.substr(SysLog.service, 1, func.position(literal('/').op('IN')(SysLog.service)) - 1)),  # Extract protocol
-            else_=Service.protocol
-        ).label('protocol'),
-        
-        case(
-            (SysLog.service.like('tcp/%') | SysLog.service.like('udp/%'), cast(func.substr(SysLog.service, func.position(literal('/').op('IN')(SysLog.service)) + 1, 5), Integer)),  # Extract port
-            else_=SysLog.dstport
-        ).label('port'),
-    ).outerjoin(
-        Service, SysLog.service == Service.name  # Outer join if the service name matches a service
-    ).subquery()
-
-    syslog_alias = aliased(syslogs, name='syslog_alias')
-    existenceSubquery = db.query(syslog_alias.c.policyid).filter(
-        and_(
-            cast(Analyze.rulebase_id, String) == syslog_alias.c.policyid,
-            or_(
-                # For rules that deal with ports/protocols (ctype 0 and 1)
-                and_(
-
-                    Analyze.ctype.in_([0, 1]),  # Type 0 or 1: ports and protocols
-                    or_(
-                        and_(
-                            Analyze.ctype == 0,
-                            syslog_alias.c.protocol == 'tcp'
-                        ),
-                        and_(
-                            Analyze.ctype == 1,
-                            syslog_alias.c.protocol == 'udp'
-                        )
-                    ),
-                    # checks if syslog port is in range
-                    syslog_alias.c.port.between(Analyze.start_object, Analyze.end_object)
-
-                ),
-                # For rules that deal with source IP addresses (ctype 2)
-                and_(
-                    Analyze.ctype == 2,  # Type 2: Source IP address
-                    # syslog_alias.c.srcip.between(Analyze.start_object, Analyze.end_object)
-                    func.cast(func.inet(syslog_alias.c.srcip) - func.inet(literal("0.0.0.0")), Integer).between(Analyze.start_object, Analyze.end_object)
-                ),
-                # For rules that deal with destination IP addresses (ctype 3)
-                and_(
-                    Analyze.ctype == 3,  # Type 3: Destination IP address
-                    # Destination IP range match (ctype 3)
-                    # syslog_alias.c.dstip.between(Analyze.start_object, Analyze.end_object),
-                    func.cast(func.inet(syslog_alias.c.dstip) - func.inet(literal("0.0.0.0")), Integer).between(Analyze.start_object, Analyze.end_object)
-                )
-            )
-        )
-    ).exists()
-
-
-    analysisQuery = db.query(Analyze.rulebase_id).outerjoin(syslog_alias, 
-        and_(
-            cast(Analyze.rulebase_id, String) == syslog_alias.c.policyid,
-            or_(
-                # For rules that deal with ports/protocols (ctype 0 and 1)
-                and_(
-
-                    Analyze.ctype.in_([0, 1]),  # Type 0 or 1: ports and protocols
-                    or_(
-                        and_(
-                            Analyze.ctype == 0,
-                            syslog_alias.c.protocol == 'tcp'
-                        ),
-                        and_(
-                            Analyze.ctype == 1,
-                            syslog_alias.c.protocol == 'udp'
-                        )
-                    ),
-                    # Checks if syslog port is in range
-                    syslog_alias.c.port.between(Analyze.start_object, Analyze.end_object)
-    
-                ),
-                # For rules that deal with source IP addresses (ctype 2)
-                and_(
-                    Analyze.ctype == 2,  # Type 2: Source IP address
-                    syslog_alias.c.srcip.between(Analyze.start_object, Analyze.end_object)
-                ),
-                # For rules that deal with destination IP addresses (ctype 3)
-                and_(
-                    Analyze.ctype == 3,  # Type 3: Destination IP address
-                    syslog_alias.c.dstip.between(Analyze.start_object, Analyze.end_object),
-                )
-            )
-        )
-    ).filter(and_(Analyze.fw_id == fw_id, syslog_alias.c.id == None)).distinct()
-
-    # Uses exists() for short circuit evaluation
-    optimizedAnalysis = db.query(Analyze.rulebase_id).filter(
-        and_(
-            Analyze.fw_id == fw_id,
-            ~existenceSubquery
-        )
-    ).distinct().all()
-
-    return [analysis.rulebase_id for analysis in optimizedAnalysis]
-
-
-
-
-
-# TODO: check rivions=0 rule for all of these
-def parse_expiration(expiration):
-    date_str = expiration[3:]  # Extract YYYYMMDD
-    return datetime.strptime(date_str, "%Y%m%d")
-
-def check_expired(rule):
-    if rule.expire and parse_expiration(rule.expire) < datetime.now():
-        return True
+    ruleTypeNames = set(vars(types)) - set(FIREWALL_TYPES) - set(PAIRWISE_TYPES) - set(SCALAR_TYPES)
 
-    return False
+    # EXPIRED, PERMANENT, DST_EXCESSIVEOPEN, NOEVIDENCE, DISABLED, MANUAL
+    # and the "any" source/destination half of SRC_ANYOPEN/DST_ANYOPEN
+    with stage("scalar_checks"):
+        scalar = RuleColumns(rules).evaluate()
+        for type_name in SCALAR_TYPES:
+            getattr(types, type_name).update(scalar[type_name])
+        sourceAny, destAny = scalar["src_anyopen"], scalar["dst_anyopen"]
 
+    with stage("checks"):
+        checked = []
+        for rule in rules:
+            if previous is not None and rule.id not in previous.changed:
+                previous.reuse(types, rule.id, ruleTypeNames)
+                continue
 
-def check_permanent(rule): 
-    permanentDate = datetime(9999, 1, 1, 0, 0)
-    if rule.expire and parse_expiration(rule.expire) >= permanentDate:
-        return True
+            ruleAnalysesPorts = analysisIndex.get((rule.id, 0), [])
+            ruleSources = sorted([(a.start_object, a.end_object) for a in analysisIndex.get((rule.id, 2), [])])
+            ruleDests = sorted([(a.start_object, a.end_object) for a in analysisIndex.get((rule.id, 3), [])])
+            checked.append((rule, ruleAnalysesPorts, ruleSources, ruleDests))
 
-    return False
+        # One pass per check over the rules, each timed as a whole
+        count = len(checked)
 
+        # PORT_EXCESSIVEOPEN
+        with check("check_port_excessiveopen", count):
+            types.port_excessiveopen.update(rule.id for rule, ports, _, _ in checked if check_port_excessiveopen(rule, ports))
 
-def check_redundant(rule, seenRules, dupRulesIds):
-    ruleTuple = (tuple(sorted(rule["source"])), tuple(sorted(rule["destination"])), rule["service"])
-    
-    if ruleTuple in seenRules:
-        dupRulesIds.add(seenRules[ruleTuple])
-        dupRulesIds.add(rule["id"])
-    else:
-        seenRules[ruleTuple] = rule["id"]
+        # KNOWNPORTOPEN, VIRUSPORTOPEN, MGMTPORTOPEN
+        with check("check_portopen", 3 * count):
+            types.knownportopen.update(rule.id for rule, ports, _, _ in checked if check_portopen(rule, compliancePorts, "wn", ports))
+            types.virusportopen.update(rule.id for rule, ports, _, _ in checked if check_portopen(rule, compliancePorts, "vi", ports))
+            types.mgmtportopen.update(rule.id for rule, ports, _, _ in checked if check_portopen(rule, compliancePorts, "mn", ports))
 
+        # SRC_ANYOPEN
+        with check("check_src_anyopen", count):
+            types.src_anyopen.update(rule.id for rule, _, sources, _ in checked if rule.id in sourceAny or check_src_anyopen(rule, sources))
 
+        # DST_ANYOPEN
+        with check("check_dst_anyopen", count):
+            types.dst_anyopen.update(rule.id for rule, _, _, dests in checked if rule.id in destAny or check_dst_anyopen(rule, dests))
 
+        # COMPLIANCECHECK
+        with check("check_compliancecheck", count):
+            types.compliancecheck.update(rule.id for rule, _, _, _ in checked if check_compliancecheck(rule))
 
+        # INVALID
+        with check("check_invalid", count):
+            types.invalid.update(rule.id for rule, _, _, _ in checked if check_invalid(rule))
 
-def check_shadow(ruleIPs, idx):
-    rule = ruleIPs[idx]
-    ruleService = rule["service"]
-    ruleSource = rule["source"]
-    ruleDestination = rule["destination"]
-    for i in range(len(ruleIPs)):
-        if i == idx:
-            continue
-
-        existingRule = ruleIPs[i]
-        existingService = existingRule["service"]
-        existingSource = existingRule["source"]
-        existingDestination = existingRule["destination"]
+    # UNUSED RULES AND OBJECTS
+    with stage("retrieve_unused"):
+        types.unused.update(retrieve_unused(db, fw_id))
+    with stage("retrieve_idle"):
+        types.greater30days.update(retrieve_idle(db, fw_id, days=30))
+
+    with stage("retrieve_unused_objects"):
+        types.unused_objects.update(retrieve_unused_objects(db, fw_id))
+
+
+    # Redundancy is a single fingerprint pass, so it is always recomputed in full
+    with stage("redundant"):
+        seenRules = {}
+        for rule in ruleIPs:
+            # REDUNDANT
+            check_redundant(rule, seenRules, types.redundant)
+
+    # SHADOW AND PARTIAL SHADOW
+    with stage("shadow"):
+        if previous is not None:
+            shadowIds, partialShadowIds = check_shadow_incremental(ruleIPs, previous)
+        else:
+            shadowIds, partialShadowIds = check_shadow(ruleIPs)
+    types.shadow.update(shadowIds)
+    types.partial_shadow.update(partialShadowIds)
     
-        if ruleService == existingService and ruleSource.issubset(existingSource) and ruleDestination.issubset(existingDestination):
-            return True
 
-    return False
+    return types
 
 
-def retrieve_unused(db, fw_id):
-    unusedRulesQuery = db.query(Rule.id).outerjoin(SysLog, cast(Rule.id, String) == SysLog.policyid).filter(Rule.fw_id == fw_id).filter(SysLog.id == None).all()
-    return [unusedRule.id for unusedRule in unusedRulesQuery]
 
 
+def rule_fingerprint(rule):
+    # Compact, stable key for a parsed rule's source, destination and service
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(rule["source"].fingerprint())
+    digest.update(rule["destination"].fingerprint())
+    digest.update((rule["service"] or "").encode())
+    return digest.digest()
 
-def check_unused_objects(db, fw_id, rule_id):
-    portAnalysis = db.query(Analyze).filter(Analyze.fw_id == fw_id)
 
+def check_redundant(rule, seenRules, dupRulesIds):
+    # seenRules maps a fingerprint to the first rule seen for each distinct
+    # (source, destination, service); full comparison only on a hash collision
+    candidates = seenRules.setdefault(rule_fingerprint(rule), [])
 
-def check_dst_excessiveopen(rule):
-    if rule.service == "any":
-            return True
+    for seen in candidates:
+        if seen["service"] == rule["service"] and seen["source"] == rule["source"] and seen["destination"] == rule["destination"]:
+            dupRulesIds.add(seen["id"])
+            dupRulesIds.add(rule["id"])
+            return
+
+    candidates.append(rule)
 
-    return False
+
+
+
+
+def check_shadow(ruleIPs):
+    # Returns (shadowed rule ids, partially shadowed rule ids), honouring rule order
+    return find_shadows(ruleIPs)
 
 
 def check_port_excessiveopen(rule, analyses):
@@ -492,18 +479,13 @@ def check_port_excessiveopen(rule, analyses):
     return False
 
 
-def check_portopen(rule, complianceObjects, analyses):
-    if complianceObjects and rule.service == "any":
+def check_portopen(rule, compliancePorts, type, analyses):
+    if compliancePorts.has(type) and rule.service == "any":
         return True
 
-    for obj in complianceObjects:
-        start, end = obj.start_object, obj.end_object
-
-        for analysis in analyses:
-            aStart, aEnd = analysis.start_object, analysis.end_object
-
-            if start <= aEnd and aStart <= end:
-                return True
+    for analysis in analyses:
+        if compliancePorts.overlaps(type, analysis.start_object, analysis.end_object):
+            return True
             
     return False
 
@@ -546,13 +528,6 @@ def check_dst_anyopen(rule, dests):
     return True if currStart >= 4294836225 else 0
 
 
-def check_noevidence(rule):
-    if not rule.comment.strip():
-        return True
-
-    return False
-
-
 def check_compliancecheck(rule):
     # need to clarify this and how a rule can be identified as a compliance rule
     # or not
@@ -560,24 +535,7 @@ def check_compliancecheck(rule):
     return False
 
 
-def check_disabled(rule):
-    # check possible other conditions for what constitutes a disabled rule
-
-    if not rule.apply_id:
-        return True
-
-    return False
-
-
 def check_invalid(rule):
     # need to clarify what constitutes a invalid rule
 
     return False
-
-
-def check_manual(rule):
-    if rule.rivision == -1:
-        return True
-
-    return False
-
@@ -4,16 +4,25 @@ import os
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Report')))
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 from sqlalchemy import func
 import models
 from datetime import timedelta,datetime
-from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Side, Border, Alignment
-from io import BytesIO
+from openpyxl.styles import Side, Border
 from typing import Union
+from collections import namedtuple
 import check_rulebase
+import policy_hits
+import xlsx_stream
+import report_store
+import cache
+import stage_metrics
+from stage_metrics import stage
+
+
+ComplianceRange = namedtuple("ComplianceRange", ["type", "start_object", "end_object"])
+FirewallEntry = namedtuple("FirewallEntry", ["id", "name", "fw_name"])
 
 
 # openpyxl border styles
@@ -53,7 +62,26 @@ def get_firewalls(db: Session, fw_ids: Union[list[int], None], skip: int = 0, li
         return db.query(models.Firewall).filter(models.Firewall.id.in_(fw_ids)).all()
 
     return db.query(models.Firewall).all()
-        
+
+
+def get_firewall_directory(db: Session) -> dict:
+    # {fw_id: FirewallEntry}, cached; credentials are left out on purpose
+    return cache.firewalls.get(lambda: {
+        fw.id: FirewallEntry(fw.id, fw.name, fw.fw_name)
+        for fw in db.query(models.Firewall.id, models.Firewall.name, models.Firewall.fw_name)
+    }, db)
+
+
+def get_firewall_entry(db: Session, firewall_id: int) -> FirewallEntry:
+    entry = get_firewall_directory(db).get(firewall_id)
+    if entry is None:
+        # The firewall may have been added since the directory was cached
+        cache.invalidate("firewalls")
+        entry = get_firewall_directory(db).get(firewall_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Firewall with id {firewall_id} not found")
+    return entry
+
 
 def get_rule(db: Session, rule_id: int):
     return db.query(models.Rule).filter(models.Rule.id == rule_id).first()
@@ -67,37 +95,81 @@ def get_log(db: Session, log_id: int):
 def get_weights(db: Session):
     return db.query(models.Weights).first()
 
+def get_weights_dict(db: Session):
+    # Cached copy of the weights row, invalidated by update_weights
+    def load():
+        weights = get_weights(db)
+        return weights.to_dict() if weights else None
+    return cache.weights.get(load, db)
+
 def get_report(db: Session, report_id: int, type: str):
     report = db.query(models.Report).filter(models.Report.id == report_id).first()
     if not report:
         raise HTTPException(status_code=404, detail=f"Report with id {report_id} not found")
     
-    data = report.jsondata
+    data = report_store.load(db, report)
 
     if not report: 
         return None
 
-    if type == "security":
-        return data
-    elif type == "individual":
-        rules = []
-        for rule in data["rules"]:
-            rule_types = []
-            for type_name, rule_ids in data["types"].items():
-                if rule["id"] in rule_ids:
-                    rule_types.append(type_name)
-            
-            rules.append({ **rule, "types": rule_types })
+    return report_view(data, type)
 
 
+# Keys of the security report (schemas.SecurityReport); ruleStamps, analysisStamp
+# and ruleTypes are internal to incremental analysis and never leave the service
+SECURITY_KEYS = ("fw_name", "rules", "types", "scores")
+
+
+def report_view(data: dict, type: str):
+    # Shapes stored report data for the security or individual endpoint
+    if type == "security":
+        return {key: data.get(key) for key in SECURITY_KEYS} if data is not None else None
+    elif type == "individual":
         return {
             "fw_name": data["fw_name"],
-            "rules": rules
+            "rules": list(iter_individual_rules(data))
         }
 
 
+def iter_individual_rules(data):
+    # Rules of the individual view in stored order, built one at a time;
+    # columnar reports rebuild them from their columns as they go
+    ruleTypes = get_rule_types(data)
+    rules = data.iter_rules() if hasattr(data, "iter_rules") else data["rules"]
+    for rule in rules:
+        yield { **rule, "types": ruleTypes.get(str(rule["id"]), []) }
+
+
+
 
 
+def get_report_meta(db: Session, report_id: int):
+    # Cheap lookup for conditional requests, jsondata is not loaded
+    meta = db.query(models.Report.id, models.Report.update_ts).filter(models.Report.id == report_id).first()
+    if not meta:
+        raise HTTPException(status_code=404, detail=f"Report with id {report_id} not found")
+    return meta
+
+
+def get_report_history_meta(db: Session, fw_id: int):
+    return (
+        db.query(
+            func.count(models.Report.id).label("count"),
+            func.max(models.Report.id).label("last_id"),
+            func.max(models.Report.update_ts).label("update_ts"),
+        )
+        .filter(models.Report.fw_id == fw_id)
+        .one()
+    )
+
+
+def get_rule_types(data: dict) -> dict:
+    # Reports stored before the ruleTypes index existed are inverted on the fly
+    ruleTypes = data.get("ruleTypes")
+    if ruleTypes is None:
+        ruleTypes = check_rulebase.invert_rule_types(data["types"])
+    return ruleTypes
+
 
 def get_report_history(db: Session, fw_id: int):
     reports = (
@@ -115,7 +187,7 @@ def get_report_history(db: Session, fw_id: int):
         for report in reports
     ]
 
-def get_most_recent_reports(db: Session, fw_ids: Union[list[int], None] = None):
+def get_most_recent_reports(db: Session, fw_ids: Union[list[int], None] = None, with_data: bool = True):
     subquery_query = db.query(
         models.Report.fw_id,
         func.max(models.Report.update_ts).label("latest_ts")
@@ -126,26 +198,35 @@ def get_most_recent_reports(db: Session, fw_ids: Union[list[int], None] = None):
 
     subquery = subquery_query.group_by(models.Report.fw_id).subquery()
 
-    results = (
-        db.query(models.Report)
-        .join(subquery, (models.Report.fw_id == subquery.c.fw_id) & (models.Report.update_ts == subquery.c.latest_ts))
-        .all()
-    )
+    query = db.query(models.Report).join(subquery, (models.Report.fw_id == subquery.c.fw_id) & (models.Report.update_ts == subquery.c.latest_ts))
+
+    if not with_data:
+        query = query.options(defer(models.Report.jsondata), defer(models.Report.payload))
+
+    results = query.all()
 
     return results
 
 def get_reports(argos_db: Session, report_db: Session, fw_ids: Union[list[int], None] = None):
-    latest_reports = get_most_recent_reports(report_db, fw_ids)
+    latest_reports = get_most_recent_reports(report_db, fw_ids, with_data=False)
 
-    all_report_fw_ids = (
-        report_db.query(models.Report.fw_id, models.Report.jsondata)
+    all_report_fw_names = (
+        report_db.query(models.Report.id, models.Report.fw_id, models.Report.fw_name)
         .distinct(models.Report.fw_id)
+        .order_by(models.Report.fw_id, models.Report.update_ts.desc())
         .all()
     )
 
+    # Reports stored before the summary columns existed, until backfill_report_summaries has run
+    names = {row.id: row.fw_name for row in [*latest_reports, *all_report_fw_names]}
+    typeCounts = {report.id: report.type_counts for report in latest_reports}
+    for report_id in [report_id for report_id, name in names.items() if name is None]:
+        summary = legacy_summary(report_db, report_id)
+        names[report_id], typeCounts[report_id] = summary["fw_name"], summary["type_counts"]
+
     id_to_name = {
-        fw_id: jsondata["fw_name"]
-        for fw_id, jsondata in all_report_fw_ids
+        row.fw_id: names[row.id]
+        for row in all_report_fw_names
     }
 
     return {
@@ -154,8 +235,8 @@ def get_reports(argos_db: Session, report_db: Session, fw_ids: Union[list[int],
             report.fw_id: {
                 # "update_ts": report.update_ts.isoformat() if report.update_ts else None,
                 "reportId": report.id,
-                "fwName": report.jsondata["fw_name"],
-                **{k: len(v) for k, v in report.jsondata["types"].items()},
+                "fwName": names[report.id],
+                **(typeCounts[report.id] or {}),
             }
             for report in latest_reports
         }
@@ -164,56 +245,176 @@ def get_reports(argos_db: Session, report_db: Session, fw_ids: Union[list[int],
 
 
 
-def analyze_rules(db: Session, fw_id: int):
-    rules = db.query(models.Rule).filter(models.Rule.fw_id == fw_id).all()
-    analyses = db.query(models.Analyze).filter(models.Analyze.fw_id == fw_id).all()
-    complianceObjects = db.query(models.ComplianceObject).filter(models.ComplianceObject.type == "wn" or models.ComplianceObject.type == "vi" or models.ComplianceObject.type == "mn").all()
+def get_compliance_objects(db: Session):
+    return cache.compliance_objects.get(lambda: load_compliance_objects(db), db)
 
-    return check_rulebase.analyze(rules, analyses, complianceObjects, fw_id, db)
 
+def load_compliance_objects(db: Session):
+    # Plain tuples so the ranges can be shared with report job worker processes
+    return [
+        ComplianceRange(obj.type, obj.start_object, obj.end_object)
+        for obj in db.query(models.ComplianceObject.type, models.ComplianceObject.start_object, models.ComplianceObject.end_object)
+                     .filter(models.ComplianceObject.type.in_(["wn", "vi", "mn"]))
+    ]
 
-    # return(schemas.RuleAnalysis(fw_id='1', rules_count={}))    
 
-def generate_report(argos_db: Session, report_db: Session, firewall_id: int):
-    rules = get_rules(argos_db, firewall_id)
-    ruleAnalysis = analyze_rules(argos_db, firewall_id)
+def get_analyses(db: Session, fw_id: int):
+    return db.query(models.Analyze).filter(models.Analyze.fw_id == fw_id).all()
 
-    weights = get_weights(report_db)
 
-    individualReport = { "fw_name": get_firewall(argos_db, firewall_id).name }
-    analyzedRules = []
+def analyze_rules(db: Session, fw_id: int, rules: Union[list, None] = None, complianceObjects: Union[list, None] = None, analyses: Union[list, None] = None, previous: Union[check_rulebase.PreviousAnalysis, None] = None):
+    # The rollup refresh commits, which expires every loaded rule and analysis
+    # row; callers passing their own rules must refresh before loading them
+    if rules is None:
+        with stage("refresh_policy_hits"):
+            policy_hits.refresh_policy_hits(db)
+        rules = get_rules(db, fw_id)
+    if analyses is None:
+        analyses = get_analyses(db, fw_id)
+    if complianceObjects is None:
+        complianceObjects = get_compliance_objects(db)
 
-    for rule in rules:  # Start from row 2, as row 1 is for headers
-        newRule = {}
-        newRule["id"] = rule.id
-        newRule["action"] = rule.action
-        newRule["source"] = rule.source
-        newRule["from_ip"] = rule.from_ip
-        newRule["destination"] = rule.destination
-        newRule["to_ip"] = rule.to_ip
-        newRule["service"] = rule.service
-        newRule["expire"] = rule.expire
-        newRule["comment"] = rule.comment
+    return check_rulebase.analyze(rules, analyses, complianceObjects, fw_id, db, previous=previous)
+
+
+def get_previous_analysis(report_db: Session, firewall_id: int, stamps: dict, analysisStamp: str):
+    # Diffs the rulebase against the latest report; None when its results cannot be reused
+    latest = (
+        report_db.query(models.Report.id)
+        .filter(models.Report.fw_id == firewall_id)
+        .order_by(models.Report.update_ts.desc(), models.Report.id.desc())
+        .first()
+    )
+    if latest is None:
+        return None
+
+    data = report_store.load_report_data(report_db, latest.id)
+    if not data or "ruleStamps" not in data or data.get("analysisStamp") != analysisStamp:
+        return None
+
+    oldStamps = data["ruleStamps"]
+    changed = {int(rule_id) for rule_id, stamp in stamps.items() if oldStamps.get(rule_id) != stamp}
+    oldRules = [rule for rule in data["rules"] if oldStamps.get(str(rule["id"])) != stamps.get(str(rule["id"]))]
+
+    return check_rulebase.PreviousAnalysis(get_rule_types(data), changed, oldRules)
+
+
+    # return(schemas.RuleAnalysis(fw_id='1', rules_count={}))    
+
+def generate_report(argos_db: Session, report_db: Session, firewall_id: int, complianceObjects: Union[list, None] = None, weights: Union[dict, None] = None, incremental: bool = False, refresh: bool = True):
+    # complianceObjects and weights may be loaded once by the caller for a fleet-wide run,
+    # which also refreshes the policy hit rollup once and passes refresh=False
+    # Stage timings go to the stage_metrics recorder active for the run, if any
+    if refresh:
+        with stage("refresh_policy_hits"):
+            policy_hits.refresh_policy_hits(argos_db)
+
+    with stage("load_rules"):
+        rules = get_rules(argos_db, firewall_id)
+        analyses = get_analyses(argos_db, firewall_id)
+        if complianceObjects is None:
+            complianceObjects = get_compliance_objects(argos_db)
+
+    with stage("previous_analysis"):
+        stamps = check_rulebase.rule_stamps(rules, analyses)
+        analysisStamp = check_rulebase.analysis_stamp(complianceObjects)
+        previous = get_previous_analysis(report_db, firewall_id, stamps, analysisStamp) if incremental else None
+
+    ruleAnalysis = analyze_rules(argos_db, firewall_id, rules=rules, complianceObjects=complianceObjects, analyses=analyses, previous=previous)
+
+    with stage("build_report"):
+        if weights is None:
+            weights = get_weights_dict(report_db)
+
+        individualReport = { "fw_name": get_firewall_entry(argos_db, firewall_id).name }
+        analyzedRules = []
+
+        for rule in rules:  # Start from row 2, as row 1 is for headers
+            newRule = {}
+            newRule["id"] = rule.id
+            newRule["action"] = rule.action
+            newRule["source"] = rule.source
+            newRule["from_ip"] = rule.from_ip
+            newRule["destination"] = rule.destination
+            newRule["to_ip"] = rule.to_ip
+            newRule["service"] = rule.service
+            newRule["expire"] = rule.expire
+            newRule["comment"] = rule.comment
+            
+            analyzedRules.append(newRule)
         
-        analyzedRules.append(newRule)
-    
-    individualReport["rules"] = analyzedRules
-    individualReport["types"] = ruleAnalysis.to_dict()
-    individualReport["scores"] = ruleAnalysis.category_scores(weights.to_dict(), len(rules))
+        individualReport["rules"] = analyzedRules
+        individualReport["types"] = ruleAnalysis.to_dict()
+        individualReport["ruleTypes"] = ruleAnalysis.rule_types()
+        individualReport["ruleStamps"] = stamps
+        individualReport["analysisStamp"] = analysisStamp
+        individualReport["scores"] = ruleAnalysis.category_scores(weights, len(rules))
 
     return individualReport
 
 
+def report_summary(report_data) -> dict:
+    # Values of the ag_report summary columns for a report's data
+    return {
+        "fw_name": report_data["fw_name"],
+        "rule_count": len(report_data["rules"]),
+        "type_counts": {k: len(v) for k, v in report_data["types"].items()},
+        "scores": report_data.get("scores"),
+    }
+
+
 def store_report(db: Session, report_data, firewall_id: int):
-    report = models.Report(
-        fw_id=firewall_id,
-        jsondata=report_data,
-    )
-    db.add(report)
+    with stage("store"):
+        report = models.Report(
+            fw_id=firewall_id,
+            **report_store.prepare(db, firewall_id, report_data),
+            **report_summary(report_data),
+        )
+        db.add(report)
+        db.flush()
+
+    recorder = stage_metrics.current()
+    if recorder is not None:
+        report.metrics = recorder.to_dict()
     db.commit()
 
     return report.id
 
+
+def legacy_summary(db: Session, report_id: int) -> dict:
+    # Summary of a report whose summary columns were never backfilled, read from its data
+    data = report_store.load_report_data(db, report_id)
+    return report_summary(data) if data else {"fw_name": None, "type_counts": None}
+
+
+def backfill_report_summaries(db: Session, batch_size: int = 100):
+    """
+    Fills the summary columns of reports stored before they existed. A one-off
+    job, see migrations.py; until it has run the read paths fall back to
+    legacy_summary for those rows.
+    """
+    backfilled = 0
+    while True:
+        ids = [
+            report_id for (report_id,) in
+            db.query(models.Report.id).filter(models.Report.fw_name == None).order_by(models.Report.id).limit(batch_size).all()
+        ]
+        if not ids:
+            return backfilled
+
+        for report_id in ids:
+            summary = legacy_summary(db, report_id)
+            # An empty name marks the row as done even when the firewall had none
+            summary["fw_name"] = summary.get("fw_name") or ""
+            db.query(models.Report).filter(models.Report.id == report_id).update(summary, synchronize_session=False)
+
+        db.commit()
+        backfilled += len(ids)
+
+def refresh_policy_hits(db: Session):
+    processed = policy_hits.refresh_policy_hits(db)
+    return {"processed": processed}
+
 def update_weights(db: Session, new_weights: dict):
     weights = db.query(models.Weights).first()
     if not weights:
@@ -224,12 +425,14 @@ def update_weights(db: Session, new_weights: dict):
         if hasattr(weights, key):
             setattr(weights, key, value)
 
+    # Committed with the weights, so no process can reload the old row under the new generation
+    cache.invalidate("weights", db)
     db.commit()
     return weights
 
 
 def get_reports_info(db: Session):
-    latest_reports = get_most_recent_reports(db)
+    latest_reports = get_most_recent_reports(db, with_data=False)
     return {
         report.fw_id: {
             "update_ts": report.update_ts.isoformat() if report.update_ts else None,
@@ -242,189 +445,128 @@ def get_reports_info(db: Session):
 
 
     
-def generate_report_file(report_db: Session, fw_ids: Union[list[int], None] = None):
-    # Fetch firewall data from the database
-    reports = get_most_recent_reports(report_db, fw_ids)
+# Layout of the Report Summary sheet, keyed by row
+SUMMARY_CATEGORIES = {4: "Period Management", 6: "Policy Utilization", 11: "Policy Scope", 14: "Service Safety", 17: "Security Compliance", 24: "Miscellaneous"}
+SUMMARY_DETAILS = {4: "Expired Rule", 5: "Permanent Rule", 6: "Redundant Rule", 7: "Shadow Rule", 8: "Partial Shadow Rule", 9: "Unused Rule", 10: "Unused Objects (Session-Based)", 11: "Src Excessive Open", 12: "Dst Excessive Open", 13: "Service Excessive Open", 14: "Well-Known Port Open", 15: "Virus Port Open", 16: "Mgmt Port Open", 17: "Src ANY Open", 18: "Dst ANY Open", 19: "Service ANY Open", 20: "No Hits >30 Days", 21: "NOEVIDENCE Rule", 22: "Compliance", 23: "Deny Rule", 24: "Check Longest Expiration Period", 25: "Check Most Recent Expiration Period", 26: "NORENEW Check Status", 27: "Check Status", 28: "Check Group-Specific Policy Registration", 29: "Check Composition", 30: "Inactive Rule", 31: "Invalid Rule", 32: "Manual Rule", 33: "Unregistered Rule", 34: "No Zone Rule"}
+SUMMARY_MERGES = ["A1:A3", "A4:A5", "A6:A10", "A11:A13", "A14:A16", "A17:A23", "A24:A34", "B1:B3"]
+
+ruletypeRows = {4: 'expired', 5: 'permanent', 6: 'redundant', 7: 'shadow', 8: 'partial_shadow', 9: 'unused', 10: 'unused_objects', 12: 'dst_excessiveopen', 13: 'port_excessiveopen', 14: 'knownportopen', 15: 'virusportopen', 16: 'mgmtportopen', 17: 'src_anyopen', 18: 'dst_anyopen', 20: 'greater30days', 21: 'noevidence', 22: 'compliancecheck', 30: 'disabled', 31: 'invalid', 32: 'manual'}
+ruletypeStrs = {'expired': 'Expired Rule', 'permanent': 'Permanent Rule', 'redundant': 'Redundant Rule', 'shadow': 'Shadow Rule', 'partial_shadow': 'Partial Shadow Rule', 'unused': 'Unused Rule', 'unused_objects': 'Unused Objects (Session-Based)', 'dst_excessiveopen': 'Dst Excessive Open', 'port_excessiveopen': 'Service Excessive Open', 'knownportopen': 'Well-Known Port Open', 'virusportopen': 'Virus Port Open', 'mgmtportopen': 'Mgmt Port Open', 'src_anyopen': 'Src ANY Open', 'dst_anyopen': 'Dst ANY Open', 'greater30days': 'No Hits >30 Days', 'noevidence': 'NOEVIDENCE Rule', 'compliancecheck': 'Compliance', 'disabled': 'Inactive Rule', 'invalid': 'Invalid Rule', 'manual': 'Manual Rule'}
+individualHeaders = ["Rule ID", "Rule Type", "Source IP", "Source Zone", "Destination IP", "Destination Zone", "Service", "Expiration", "Comment", "Report Details"]
+ruleFields = ["id", "action", "source", "from_ip", "destination", "to_ip", "service", "expire", "comment"]
+
+# Compressed bytes buffered before a chunk is sent to the client
+STREAM_CHUNK_SIZE = 64 * 1024
 
-    endCol = get_column_letter(3 + len(reports))
+
+def generate_report_file(report_db: Session, fw_ids: Union[list[int], None] = None):
+    # Only ids are loaded up front; each report's data is fetched when its sheet is written
+    reports = get_most_recent_reports(report_db, fw_ids, with_data=False)
 
     if not reports:
         raise Exception("No report data found")
         # raise HTTPException(status_code=404, detail="No firewall data found")
-    
-    # Create a new Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Report Summary"
 
-    
-    # Define headers for the Excel report
-    individualHeaders = ["Rule ID", "Rule Type", "Source IP", "Source Zone", "Destination IP", "Destination Zone", "Service", "Expiration", "Comment", "Report Details"]
-    
-    ruletypeRows = {4: 'expired', 5: 'permanent', 6: 'redundant', 7: 'shadow', 9: 'unused', 10: 'unused_objects', 12: 'dst_excessiveopen', 13: 'port_excessiveopen', 14: 'knownportopen', 15: 'virusportopen', 16: 'mgmtportopen', 17: 'src_anyopen', 18: 'dst_anyopen', 21: 'noevidence', 22: 'compliancecheck', 30: 'disabled', 31: 'invalid', 32: 'manual'}
-    ruletypeStrs = {'expired': 'Expired Rule', 'permanent': 'Permanent Rule', 'redundant': 'Redundant Rule', 'shadow': 'Shadow Rule', 'unused': 'Unused Rule', 'unused_objects': 'Unused Objects (Session-Based)', 'dst_excessiveopen': 'Dst Excessive Open', 'port_excessiveopen': 'Service Excessive Open', 'knownportopen': 'Well-Known Port Open', 'virusportopen': 'Virus Port Open', 'mgmtportopen': 'Mgmt Port Open', 'src_anyopen': 'Src ANY Open', 'dst_anyopen': 'Dst ANY Open', 'noevidence': 'NOEVIDENCE Rule', 'compliancecheck': 'Compliance', 'disabled': 'Inactive Rule', 'invalid': 'Invalid Rule', 'manual': 'Manual Rule'}
-    
-    alignment = Alignment(horizontal="center", vertical="center")
-    ws["A1"] = "Category"
-    ws["A4"] = "Period Management"
-    ws["A6"] = "Policy Utilization"
-    ws["A11"] = "Policy Scope"
-    ws["A14"] = "Service Safety"
-    ws["A17"] = "Security Compliance"
-    ws["A24"] = "Miscellaneous"
-    ws["B1"] = "Details"
-    ws["C1"] = "Number of Applicable Rules"
-    ws["A1"].alignment = alignment
-    ws["A4"].alignment = alignment
-    ws["A6"].alignment = alignment
-    ws["A11"].alignment = alignment
-    ws["A14"].alignment = alignment
-    ws["A17"].alignment = alignment
-    ws["A24"].alignment = alignment
-    ws["B1"].alignment = alignment
-    ws["C1"].alignment = Alignment(vertical="center")
-    ws["A1"].font = Font(bold=True)
-    ws["B1"].font = Font(bold=True)
-    ws["C1"].font = Font(bold=True)
-
-    ws["B4"] = "Expired Rule"
-    ws["B5"] = "Permanent Rule"
-    ws["B6"] = "Redundant Rule"
-    ws["B7"] = "Shadow Rule"
-    ws["B8"] = "Partial Shadow Rule"
-    ws["B9"] = "Unused Rule"
-    ws["B10"] = "Unused Objects (Session-Based)"
-    ws["B11"] = "Src Excessive Open"
-    ws["B12"] = "Dst Excessive Open"
-    ws["B13"] = "Service Excessive Open"
-    ws["B14"] = "Well-Known Port Open"
-    ws["B15"] = "Virus Port Open"
-    ws["B16"] = "Mgmt Port Open"
-    ws["B17"] = "Src ANY Open"
-    ws["B18"] = "Dst ANY Open"
-    ws["B19"] = "Service ANY Open"
-    ws["B20"] = ">30 Days Past Expiration"
-    ws["B21"] = "NOEVIDENCE Rule"
-    ws["B22"] = "Compliance"
-    ws["B23"] = "Deny Rule"
-    ws["B24"] = "Check Longest Expiration Period"
-    ws["B25"] = "Check Most Recent Expiration Period"
-    ws["B26"] = "NORENEW Check Status"
-    ws["B27"] = "Check Status"
-    ws["B28"] = "Check Group-Specific Policy Registration"
-    ws["B29"] = "Check Composition"
-    ws["B30"] = "Inactive Rule"
-    ws["B31"] = "Invalid Rule"
-    ws["B32"] = "Manual Rule"
-    ws["B33"] = "Unregistered Rule"
-    ws["B34"] = "No Zone Rule"
-    ws[f"{endCol}3"] = "Total"
-    ws[f"{endCol}3"].font = Font(bold=True)
-
-
-    ws.merge_cells("A1:A3")
-    ws.merge_cells("A4:A5")
-    ws.merge_cells("A6:A10")
-    ws.merge_cells("A11:A13")
-    ws.merge_cells("A14:A16")
-    ws.merge_cells("A17:A23")
-    ws.merge_cells("A24:A34")
-    ws.merge_cells("B1:B3")
-    ws.merge_cells(f"C1:{endCol}2")
-
-    ws.column_dimensions['A'].width = 20
-    ws.column_dimensions['B'].width = 40
-    ws.column_dimensions[endCol].width = 15
-    
+    return stream_report_file(report_db, [(report.id, report.fw_id) for report in reports])
 
-    for main_col_num, report in enumerate(reports, 3):
-        # rules = get_rules(argos_db, report.fw_id)
-        reportData = report.jsondata
-        rules = reportData["rules"]
-        fw_name = reportData["fw_name"]
 
-        ws.cell(row=3, column=main_col_num, value=fw_name)
-        ws.column_dimensions[get_column_letter(main_col_num)].width = 15
+def write_rules_sheet(writer: xlsx_stream.StreamingXlsxWriter, fw_name: str, rules: list, ruleTypes: dict):
+    # Column widths have to precede the rows, so they are measured in a first pass
+    widths = [len(header) for header in individualHeaders]
+    for rule in rules:
+        for col, field in enumerate(ruleFields):
+            widths[col] = max(widths[col], len(str(rule[field])))
+    for types in ruleTypes.values():
+        for type in types:
+            widths[9] = max(widths[9], len(ruletypeStrs[type]))
 
-        # ruleAnalysis = analyze_rules(db=db, fw_id=firewall.id)
-        ruleAnalysis = reportData["types"]
-        
-        if rules:
-            sheet = wb.create_sheet(title=f"{fw_name}")
-
-            curr_row = 2
-
-            # Add headers to the first row
-            for col_num, header in enumerate(individualHeaders, 1):
-                cell = sheet.cell(row=1, column=col_num, value=header)
-                cell.font = cell.font.copy(bold=True)  # Make the headers bold
-
-            for rule in rules:  # Start from row 2, as row 1 is for headers
-                start_row = curr_row
-
-                sheet.cell(row=curr_row, column=1, value=rule["id"])
-                sheet.cell(row=curr_row, column=2, value=rule["action"])
-                sheet.cell(row=curr_row, column=3, value=rule["source"])
-                sheet.cell(row=curr_row, column=4, value=rule["from_ip"])
-                sheet.cell(row=curr_row, column=5, value=rule["destination"])
-                sheet.cell(row=curr_row, column=6, value=rule["to_ip"])
-                sheet.cell(row=curr_row, column=7, value=rule["service"])
-                sheet.cell(row=curr_row, column=8, value=rule["expire"])
-                sheet.cell(row=curr_row, column=9, value=rule["comment"])
-
-                for type, ruleSet in ruleAnalysis.items():
-                    if len(ruleSet) > 0 and rule["id"] in ruleSet:
-                        sheet.cell(row=curr_row, column=10, value=ruletypeStrs[type])
-                        curr_row += 1
-
-                if curr_row == start_row:
-                    curr_row += 1
-                else:
-                    for col in sheet.iter_cols(min_row=start_row, max_row=curr_row - 1, min_col=1, max_col=9):
-                        sheet.merge_cells(start_column=col[0].column, end_column=col[0].column, start_row=start_row, end_row=curr_row-1)
-
-
-            # Adjust column widths for better readability
-            for col_num in range(1, len(individualHeaders) + 1):
-                column = get_column_letter(col_num)
-                max_length = 0
-                for row in sheet.iter_rows(min_col=col_num, max_col=col_num):
-                    for cell in row:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                
-                adjusted_width = (max_length + 2)
-                sheet.column_dimensions[column].width = adjusted_width
+    sheet = writer.create_sheet(fw_name, widths={col: width + 2 for col, width in enumerate(widths, 1)})
+    sheet.append([xlsx_stream.Cell(header, xlsx_stream.STYLE_BOLD) for header in individualHeaders])
 
+    curr_row = 2
+    for rule in rules:
+        start_row = curr_row
+        values = [rule[field] for field in ruleFields]
 
-        for row_num in range(4, 35):
-            if row_num in ruletypeRows:
-                ws.cell(row=row_num, column=main_col_num, value=len(ruleAnalysis[ruletypeRows[row_num]]))
-                # ws.cell(row=row_num, column=main_col_num, value=len(getattr(ruleAnalysis, ruletypeRows[row_num])))
+        for type in ruleTypes.get(str(rule["id"]), []):
+            if curr_row == start_row:
+                sheet.append(values + [ruletypeStrs[type]], row=curr_row)
             else:
-                ws.cell(row=row_num, column=main_col_num, value=0)
-    
-    for row in ws.iter_rows(min_row=4, max_row=ws.max_row, min_col=3, max_col=2 + len(reports)):
-        row_sum = sum(cell.value for cell in row)
-        ws.cell(row=row[0].row, column=3 + len(reports), value=row_sum)
+                sheet.append([None] * len(values) + [ruletypeStrs[type]], row=curr_row)
+            curr_row += 1
 
-    # Create an in-memory binary stream for the Excel file
-    output = BytesIO()
-    
-    # Save the workbook to the binary stream and seek to the beginning
-    wb.save(output)
-    output.seek(0)
-    
-    return output
+        if curr_row == start_row:
+            sheet.append(values, row=curr_row)
+            curr_row += 1
+        elif curr_row - start_row > 1:
+            for col in range(1, len(values) + 1):
+                letter = get_column_letter(col)
+                sheet.merge(f"{letter}{start_row}:{letter}{curr_row - 1}")
+
+        yield
+
+    sheet.close()
+
+
+def write_summary_sheet(writer: xlsx_stream.StreamingXlsxWriter, fw_names: list, counts: list):
+    Cell = xlsx_stream.Cell
+    endColNum = 3 + len(fw_names)
+    endCol = get_column_letter(endColNum)
+
+    widths = {1: 20, 2: 40, endColNum: 15}
+    widths.update({col: 15 for col in range(3, endColNum)})
+    sheet = writer.create_sheet("Report Summary", widths=widths, position=0)
+
+    sheet.append([Cell("Category", xlsx_stream.STYLE_BOLD_CENTER), Cell("Details", xlsx_stream.STYLE_BOLD_CENTER), Cell("Number of Applicable Rules", xlsx_stream.STYLE_BOLD_VCENTER)], row=1)
+    sheet.append([None, None] + fw_names + [Cell("Total", xlsx_stream.STYLE_BOLD)], row=3)
+
+    for row_num in range(4, 35):
+        category = SUMMARY_CATEGORIES.get(row_num)
+        values = [firewallCounts.get(ruletypeRows.get(row_num), 0) for firewallCounts in counts]
+        sheet.append([Cell(category, xlsx_stream.STYLE_CENTER) if category else None, SUMMARY_DETAILS[row_num]] + values + [sum(values)], row=row_num)
+
+    for ref in SUMMARY_MERGES + [f"C1:{endCol}2"]:
+        sheet.merge(ref)
+
+    sheet.close()
+
+
+def stream_report_file(report_db: Session, reports: list):
+    # Yields the workbook as compressed chunks while the per-firewall sheets are written
+    writer = xlsx_stream.StreamingXlsxWriter()
+    fw_names = []
+    counts = []
+
+    try:
+        for report_id, fw_id in reports:
+            reportData = report_store.load_report_data(report_db, report_id)
+            rules = reportData["rules"]
+            fw_name = reportData["fw_name"]
+            ruleAnalysis = reportData["types"]
+
+            fw_names.append(fw_name)
+            counts.append({type: len(ruleSet) for type, ruleSet in ruleAnalysis.items()})
+
+            if rules:
+                for _ in write_rules_sheet(writer, fw_name, rules, get_rule_types(reportData)):
+                    chunk = writer.flush(STREAM_CHUNK_SIZE)
+                    if chunk:
+                        yield chunk
+
+            # Drop the report before loading the next one
+            del reportData, rules, ruleAnalysis
+            report_db.expunge_all()
+
+        write_summary_sheet(writer, fw_names, counts)
+        yield writer.close()
+    finally:
+        report_db.close()
 
 
 
 
 def get_report_data(db: Session, firewall_id: int = -1, fw_ids: Union[list[int], None] = None):
-    ruletypes = ['expired','permanent','redundant','shadow','unused', 'unused_objects', 'dst_excessiveopen', 'port_excessiveopen', 'knownportopen', 'virusportopen', 'mgmtportopen', 'src_anyopen', 'dst_anyopen', 'noevidence', 'compliancecheck', 'disabled', 'invalid', 'manual']
+    ruletypes = ['expired','permanent','redundant','shadow','partial_shadow','unused', 'unused_objects', 'greater30days', 'dst_excessiveopen', 'port_excessiveopen', 'knownportopen', 'virusportopen', 'mgmtportopen', 'src_anyopen', 'dst_anyopen', 'noevidence', 'compliancecheck', 'disabled', 'invalid', 'manual']
     # ruletypeStrs = {'expired': 'Expired Rule', 'permanent': 'Permanent Rule', 'redundant': 'Redundant Rule', 'shadow': 'Shadow Rule', 'unused': 'Unused Rule', 'unused_objects': 'Unused Objects (Session-Based)', 'dst_excessiveopen': 'Dst Excessive Open', 'port_excessiveopen': 'Service Excessive Open', 'knownportopen': 'Well-Known Port Open', 'virusportopen': 'Virus Port Open', 'mgmtportopen': 'Mgmt Port Open', 'src_anyopen': 'Src ANY Open', 'dst_anyopen': 'Dst ANY Open', 'noevidence': 'NOEVIDENCE Rule', 'compliancecheck': 'Compliance', 'disabled': 'Inactive Rule', 'invalid': 'Invalid Rule', 'manual': 'Manual Rule'}
 
     # The report will include all firewalls
@@ -0,0 +1,274 @@
+from fastapi import HTTPException
+from sqlalchemy import select, func, cast, case, and_, literal_column, Text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from starlette.concurrency import run_in_threadpool
+from typing import Union
+from bisect import bisect_right
+from itertools import islice
+import orjson
+import models
+import report_store
+import report_codec
+import crud
+import cache
+
+
+# Async counterparts of the report read queries in crud, served from the
+# asyncpg engine. Analysis and report generation stay on the sync sessions.
+
+
+async def get_report_meta(db: AsyncSession, report_id: int):
+    meta = (await db.execute(select(models.Report.id, models.Report.update_ts).where(models.Report.id == report_id))).first()
+    if not meta:
+        raise HTTPException(status_code=404, detail=f"Report with id {report_id} not found")
+    return meta
+
+
+def source_data(row):
+    # orjson parses the stored text directly; columnar payloads decode lazily
+    if row.payload is not None:
+        return report_codec.decode(row.payload, row.encoding, report_store.DERIVED)
+    return orjson.loads(row.raw)
+
+
+def decode_report_data(report, base=None):
+    data = source_data(report)
+    if base is None:
+        return data
+    return report_store.apply_delta(source_data(base), data)
+
+
+def encode_report_view(data, type: str) -> bytes:
+    return orjson.dumps(crud.report_view(data, type))
+
+
+def stored_columns():
+    return (cast(models.Report.jsondata, Text).label("raw"), models.Report.payload, models.Report.encoding)
+
+
+def has_data(row) -> bool:
+    return row.raw is not None or row.payload is not None
+
+
+async def get_report_source(db: AsyncSession, report_id: int):
+    # (stored row, base snapshot row or None); jsondata comes back as text
+    report = (await db.execute(select(*stored_columns(), models.Report.base_id).where(models.Report.id == report_id))).first()
+    if not report:
+        raise HTTPException(status_code=404, detail=f"Report with id {report_id} not found")
+
+    base = None
+    if has_data(report) and report.base_id is not None:
+        base = (await db.execute(select(*stored_columns()).where(models.Report.id == report.base_id))).first()
+    return report, base
+
+
+def security_json():
+    # The security view of a full JSON snapshot assembled in SQL, so the
+    # internal keys are never read out of the database
+    parts = []
+    for key in crud.SECURITY_KEYS:
+        name = literal_column(f"'{key}'")
+        parts += [name, models.Report.jsondata.op("->")(name)]
+    return cast(func.json_build_object(*parts), Text)
+
+
+async def get_report_json(db: AsyncSession, report_id: int, type: str) -> bytes:
+    """
+    Returns the response body of the security or individual report. The
+    security report of a full JSON snapshot is built in SQL and passed
+    through as text; anything else is decoded and encoded with orjson.
+    """
+    if type == "security":
+        # None in jsondata is stored as JSON null, columnar rows are told apart by their payload
+        snapshot = and_(models.Report.base_id == None, models.Report.payload == None, models.Report.jsondata != None)
+        row = (await db.execute(select(case((snapshot, security_json())).label("raw")).where(models.Report.id == report_id))).first()
+        if row is not None and row.raw is not None:
+            return row.raw.encode()
+
+    report, base = await get_report_source(db, report_id)
+
+    if not has_data(report):
+        return b"null"
+
+    # Decoding and encoding are CPU bound, keep them off the event loop
+    data = await run_in_threadpool(decode_report_data, report, base)
+    return await run_in_threadpool(encode_report_view, data, type)
+
+
+class IndividualRules:
+    """
+    Rules of an individual report ordered by id, the key of the paginated
+    and streamed views. Per-type subsets are built on first use.
+    """
+
+    def __init__(self, data):
+        view = crud.report_view(data, "individual")
+        self.fw_name = view["fw_name"]
+        self.rules = sorted(view["rules"], key=lambda rule: rule["id"])
+        self.ids = [rule["id"] for rule in self.rules]
+        self.byType = {}
+        # Estimated memory, what the report_views cache is bounded by
+        self.nbytes = cache.sampled_size(self.rules) + cache.sampled_size(self.ids)
+
+    def select(self, type=None):
+        if type is None:
+            return self.rules, self.ids
+        if type not in self.byType:
+            rules = [rule for rule in self.rules if type in rule["types"]]
+            self.byType[type] = (rules, [rule["id"] for rule in rules])
+        return self.byType[type]
+
+    def page(self, after_rule_id=None, limit=None, type=None):
+        """
+        Returns (rules, next cursor) for rules with an id above after_rule_id;
+        the cursor is None on the last page.
+        """
+        rules, ids = self.select(type)
+        start = bisect_right(ids, after_rule_id) if after_rule_id is not None else 0
+        end = len(rules) if limit is None else min(start + limit, len(rules))
+
+        page = rules[start:end]
+        nextCursor = page[-1]["id"] if page and end < len(rules) else None
+        return page, nextCursor
+
+
+def build_individual_rules(report, base):
+    return IndividualRules(decode_report_data(report, base))
+
+
+async def get_individual_rules(db: AsyncSession, report_id: int) -> IndividualRules:
+    # Stored reports never change, so decoded views are kept across requests
+    rules = cache.report_views.lookup(report_id)
+    if rules is None:
+        report, base = await get_report_source(db, report_id)
+        if not has_data(report):
+            raise HTTPException(status_code=404, detail=f"Report with id {report_id} has no data")
+        rules = await run_in_threadpool(build_individual_rules, report, base)
+        cache.report_views.store(report_id, rules, rules.nbytes)
+    return rules
+
+
+async def get_stored_rules(db: AsyncSession, report_id: int):
+    # Stored row and base for streaming, read before the response starts so a missing report is a 404
+    report, base = await get_report_source(db, report_id)
+    if not has_data(report):
+        raise HTTPException(status_code=404, detail=f"Report with id {report_id} has no data")
+    return report, base
+
+
+# Rules serialized per chunk of the NDJSON stream
+NDJSON_BATCH_SIZE = 500
+
+
+def stream_rules_ndjson(rules):
+    rules = iter(rules)
+    while True:
+        batch = list(islice(rules, NDJSON_BATCH_SIZE))
+        if not batch:
+            return
+        yield b"".join(orjson.dumps(rule) + b"\n" for rule in batch)
+
+
+def stream_report_ndjson(report, base):
+    """
+    The whole individual report as NDJSON, in stored rule order. Decoding
+    happens inside the stream (StreamingResponse runs it in a thread) and
+    rules are built one batch at a time, so nothing is sorted or cached and
+    columnar reports never hold every rule as a dict.
+    """
+    yield from stream_rules_ndjson(crud.iter_individual_rules(decode_report_data(report, base)))
+
+
+async def get_report_history_meta(db: AsyncSession, fw_id: int):
+    return (await db.execute(
+        select(
+            func.count(models.Report.id).label("count"),
+            func.max(models.Report.id).label("last_id"),
+            func.max(models.Report.update_ts).label("update_ts"),
+        )
+        .where(models.Report.fw_id == fw_id)
+    )).one()
+
+
+async def get_report_history(db: AsyncSession, fw_id: int):
+    reports = (await db.execute(
+        select(models.Report.id, models.Report.update_ts)
+        .where(models.Report.fw_id == fw_id)
+        .order_by(models.Report.update_ts.desc())
+    )).all()
+
+    return [
+        {
+            "reportId": report.id,
+            "update_ts": report.update_ts.isoformat() if report.update_ts else None,
+        }
+        for report in reports
+    ]
+
+
+async def get_most_recent_reports(db: AsyncSession, fw_ids: Union[list[int], None] = None):
+    # Summary columns only, jsondata is never loaded here
+    subquery = select(models.Report.fw_id, func.max(models.Report.update_ts).label("latest_ts"))
+    if fw_ids is not None:
+        subquery = subquery.where(models.Report.fw_id.in_(fw_ids))
+    subquery = subquery.group_by(models.Report.fw_id).subquery()
+
+    query = (
+        select(models.Report)
+        .join(subquery, (models.Report.fw_id == subquery.c.fw_id) & (models.Report.update_ts == subquery.c.latest_ts))
+        .options(defer(models.Report.jsondata), defer(models.Report.payload))
+    )
+
+    return (await db.scalars(query)).all()
+
+
+async def load_report_data(db: AsyncSession, report_id: int):
+    report, base = await get_report_source(db, report_id)
+    return decode_report_data(report, base) if has_data(report) else None
+
+
+async def legacy_summary(db: AsyncSession, report_id: int) -> dict:
+    # Summary of a report whose summary columns were never backfilled, read from its data
+    data = await load_report_data(db, report_id)
+    return crud.report_summary(data) if data else {"fw_name": None, "type_counts": None}
+
+
+async def get_reports(db: AsyncSession, fw_ids: Union[list[int], None] = None):
+    latest_reports = await get_most_recent_reports(db, fw_ids)
+
+    all_report_fw_names = (await db.execute(
+        select(models.Report.id, models.Report.fw_id, models.Report.fw_name)
+        .distinct(models.Report.fw_id)
+        .order_by(models.Report.fw_id, models.Report.update_ts.desc())
+    )).all()
+
+    # Reports stored before the summary columns existed, until backfill_report_summaries has run
+    names = {row.id: row.fw_name for row in [*latest_reports, *all_report_fw_names]}
+    typeCounts = {report.id: report.type_counts for report in latest_reports}
+    for report_id in [report_id for report_id, name in names.items() if name is None]:
+        summary = await legacy_summary(db, report_id)
+        names[report_id], typeCounts[report_id] = summary["fw_name"], summary["type_counts"]
+
+    return {
+        "idToName": {row.fw_id: names[row.id] for row in all_report_fw_names},
+        "requestedFwData": {
+            report.fw_id: {
+                "reportId": report.id,
+                "fwName": names[report.id],
+                **(typeCounts[report.id] or {}),
+            }
+            for report in latest_reports
+        }
+    }
+
+
+async def get_reports_info(db: AsyncSession):
+    latest_reports = await get_most_recent_reports(db)
+    return {
+        report.fw_id: {
+            "update_ts": report.update_ts.isoformat() if report.update_ts else None,
+            "report_id": report.id
+        }
+        for report in latest_reports
+    }
@@ -0,0 +1,56 @@
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Response
+
+
+# Stored reports never change, so clients and proxies may keep them indefinitely
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Lists that grow with new reports must be revalidated, which is cheap with an ETag
+REVALIDATE = "no-cache"
+
+# Part of every ETag. Bump it whenever a cached response body changes shape,
+# so clients and proxies holding an immutable copy fetch the new one
+FORMAT_VERSION = 2
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr((FORMAT_VERSION, *parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def last_modified(ts) -> str:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return format_datetime(ts.astimezone(timezone.utc), usegmt=True)
+
+
+def is_fresh(etag: str, ts=None, if_none_match: str = None, if_modified_since: str = None) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110, 13.2.2)
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    if if_modified_since is not None and ts is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        modified = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+        return modified.replace(microsecond=0) <= since
+
+    return False
+
+
+def cache_headers(etag: str, cache_control: str, ts=None, vary: str = None) -> dict:
+    # vary names the request headers that select the body, e.g. "Accept"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if ts is not None:
+        headers["Last-Modified"] = last_modified(ts)
+    if vary is not None:
+        headers["Vary"] = vary
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
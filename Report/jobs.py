@@ -0,0 +1,227 @@
+import logging as log
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+import database
+import models
+import crud
+import cache
+import stage_metrics
+import query_budget
+
+
+# Worker processes running report generation; kept small so analysis cannot
+# take every CPU and database connection away from the read endpoints
+MAX_WORKERS = database.get_setting("reportWorkers", 2)
+
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION = 3600
+
+# Workers start from a clean server process instead of being forked from the
+# API process, whose event loop, threads and pooled connections a forked
+# child would inherit mid-use
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Job state lives in ag_report_job so any API worker process can answer a
+# poll; the pool below is local to the process that submitted the job
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context(START_METHOD))
+        return _executor
+
+
+def _replace_executor(broken):
+    # A worker that died (e.g. killed for memory) leaves the pool unusable for
+    # every later submit; other threads may have replaced it already
+    global _executor
+    with _lock:
+        if _executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _update_job(job_id: str, **values):
+    db = database.ReportSession()
+    try:
+        db.query(models.ReportJob).filter(models.ReportJob.id == job_id).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_report_job(job_id: str, firewall_id: int, cacheGeneration, complianceObjects=None, weights=None, incremental=False, refresh=True):
+    # Runs in a worker process with its own sessions; the run's stage metrics
+    # go back with the report id so the parent can publish them
+    cache.sync(cacheGeneration)
+    argos_db = database.SessionLocal()
+    report_db = database.ReportSession()
+    try:
+        with stage_metrics.recording() as recorder, query_budget.track("run_report_job"):
+            _update_job(job_id, status="running", stage="analyzing")
+            report_data = crud.generate_report(argos_db=argos_db, report_db=report_db, firewall_id=firewall_id, complianceObjects=complianceObjects, weights=weights, incremental=incremental, refresh=refresh)
+
+            _update_job(job_id, stage="storing")
+            report_id = crud.store_report(report_db, report_data, firewall_id)
+
+        return {"report_id": report_id, "metrics": recorder.to_dict()}
+    except HTTPException as e:
+        # Keep the error picklable on its way back to the parent
+        raise RuntimeError(e.detail) from None
+    finally:
+        argos_db.close()
+        report_db.close()
+
+
+def _finish(job_id, future):
+    values = {"finished": time.time(), "stage": None}
+    metrics = None
+    if future.cancelled():
+        values["status"] = "cancelled"
+    elif future.exception() is not None:
+        values["status"] = "failed"
+        values["error"] = str(future.exception()) or type(future.exception()).__name__
+    else:
+        metrics = future.result()["metrics"]
+        values["status"] = "done"
+        values["report_id"] = future.result()["report_id"]
+        values["metrics"] = metrics["total"]
+
+    db = database.ReportSession()
+    try:
+        db.query(models.ReportJob).filter(models.ReportJob.id == job_id).update(values, synchronize_session=False)
+        if metrics is not None:
+            stage_metrics.observe(db, metrics)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _queue(firewall_ids, batch_id=None) -> dict:
+    # Records the jobs before any worker can pick them up; returns {firewall id: job id}
+    queued = {firewall_id: uuid.uuid4().hex for firewall_id in firewall_ids}
+
+    db = database.ReportSession()
+    try:
+        db.query(models.ReportJob).filter(models.ReportJob.finished < time.time() - JOB_RETENTION).delete(synchronize_session=False)
+        db.add_all(
+            models.ReportJob(id=job_id, batch_id=batch_id, firewall_id=firewall_id, status="queued", created=time.time())
+            for firewall_id, job_id in queued.items()
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    return queued
+
+
+def _start(job_id: str, firewall_id: int, complianceObjects=None, weights=None, incremental=False, refresh=True):
+    args = (run_report_job, job_id, firewall_id, cache.generation(), complianceObjects, weights, incremental, refresh)
+    try:
+        executor = get_executor()
+        try:
+            future = executor.submit(*args)
+        except BrokenProcessPool:
+            _replace_executor(executor)
+            future = get_executor().submit(*args)
+    except Exception as e:
+        # No worker will ever pick the job up, fail it instead of leaving it queued
+        log.exception("could not start report job %s", job_id)
+        _update_job(job_id, status="failed", error=str(e) or type(e).__name__, finished=time.time())
+        return
+    future.add_done_callback(lambda f: _finish(job_id, f))
+
+
+def submit_report_job(firewall_id: int, incremental: bool = False):
+    job_id = _queue([firewall_id])[firewall_id]
+    _start(job_id, firewall_id, incremental=incremental)
+
+    db = database.ReportSession()
+    try:
+        return get_job(db, job_id)
+    finally:
+        db.close()
+
+
+def generate_reports(argos_db, report_db, fw_ids=None, incremental=False):
+    """
+    Queues reports for many firewalls at once and returns the batch id and
+    the job id per firewall without waiting; poll get_batch for the results.
+    Compliance objects and weights are loaded once and shared with every
+    job, and the policy hit rollup is refreshed here once so the jobs skip
+    their own refresh.
+    """
+    if fw_ids is None:
+        fw_ids = list(crud.get_firewall_directory(argos_db))
+
+    complianceObjects = crud.get_compliance_objects(argos_db)
+    weights = crud.get_weights_dict(report_db)
+    crud.refresh_policy_hits(argos_db)
+
+    batch_id = uuid.uuid4().hex
+    queued = _queue(fw_ids, batch_id)
+    for firewall_id, job_id in queued.items():
+        _start(job_id, firewall_id, complianceObjects, weights, incremental, refresh=False)
+
+    return {"batch_id": batch_id, "jobs": queued}
+
+
+def job_dict(job) -> dict:
+    return {
+        "job_id": job.id,
+        "firewall_id": job.firewall_id,
+        "status": job.status,
+        "stage": job.stage,
+        "report_id": job.report_id,
+        "error": job.error,
+        "metrics": job.metrics,
+        "created": job.created,
+        "finished": job.finished,
+    }
+
+
+def get_job(report_db, job_id: str):
+    job = report_db.get(models.ReportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job with id {job_id} not found")
+    return job_dict(job)
+
+
+def get_batch(report_db, batch_id: str):
+    batch = report_db.query(models.ReportJob).filter(models.ReportJob.batch_id == batch_id).all()
+    if not batch:
+        raise HTTPException(status_code=404, detail=f"Batch with id {batch_id} not found")
+
+    results, failures, pending = {}, {}, {}
+    for job in batch:
+        if job.status == "done":
+            results[job.firewall_id] = {"job_id": job.id, "report_id": job.report_id}
+        elif job.finished is not None:
+            failures[job.firewall_id] = job.error or job.status
+        else:
+            pending[job.firewall_id] = {"job_id": job.id, "status": job.status, "stage": job.stage}
+
+    return {
+        "batch_id": batch_id,
+        "status": "running" if pending else "done",
+        "results": results,
+        "failures": failures,
+        "pending": pending,
+    }
@@ -0,0 +1,78 @@
+import argparse
+import logging as log
+from sqlalchemy import text
+import database, models, crud
+
+
+# Idempotent schema changes, applied in order on startup; {schema} is the owning schema.
+# The argos_syslog columns of the database unused-objects mode are opt-in, see syslog_migration.py
+REPORT_MIGRATIONS = [
+    # Denormalized report summary columns
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS fw_name varchar",
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS rule_count integer",
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS type_counts json",
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS scores json",
+    "CREATE INDEX IF NOT EXISTS ix_ag_report_fw_id_update_ts ON {schema}.ag_report (fw_id, update_ts)",
+    # Delta-encoded report history
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS base_id integer",
+    "CREATE INDEX IF NOT EXISTS ix_ag_report_base_id ON {schema}.ag_report (base_id)",
+    # Columnar report payloads
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS payload bytea",
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS encoding varchar",
+    # Report generation metrics
+    "ALTER TABLE {schema}.ag_report ADD COLUMN IF NOT EXISTS metrics json",
+    # Batched report jobs
+    "ALTER TABLE {schema}.ag_report_job ADD COLUMN IF NOT EXISTS batch_id varchar",
+    "CREATE INDEX IF NOT EXISTS ix_ag_report_job_batch_id ON {schema}.ag_report_job (batch_id)",
+]
+
+
+def run(engine, statements, schema):
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement.format(schema=schema)))
+
+
+# Tables owned by this service, created when missing
+ARGOS_TABLES = [
+    models.PolicyHit.__table__,
+    models.PolicyHitDaily.__table__,
+    models.RollupWatermark.__table__,
+]
+
+REPORT_TABLES = [
+    models.ReportJob.__table__,
+    models.ReportMetric.__table__,
+    models.CacheGeneration.__table__,
+]
+
+
+def upgrade():
+    models.Base.metadata.create_all(bind=database.engine, tables=ARGOS_TABLES)
+    models.Base.metadata.create_all(bind=database.report_engine, tables=REPORT_TABLES)
+    run(database.report_engine, REPORT_MIGRATIONS, database.REPORT_SCHEMA)
+
+
+def backfill_summaries():
+    # One-off: reads and decodes every report stored before the summary
+    # columns existed, so it is not part of the startup upgrade
+    db = database.ReportSession()
+    try:
+        return crud.backfill_report_summaries(db)
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the report schema migrations")
+    parser.add_argument("--backfill-summaries", action="store_true", help="also fill the summary columns of old reports")
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.INFO)
+    upgrade()
+    if args.backfill_summaries:
+        log.info("%d report summaries backfilled", backfill_summaries())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, CheckConstraint, JSON, func
+from sqlalchemy import Column, Integer, BigInteger, Float, String, LargeBinary, Date, DateTime, CheckConstraint, JSON, func
+from sqlalchemy.orm import deferred
 from database import Base
 
 class Firewall(Base):
@@ -131,6 +132,37 @@ class SysLog(Base):
     apprisk = Column(String, nullable=True)
     times = Column(Integer)
 
+    # Added and filled by syslog_migration.py for the database join mode;
+    # deferred so loading rows works on databases that never ran it
+    srcip_int = deferred(Column(BigInteger, nullable=True))
+    dstip_int = deferred(Column(BigInteger, nullable=True))
+    protocol = deferred(Column(String, nullable=True))
+    port = deferred(Column(Integer, nullable=True))
+
+class PolicyHit(Base):
+    __tablename__ = "argos_policy_hit"
+
+    policyid = Column(String, primary_key=True)
+    hits = Column(BigInteger, default=0, server_default="0")
+    first_seen = Column(DateTime, nullable=True)
+    last_seen = Column(DateTime, nullable=True)
+
+
+class PolicyHitDaily(Base):
+    __tablename__ = "argos_policy_hit_daily"
+
+    policyid = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    hits = Column(BigInteger, default=0, server_default="0")
+
+
+class RollupWatermark(Base):
+    __tablename__ = "argos_rollup_watermark"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(BigInteger, default=0, server_default="0")
+    ts = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 class Report(Base):
     __tablename__ = "ag_report"
 
@@ -138,6 +170,58 @@ class Report(Base):
     fw_id = Column(Integer, index=True)
     update_ts = Column(DateTime, server_default=func.now())
     jsondata = Column(JSON)
+    # When set, jsondata is a delta against this full snapshot report (see report_store)
+    base_id = Column(Integer, nullable=True, index=True)
+    # Columnar snapshot (report_codec) stored instead of jsondata, e.g. encoding "columnar+zstd"
+    payload = Column(LargeBinary, nullable=True)
+    encoding = Column(String, nullable=True)
+
+    # Summary of jsondata written by crud.store_report, so list endpoints never load the rules
+    fw_name = Column(String, nullable=True)
+    rule_count = Column(Integer, nullable=True)
+    type_counts = Column(JSON, nullable=True)
+    scores = Column(JSON, nullable=True)
+
+    # Per-stage and per-check timings of the run that produced the report (stage_metrics)
+    metrics = Column(JSON, nullable=True)
+
+class ReportJob(Base):
+    # Report generation jobs (see jobs.py), shared by every API worker process
+    __tablename__ = "ag_report_job"
+
+    id = Column(String, primary_key=True)
+    # Set for the jobs of one generate-reports call
+    batch_id = Column(String, nullable=True, index=True)
+    firewall_id = Column(Integer)
+    status = Column(String)
+    stage = Column(String, nullable=True)
+    report_id = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    metrics = Column(JSON, nullable=True)
+    # Epoch seconds
+    created = Column(Float)
+    finished = Column(Float, nullable=True, index=True)
+
+class ReportMetric(Base):
+    # Running totals of the report generation metrics (stage_metrics), one row
+    # per stage, check and the run total, summed over every finished job
+    __tablename__ = "ag_report_metric"
+
+    kind = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    calls = Column(BigInteger, default=0, server_default="0")
+    wall = Column(Float, default=0, server_default="0")
+    cpu = Column(Float, default=0, server_default="0")
+    queries = Column(BigInteger, default=0, server_default="0")
+    rows = Column(BigInteger, default=0, server_default="0")
+
+class CacheGeneration(Base):
+    # Bumped when a cache (see cache.py) is invalidated, so every API worker
+    # process drops its copy on the next read
+    __tablename__ = "ag_cache_generation"
+
+    name = Column(String, primary_key=True)
+    generation = Column(BigInteger, default=0, server_default="0")
 
 class Weights(Base):
     __tablename__ = "ag_weights"
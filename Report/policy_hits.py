@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+from sqlalchemy import String, Date, cast, func, select
+from sqlalchemy.dialects.postgresql import insert
+from models import SysLog, Rule, PolicyHit, PolicyHitDaily, RollupWatermark
+import database
+import query_budget
+
+
+WATERMARK_NAME = "argos_syslog"
+REFRESH_BATCH_SIZE = 200000
+
+# Syslog ids are taken from a sequence when a row is inserted, not when its
+# transaction commits, so a slow ingest transaction can commit ids below ones
+# that are already visible. The refresh stops this many ids short of max(id)
+# so those rows are still ahead of the watermark when they become visible.
+# It must exceed the number of rows ingest can have in flight. The rows
+# held back are still counted: the readers below aggregate every row past
+# the watermark live and combine it with the rollup.
+ROLLUP_ID_LAG = database.get_setting("rollupIdLag", 10000)
+
+
+def refresh_policy_hits(db, batch_size=REFRESH_BATCH_SIZE, lag=None):
+    """
+    Folds syslog rows newer than the stored SysLog.id watermark, up to
+    max(id) minus the safety lag, into the policy hit rollup (totals and
+    per-day buckets). Each batch is committed together with the watermark,
+    so an interrupted refresh resumes cleanly.
+    The watermark row is locked for every batch, so concurrent refreshes
+    (report jobs run in parallel) never fold the same rows twice.
+    Its statements are tracked on their own, against a query budget that
+    grows with the number of batches, not against the enclosing job's.
+    Returns the number of syslog rows folded in.
+    """
+    with query_budget.track("refresh_policy_hits", separate=True) as queryLog:
+        db.execute(insert(RollupWatermark).values(name=WATERMARK_NAME, last_id=0).on_conflict_do_nothing())
+        db.commit()
+
+        maxId = db.query(func.max(SysLog.id)).scalar()
+        if maxId is None:
+            return 0
+        maxId -= ROLLUP_ID_LAG if lag is None else lag
+
+        processed = 0
+        while True:
+            watermark = (
+                db.query(RollupWatermark)
+                .filter(RollupWatermark.name == WATERMARK_NAME)
+                .with_for_update()
+                .populate_existing()
+                .one()
+            )
+            if watermark.last_id >= maxId:
+                db.commit()
+                break
+
+            queryLog.batch()
+            low = watermark.last_id
+            high = min(low + batch_size, maxId)
+
+            day = cast(SysLog.eventtime, Date)
+            buckets = (
+                db.query(
+                    SysLog.policyid,
+                    day.label("day"),
+                    func.count(SysLog.id).label("hits"),
+                    func.min(SysLog.eventtime).label("first_seen"),
+                    func.max(SysLog.eventtime).label("last_seen"),
+                )
+                .filter(SysLog.id > low, SysLog.id <= high, SysLog.policyid != None)
+                .group_by(SysLog.policyid, day)
+                .all()
+            )
+
+            totals = {}
+            for bucket in buckets:
+                total = totals.get(bucket.policyid)
+                if total is None:
+                    totals[bucket.policyid] = {"policyid": bucket.policyid, "hits": bucket.hits, "first_seen": bucket.first_seen, "last_seen": bucket.last_seen}
+                    continue
+                total["hits"] += bucket.hits
+                total["first_seen"] = min(filter(None, (total["first_seen"], bucket.first_seen)), default=None)
+                total["last_seen"] = max(filter(None, (total["last_seen"], bucket.last_seen)), default=None)
+            processed += sum(bucket.hits for bucket in buckets)
+
+            dailyRows = [{"policyid": b.policyid, "day": b.day, "hits": b.hits} for b in buckets if b.day is not None]
+            if dailyRows:
+                stmt = insert(PolicyHitDaily).values(dailyRows)
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=[PolicyHitDaily.policyid, PolicyHitDaily.day],
+                    set_={"hits": PolicyHitDaily.hits + stmt.excluded.hits},
+                ))
+
+            if totals:
+                stmt = insert(PolicyHit).values(list(totals.values()))
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=[PolicyHit.policyid],
+                    set_={
+                        "hits": PolicyHit.hits + stmt.excluded.hits,
+                        "first_seen": func.least(PolicyHit.first_seen, stmt.excluded.first_seen),
+                        "last_seen": func.greatest(PolicyHit.last_seen, stmt.excluded.last_seen),
+                    },
+                ))
+
+            watermark.last_id = high
+            db.commit()
+
+        return processed
+
+
+def recent_hits():
+    # Hits of the syslog rows not folded into the rollup yet, aggregated per policy
+    watermark = select(RollupWatermark.last_id).where(RollupWatermark.name == WATERMARK_NAME).scalar_subquery()
+    return (
+        select(SysLog.policyid, func.max(SysLog.eventtime).label("last_seen"))
+        .where(SysLog.id > func.coalesce(watermark, 0), SysLog.policyid != None)
+        .group_by(SysLog.policyid)
+        .subquery("recent_hits")
+    )
+
+
+def retrieve_unused(db, fw_id):
+    # Rules of the firewall that never appeared in the syslog
+    recent = recent_hits()
+    unusedRules = (
+        db.query(Rule.id)
+        .outerjoin(PolicyHit, cast(Rule.id, String) == PolicyHit.policyid)
+        .outerjoin(recent, cast(Rule.id, String) == recent.c.policyid)
+        .filter(Rule.fw_id == fw_id)
+        .filter(PolicyHit.policyid == None, recent.c.policyid == None)
+        .all()
+    )
+    return [rule.id for rule in unusedRules]
+
+
+def retrieve_idle(db, fw_id, days=30):
+    # Rules that were hit at some point but not within the last `days` days
+    cutoff = datetime.now() - timedelta(days=days)
+    recent = recent_hits()
+    idleRules = (
+        db.query(Rule.id)
+        .outerjoin(PolicyHit, cast(Rule.id, String) == PolicyHit.policyid)
+        .outerjoin(recent, cast(Rule.id, String) == recent.c.policyid)
+        .filter(Rule.fw_id == fw_id)
+        .filter(func.greatest(PolicyHit.last_seen, recent.c.last_seen) < cutoff)
+        .all()
+    )
+    return [rule.id for rule in idleRules]
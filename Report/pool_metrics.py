@@ -0,0 +1,73 @@
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+# QueuePool._do_get retries by calling itself, only the outermost call is measured
+_inCheckout = ContextVar("inCheckout", default=False)
+
+
+class PoolMetricsMixin:
+    """
+    Records how long checkouts wait for a connection and how close the pool
+    gets to its limit, so workers can be sized against max_connections.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metricsLock = threading.Lock()
+        self._checkouts = 0
+        self._waitTotal = 0.0
+        self._waitMax = 0.0
+        self._timeouts = 0
+        self._peakCheckedOut = 0
+
+    def _do_get(self):
+        if _inCheckout.get():
+            return super()._do_get()
+
+        token = _inCheckout.set(True)
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with self._metricsLock:
+                self._timeouts += 1
+            raise
+        finally:
+            _inCheckout.reset(token)
+
+        waited = time.perf_counter() - start
+        with self._metricsLock:
+            self._checkouts += 1
+            self._waitTotal += waited
+            self._waitMax = max(self._waitMax, waited)
+            self._peakCheckedOut = max(self._peakCheckedOut, self.checkedout())
+        return conn
+
+    def metrics(self) -> dict:
+        capacity = self.size() + max(self._max_overflow, 0)
+        with self._metricsLock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "saturation": self.checkedout() / capacity if capacity else 0.0,
+                "peak_saturation": self._peakCheckedOut / capacity if capacity else 0.0,
+                "checkouts": self._checkouts,
+                "checkout_wait_avg": self._waitTotal / self._checkouts if self._checkouts else 0.0,
+                "checkout_wait_max": self._waitMax,
+                "timeouts": self._timeouts,
+            }
+
+
+class MeteredQueuePool(PoolMetricsMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncPool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+    pass
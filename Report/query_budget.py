@@ -0,0 +1,160 @@
+import re
+import logging as log
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+import database
+
+
+logger = log.getLogger("query_budget")
+
+# "warn" logs a budget overrun, "raise" fails with QueryBudgetExceeded (for
+# tests), "off" only counts
+MODE = database.get_setting("queryBudgetMode", "warn")
+
+# Statements allowed per endpoint (by function name in main.py) or job. The
+# limits must not depend on rulebase size; a count that grows with the
+# number of rules or firewalls is an N+1. Overridden by the queryBudgets setting.
+DEFAULT_BUDGETS = {
+    "get_comprehensive_report": 4,
+    "generate_individual_report": 4,
+    "get_security_report": 4,
+    "get_report_history": 3,
+    "get_reports_info": 2,
+    "get_report_weights": 2,
+    "run_report_job": 30,
+    "refresh_policy_hits": 3,
+}
+BUDGETS = {**DEFAULT_BUDGETS, **database.get_setting("queryBudgets", {})}
+
+# Statements allowed per batch on top of BUDGETS, for work that goes through
+# a table in batches and reports each one with QueryLog.batch()
+BATCH_BUDGETS = {
+    "refresh_policy_hits": 5,
+}
+
+# (query log, whether statements count against its budget) of the requests
+# and jobs being tracked in this context
+_active = ContextVar("queryLogs", default=())
+
+# Bound parameter lists, so an IN list of any length has the same shape
+_PARAMETER_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)\s*,?)+\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def statement_shape(statement: str) -> str:
+    return _PARAMETER_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class QueryLog:
+    def __init__(self, name=None, budget=None, batch_budget=None):
+        self.name = name
+        self.budget = budget
+        self.batch_budget = batch_budget
+        self.batches = 0
+        self.count = 0
+        # Statements of nested separate blocks, checked against their own budget
+        self.separate = 0
+        self.shapes = Counter()
+
+    def record(self, statement, budgeted=True):
+        self.count += 1
+        if not budgeted:
+            self.separate += 1
+            return
+        self.shapes[statement_shape(statement)] += 1
+
+    def budgeted(self) -> int:
+        return self.count - self.separate
+
+    def batch(self):
+        self.batches += 1
+
+    def limit(self):
+        if self.budget is None:
+            return None
+        return self.budget + self.batches * (self.batch_budget or 0)
+
+    def exceeded(self) -> bool:
+        return self.budget is not None and self.budgeted() > self.limit()
+
+    def duplicates(self, min_count: int = 2) -> list:
+        # [(shape, count)] of statements run more than once, most repeated first
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= min_count]
+
+    def report(self, limit: int = 5) -> str:
+        lines = [f"{self.name or 'request'} ran {self.budgeted()} queries (budget {self.limit()})"]
+        for shape, count in self.duplicates()[:limit]:
+            lines.append(f"  {count}x {shape[:200]}")
+        return "\n".join(lines)
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    for queryLog, budgeted in _active.get():
+        queryLog.record(statement, budgeted)
+
+
+def instrument(engine):
+    event.listen(engine, "before_cursor_execute", _on_execute)
+
+
+instrument(database.base_engine)
+instrument(database.async_base_engine.sync_engine)
+
+
+def check(queryLog: QueryLog, mode=None):
+    mode = mode or MODE
+    if mode == "off" or not queryLog.exceeded():
+        return
+    if mode == "raise":
+        raise QueryBudgetExceeded(queryLog.report())
+    logger.warning(queryLog.report())
+
+
+@contextmanager
+def track(name=None, budget=None, mode=None, separate=False):
+    """
+    Counts the statements run inside the block, on any instrumented engine,
+    and checks them against the budget (BUDGETS[name] unless given, plus
+    BATCH_BUDGETS[name] per QueryLog.batch() call) on exit. The name and
+    budget may still be set on the yielded QueryLog until then. A separate
+    block's statements are still counted by the blocks it is nested in, but
+    not against their budgets.
+    """
+    queryLog = QueryLog(name, budget if budget is not None else BUDGETS.get(name), BATCH_BUDGETS.get(name))
+    enclosing = _active.get()
+    if separate:
+        enclosing = tuple((outer, False) for outer, _ in enclosing)
+    token = _active.set(enclosing + ((queryLog, True),))
+    try:
+        yield queryLog
+    finally:
+        _active.reset(token)
+    check(queryLog, mode)
+
+
+class QueryBudgetMiddleware:
+    """
+    Tracks every HTTP request, including a streamed body, against the
+    budget of the endpoint it was routed to.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with track() as queryLog:
+            await self.app(scope, receive, send)
+            # The router has added the matched endpoint to the scope by now
+            endpoint = scope.get("endpoint")
+            if endpoint is not None:
+                queryLog.name = endpoint.__name__
+                queryLog.budget = BUDGETS.get(queryLog.name)
@@ -0,0 +1,315 @@
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping
+import orjson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Columnar report payloads: the rules are stored as one array per field,
+# string fields dictionary-encoded, type memberships as bitmaps over rule
+# positions, and the whole body compressed with zstd (zlib when the
+# zstandard package is not installed). decode() returns a LazyReport that
+# only rebuilds the parts that are read.
+
+FORMAT_VERSION = 1
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+
+# Keys that get a columnar section, everything else is stored as-is in the header
+SECTION_KEYS = ("rules", "types", "ruleStamps")
+
+_HEADER = struct.Struct("<I")
+
+
+def codec_name() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress(body: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return zlib.compress(body, ZLIB_LEVEL)
+
+
+def decompress(payload: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Report payload is zstd compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+class _Blob:
+    # Little-endian array sections appended to one buffer, addressed by (offset, typecode, count)
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def add(self, values: array):
+        if sys.byteorder == "big":
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        ref = [self.size, values.typecode, len(values)]
+        self.parts.append(data)
+        self.size += len(data)
+        return ref
+
+    def add_bytes(self, data: bytes):
+        ref = [self.size, "B", len(data)]
+        self.parts.append(data)
+        self.size += len(data)
+        return ref
+
+    def getvalue(self):
+        return b"".join(self.parts)
+
+
+def _read(blob, ref) -> array:
+    offset, typecode, count = ref
+    values = array(typecode)
+    values.frombytes(blob[offset:offset + count * values.itemsize])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _code_typecode(size: int) -> str:
+    if size <= 0xFF:
+        return "B"
+    if size <= 0xFFFF:
+        return "H"
+    return "I"
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def encode_rules(rules, blob):
+    if not rules:
+        return {"n": 0, "fields": []}
+
+    names = list(rules[0])
+    if any(list(rule) != names for rule in rules):
+        # Rules with differing keys are kept as a plain list
+        return {"list": rules}
+
+    fields = []
+    for name in names:
+        values = [rule[name] for rule in rules]
+        if all(_is_int(v) and -2**63 <= v < 2**63 for v in values):
+            fields.append({"name": name, "ints": blob.add(array("q", values))})
+            continue
+
+        dictionary, codes = {}, []
+        for value in values:
+            key = orjson.dumps(value)
+            code = dictionary.get(key)
+            if code is None:
+                code = dictionary[key] = len(dictionary)
+            codes.append(code)
+        fields.append({
+            "name": name,
+            "dict": [orjson.loads(key) for key in dictionary],
+            "codes": blob.add(array(_code_typecode(len(dictionary)), codes)),
+        })
+
+    return {"n": len(rules), "fields": fields}
+
+
+def iter_rules(section, blob):
+    # Rebuilds the rules one at a time from their columns
+    if "list" in section:
+        return iter(section["list"])
+    if not section["fields"]:
+        return ({} for _ in range(section["n"]))
+
+    names, columns = [], []
+    for field in section["fields"]:
+        names.append(field["name"])
+        if "ints" in field:
+            columns.append(_read(blob, field["ints"]).tolist())
+        else:
+            columns.append(map(field["dict"].__getitem__, _read(blob, field["codes"])))
+
+    return (dict(zip(names, row)) for row in zip(*columns))
+
+
+def decode_rules(section, blob):
+    return list(iter_rules(section, blob))
+
+
+def decode_rule_ids(section, blob):
+    # The id column alone, without building the rules
+    if "list" in section:
+        return [rule.get("id") for rule in section["list"]]
+    for field in section["fields"]:
+        if field["name"] == "id":
+            if "ints" in field:
+                return _read(blob, field["ints"]).tolist()
+            return [field["dict"][code] for code in _read(blob, field["codes"])]
+    return [None] * section["n"]
+
+
+def _rule_ids(rules):
+    ids = [rule.get("id") for rule in rules]
+    positions = {rule_id: i for i, rule_id in enumerate(ids)}
+    return ids, positions
+
+
+def encode_types(types, rules, blob):
+    ids, positions = _rule_ids(rules)
+    uniqueIds = len(positions) == len(ids)
+
+    section = {}
+    for type_name, rule_ids in types.items():
+        found = [positions.get(rule_id) for rule_id in rule_ids] if uniqueIds else [None]
+        # Only members that map back to the same rule id (and type) can become positions
+        if None in found or any(type(ids[i]) is not type(rule_id) for i, rule_id in zip(found, rule_ids)):
+            section[type_name] = {"list": rule_ids}
+        elif all(a < b for a, b in zip(found, found[1:])):
+            bitmap = bytearray((len(ids) + 7) // 8)
+            for i in found:
+                bitmap[i >> 3] |= 1 << (i & 7)
+            section[type_name] = {"bitmap": blob.add_bytes(bytes(bitmap))}
+        else:
+            section[type_name] = {"positions": blob.add(array("I", found))}
+    return section
+
+
+def decode_types(section, ids, blob):
+    types = {}
+    for type_name, entry in section.items():
+        if "list" in entry:
+            types[type_name] = entry["list"]
+        elif "positions" in entry:
+            types[type_name] = [ids[i] for i in _read(blob, entry["positions"])]
+        else:
+            offset, _, count = entry["bitmap"]
+            bitmap = blob[offset:offset + count]
+            types[type_name] = [
+                ids[(byte_index << 3) + bit]
+                for byte_index, byte in enumerate(bitmap) if byte
+                for bit in range(8) if byte >> bit & 1
+            ]
+    return types
+
+
+def encode_stamps(stamps, rules, blob):
+    keys = [str(rule.get("id")) for rule in rules]
+    values = list(stamps.values())
+    width = len(values[0]) // 2 if values else 0
+    try:
+        if list(stamps) == keys and width and all(len(v) == width * 2 for v in values):
+            # Rule-aligned fixed-width hex digests are stored as raw bytes
+            return {"width": width, "bytes": blob.add_bytes(b"".join(bytes.fromhex(v) for v in values))}
+    except (TypeError, ValueError):
+        pass
+    return {"dict": stamps}
+
+
+def decode_stamps(section, ids, blob):
+    if "dict" in section:
+        return section["dict"]
+    offset, _, count = section["bytes"]
+    data = blob[offset:offset + count]
+    width = section["width"]
+    return {str(rule_id): data[i * width:(i + 1) * width].hex() for i, rule_id in enumerate(ids)}
+
+
+def encode(report_data) -> tuple:
+    """
+    Returns (payload, encoding) for a report dict. The encoding names the
+    format and codec, e.g. "columnar+zstd", and is stored next to the payload.
+    """
+    blob = _Blob()
+    rules = report_data.get("rules")
+    sections = {}
+    if isinstance(rules, list) and all(isinstance(rule, dict) for rule in rules):
+        sections["rules"] = encode_rules(rules, blob)
+        if isinstance(report_data.get("types"), dict):
+            sections["types"] = encode_types(report_data["types"], rules, blob)
+        if isinstance(report_data.get("ruleStamps"), dict):
+            sections["ruleStamps"] = encode_stamps(report_data["ruleStamps"], rules, blob)
+
+    header = orjson.dumps({
+        "v": FORMAT_VERSION,
+        "order": list(report_data),
+        "keys": {k: v for k, v in report_data.items() if k not in sections},
+        "sections": sections,
+    })
+    codec = codec_name()
+    body = _HEADER.pack(len(header)) + header + blob.getvalue()
+    return compress(body, codec), f"columnar+{codec}"
+
+
+def decode(payload: bytes, encoding: str, derived: dict = None):
+    kind, _, codec = encoding.partition("+")
+    if kind != "columnar":
+        raise ValueError(f"Unknown report encoding {encoding}")
+    return LazyReport(decompress(payload, codec), derived)
+
+
+class LazyReport(Mapping):
+    """
+    Read-only view of a decoded payload. The header is parsed up front; rules,
+    types and stamps are rebuilt from their columns on first access, and
+    derived keys are computed from the rest of the report when read.
+    """
+
+    def __init__(self, body: bytes, derived: dict = None):
+        (headerSize,) = _HEADER.unpack_from(body)
+        header = orjson.loads(body[_HEADER.size:_HEADER.size + headerSize])
+        if header["v"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported report payload version {header['v']}")
+
+        self.blob = memoryview(body)[_HEADER.size + headerSize:]
+        self.sections = header["sections"]
+        self.values = dict(header["keys"])
+        self.derived = derived or {}
+        self.order = header["order"] + [k for k in self.derived if k not in header["order"]]
+
+    def __getitem__(self, key):
+        if key in self.values:
+            return self.values[key]
+        if key in self.sections:
+            section = self.sections[key]
+            if key == "rules":
+                value = decode_rules(section, self.blob)
+            elif key == "types":
+                value = decode_types(section, self.rule_ids(), self.blob)
+            else:
+                value = decode_stamps(section, self.rule_ids(), self.blob)
+        elif key in self.derived:
+            value = self.derived[key](self)
+        else:
+            raise KeyError(key)
+        self.values[key] = value
+        return value
+
+    def rule_ids(self):
+        if "rules" in self.values or "rules" not in self.sections:
+            return [rule.get("id") for rule in self["rules"]]
+        return decode_rule_ids(self.sections["rules"], self.blob)
+
+    def iter_rules(self):
+        # Rules in stored order without keeping the decoded list
+        if "rules" in self.values or "rules" not in self.sections:
+            return iter(self["rules"])
+        return iter_rules(self.sections["rules"], self.blob)
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, key):
+        return key in self.values or key in self.sections or key in self.derived
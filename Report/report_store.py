@@ -0,0 +1,206 @@
+import database
+import models
+import check_rulebase
+import report_codec
+
+
+# "delta" stores periodic full snapshots and, in between, only the changes
+# against the latest snapshot; "full" stores every report in full
+REPORT_STORAGE_MODE = database.get_setting("reportStorageMode", "delta")
+
+# Deltas written against one snapshot before a new snapshot is taken
+SNAPSHOT_INTERVAL = 20
+
+# A delta touching more than this share of the rules is stored as a snapshot
+MAX_DELTA_RATIO = 0.5
+
+# Keys rebuilt from the rest of the report instead of being stored in deltas or payloads
+DERIVED = {"ruleTypes": lambda data: check_rulebase.invert_rule_types(data["types"])}
+DERIVED_KEYS = tuple(DERIVED)
+
+# Flat dict keys stored as set/unset entries in deltas
+DICT_KEYS = ("ruleStamps",)
+
+# "json" stores snapshots in jsondata; "columnar" stores them as a compressed
+# report_codec payload. Deltas are small and always stay JSON.
+REPORT_ENCODING = database.get_setting("reportEncoding", "json")
+
+
+def diff_rules(baseRules, rules):
+    baseById = {rule["id"]: rule for rule in baseRules}
+    ids = {rule["id"] for rule in rules}
+
+    upsert = [rule for rule in rules if baseById.get(rule["id"]) != rule]
+    removed = [rule["id"] for rule in baseRules if rule["id"] not in ids]
+
+    delta = {"upsert": upsert, "removed": removed}
+
+    # Only spell out the order when replaying the delta would not reproduce it
+    if [rule["id"] for rule in apply_rules(baseRules, delta)] != [rule["id"] for rule in rules]:
+        delta["order"] = [rule["id"] for rule in rules]
+
+    return delta
+
+
+def apply_rules(baseRules, delta):
+    removed = set(delta["removed"])
+    upserts = {rule["id"]: rule for rule in delta["upsert"]}
+
+    rules = []
+    for rule in baseRules:
+        if rule["id"] in removed:
+            continue
+        rules.append(upserts.pop(rule["id"], rule))
+    rules.extend(rule for rule in delta["upsert"] if rule["id"] in upserts)
+
+    if "order" in delta:
+        byId = {rule["id"]: rule for rule in rules}
+        rules = [byId[rule_id] for rule_id in delta["order"]]
+
+    return rules
+
+
+def diff_types(baseTypes, types):
+    delta = {}
+    for type_name, rule_ids in types.items():
+        base = set(baseTypes.get(type_name, []))
+        current = set(rule_ids)
+        if type_name not in baseTypes or base != current:
+            delta[type_name] = {"added": sorted(current - base), "removed": sorted(base - current)}
+
+    dropped = [type_name for type_name in baseTypes if type_name not in types]
+    return {"changed": delta, "dropped": dropped}
+
+
+def apply_types(baseTypes, delta):
+    types = {}
+    for type_name, rule_ids in baseTypes.items():
+        if type_name in delta["dropped"]:
+            continue
+        change = delta["changed"].get(type_name)
+        if change is None:
+            types[type_name] = list(rule_ids)
+            continue
+        removed = set(change["removed"])
+        types[type_name] = [rule_id for rule_id in rule_ids if rule_id not in removed] + change["added"]
+
+    for type_name, change in delta["changed"].items():
+        if type_name not in types and type_name not in baseTypes:
+            types[type_name] = list(change["added"])
+
+    return types
+
+
+def diff_dict(base, current):
+    return {
+        "set": {k: v for k, v in current.items() if base.get(k) != v},
+        "unset": [k for k in base if k not in current],
+    }
+
+
+def apply_dict(base, delta):
+    data = {k: v for k, v in base.items() if k not in set(delta["unset"])}
+    data.update(delta["set"])
+    return data
+
+
+def encode_delta(base, data):
+    return {
+        "rules": diff_rules(base["rules"], data["rules"]),
+        "types": diff_types(base["types"], data["types"]),
+        "dicts": {k: diff_dict(base.get(k, {}), data[k]) for k in DICT_KEYS if k in data},
+        "keys": {k: v for k, v in data.items() if k not in ("rules", "types") and k not in DERIVED_KEYS and k not in DICT_KEYS},
+    }
+
+
+def apply_delta(base, delta):
+    data = dict(delta["keys"])
+    data["rules"] = apply_rules(base["rules"], delta["rules"])
+    data["types"] = apply_types(base["types"], delta["types"])
+    for k, change in delta.get("dicts", {}).items():
+        data[k] = apply_dict(base.get(k, {}), change)
+    return rebuild_derived(data)
+
+
+def rebuild_derived(data):
+    for key, build in DERIVED.items():
+        data[key] = build(data)
+    return data
+
+
+def delta_size(delta):
+    return len(delta["rules"]["upsert"]) + len(delta["rules"]["removed"])
+
+
+def prepare(db, firewall_id: int, report_data: dict):
+    """
+    Returns the storage columns (jsondata, base_id, payload, encoding) for a
+    new report: a snapshot of the report itself, or its delta against the
+    latest snapshot and that snapshot's id.
+    """
+    if REPORT_STORAGE_MODE != "delta":
+        return snapshot_columns(report_data)
+
+    snapshot = (
+        db.query(models.Report.id, models.Report.jsondata, models.Report.payload, models.Report.encoding)
+        .filter(models.Report.fw_id == firewall_id, models.Report.base_id == None)
+        .order_by(models.Report.id.desc())
+        .first()
+    )
+    base = snapshot_data(snapshot) if snapshot is not None else None
+    if not base:
+        return snapshot_columns(report_data)
+
+    deltas = db.query(models.Report.id).filter(models.Report.base_id == snapshot.id).count()
+    if deltas + 1 >= SNAPSHOT_INTERVAL:
+        return snapshot_columns(report_data)
+
+    delta = encode_delta(base, report_data)
+    if delta_size(delta) > MAX_DELTA_RATIO * max(len(report_data["rules"]), 1):
+        return snapshot_columns(report_data)
+
+    return {"jsondata": delta, "base_id": snapshot.id, "payload": None, "encoding": None}
+
+
+def snapshot_columns(report_data):
+    if REPORT_ENCODING != "columnar":
+        return {"jsondata": report_data, "base_id": None, "payload": None, "encoding": None}
+
+    payload, encoding = report_codec.encode({k: v for k, v in report_data.items() if k not in DERIVED_KEYS})
+    return {"jsondata": None, "base_id": None, "payload": payload, "encoding": encoding}
+
+
+def snapshot_data(row):
+    # The stored report of a row: its jsondata, or its payload decoded lazily
+    if row.payload is not None:
+        return report_codec.decode(row.payload, row.encoding, DERIVED)
+    return row.jsondata
+
+
+def load(db, row):
+    """
+    Rebuilds the report stored in a row with jsondata, base_id, payload and
+    encoding. A delta is always stored against a full snapshot, so one
+    application rebuilds it.
+    """
+    data = snapshot_data(row)
+    if row.base_id is None or data is None:
+        return data
+
+    base = (
+        db.query(models.Report.jsondata, models.Report.payload, models.Report.encoding)
+        .filter(models.Report.id == row.base_id)
+        .first()
+    )
+    return apply_delta(snapshot_data(base), data)
+
+
+def load_report_data(db, report_id: int):
+    row = (
+        db.query(models.Report.jsondata, models.Report.base_id, models.Report.payload, models.Report.encoding)
+        .filter(models.Report.id == report_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return load(db, row)
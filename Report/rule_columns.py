@@ -0,0 +1,87 @@
+from datetime import datetime
+from itertools import compress
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Rule types that depend only on the rule's own fields, evaluated here for
+# the whole rulebase at once (tests/test_rule_columns.py keeps the per-rule
+# definitions they replace)
+SCALAR_TYPES = ("expired", "permanent", "noevidence", "disabled", "manual", "dst_excessiveopen")
+
+# Rules whose source or destination is the "any" sentinel; the other half of
+# src_anyopen/dst_anyopen, full interval coverage, is still checked per rule
+SENTINEL_TYPES = ("src_anyopen", "dst_anyopen")
+
+# Expiry dates from here on are permanent
+PERMANENT_DATE = 99990101
+
+
+def date_int(date) -> int:
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+class RuleColumns:
+    """
+    The rule fields read by the scalar checks, extracted once: expiry as an
+    int YYYYMMDD (0 when unset) and one boolean column per flag. Each
+    distinct expiry string is parsed once. Columns are NumPy arrays when
+    numpy is installed, plain lists otherwise.
+    """
+
+    def __init__(self, rules):
+        dates = {}
+
+        def expire_date(expire):
+            # "DT_YYYYMMDD"
+            if not expire:
+                return 0
+            date = dates.get(expire)
+            if date is None:
+                date = dates[expire] = date_int(datetime.strptime(expire[3:], "%Y%m%d"))
+            return date
+
+        ids = [rule.id for rule in rules]
+        expire = [expire_date(rule.expire) for rule in rules]
+        flags = {
+            "noevidence": [not rule.comment.strip() for rule in rules],
+            "disabled": [not rule.apply_id for rule in rules],
+            "manual": [rule.rivision == -1 for rule in rules],
+            "dst_excessiveopen": [rule.service == "any" for rule in rules],
+            "src_anyopen": [rule.source == "any" for rule in rules],
+            "dst_anyopen": [rule.destination == "any" for rule in rules],
+        }
+
+        if numpy is not None:
+            self.ids = numpy.array(ids, dtype=numpy.int64)
+            self.expire = numpy.array(expire, dtype=numpy.int32)
+            self.flags = {name: numpy.array(values, dtype=bool) for name, values in flags.items()}
+        else:
+            self.ids, self.expire, self.flags = ids, expire, flags
+
+    def masks(self, today: int) -> dict:
+        if numpy is not None:
+            return {
+                "expired": (self.expire > 0) & (self.expire <= today),
+                "permanent": self.expire >= PERMANENT_DATE,
+                **self.flags,
+            }
+        return {
+            "expired": [0 < date <= today for date in self.expire],
+            "permanent": [date >= PERMANENT_DATE for date in self.expire],
+            **self.flags,
+        }
+
+    def evaluate(self, today=None) -> dict:
+        """
+        Returns {type name: set of rule ids} for SCALAR_TYPES and
+        SENTINEL_TYPES. A rule is expired from its expiry day on, as the
+        expiry parses to midnight and is compared with datetime.now().
+        """
+        today = today or date_int(datetime.now())
+        if numpy is not None:
+            return {name: set(self.ids[mask].tolist()) for name, mask in self.masks(today).items()}
+        return {name: set(compress(self.ids, mask)) for name, mask in self.masks(today).items()}
@@ -1,5 +1,5 @@
 
-from typing import Optional, Literal, Dict
+from typing import Optional, Literal, Dict, List, Any
 from pydantic import BaseModel, Field
 from datetime import datetime
 from enum import Enum
@@ -75,4 +75,38 @@ class FirewallAnalysis(BaseModel):
     firewalls: Dict[int, Dict[RuleType, int]]
 
     class Config:
-        use_enum_values = True
\ No newline at end of file
+        use_enum_values = True
+
+
+# rule entry of the individual report endpoint
+class ReportRule(BaseModel):
+    id: int
+    action: Optional[str] = None
+    source: Optional[str] = None
+    from_ip: Optional[str] = None
+    destination: Optional[str] = None
+    to_ip: Optional[str] = None
+    service: Optional[str] = None
+    expire: Optional[str] = None
+    comment: Optional[str] = None
+    types: List[str] = []
+
+
+class IndividualReport(BaseModel):
+    fw_name: Optional[str] = None
+    rules: List[ReportRule]
+
+
+# one keyset page of the individual report, rules ordered by id
+class IndividualReportPage(BaseModel):
+    fw_name: Optional[str] = None
+    rules: List[ReportRule]
+    next_after_rule_id: Optional[int] = None
+
+
+# stored report as returned by the security report endpoint
+class SecurityReport(BaseModel):
+    fw_name: Optional[str] = None
+    rules: List[Dict[str, Any]]
+    types: Dict[str, List[Any]]
+    scores: Optional[Dict[str, Any]] = None
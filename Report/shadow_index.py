@@ -0,0 +1,254 @@
+from bisect import bisect_left, bisect_right
+
+
+SHADOW = "shadow"
+PARTIAL_SHADOW = "partial_shadow"
+
+
+class IntervalTree:
+    """
+    Static interval tree over inclusive (start, end, value, rank) items.
+
+    Items are kept sorted by start in flat lists; the implicit balanced tree
+    over those lists stores the maximum end and the minimum rank of every
+    subtree at its middle index, so a query only descends into subtrees that
+    can match, and with `before` only into subtrees holding an earlier rule.
+    """
+
+    def __init__(self, items):
+        items = sorted(items, key=lambda item: (item[0], item[1]))
+        self.starts = [item[0] for item in items]
+        self.ends = [item[1] for item in items]
+        self.values = [item[2] for item in items]
+        self.ranks = [item[3] for item in items]
+        self.sortedEnds = sorted(self.ends)
+        self.maxEnds = [0] * len(items)
+        self.minRanks = [0] * len(items)
+        self._build(0, len(items))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _build(self, lo, hi):
+        # Iterative post-order build so deep trees cannot hit the recursion limit
+        stack = [(lo, hi, False)]
+        while stack:
+            lo, hi, visited = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if not visited:
+                stack.append((lo, hi, True))
+                stack.append((lo, mid, False))
+                stack.append((mid + 1, hi, False))
+                continue
+
+            maxEnd, minRank = self.ends[mid], self.ranks[mid]
+            for child in ((lo + mid) // 2 if lo < mid else None, (mid + 1 + hi) // 2 if mid + 1 < hi else None):
+                if child is not None:
+                    maxEnd = max(maxEnd, self.maxEnds[child])
+                    minRank = min(minRank, self.minRanks[child])
+            self.maxEnds[mid] = maxEnd
+            self.minRanks[mid] = minRank
+
+    def count_overlapping(self, start, end):
+        # Exact number of items overlapping [start, end]: those starting at or
+        # before end, less those ending before start
+        return bisect_right(self.starts, end) - bisect_left(self.sortedEnds, start)
+
+    def overlapping(self, start, end, before=None):
+        """Yields the values of every item overlapping [start, end], ranked before `before` if given."""
+        stack = [(0, len(self.starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.maxEnds[mid] < start or (before is not None and self.minRanks[mid] >= before):
+                continue
+
+            stack.append((lo, mid))
+            if self.starts[mid] <= end:
+                if self.ends[mid] >= start and (before is None or self.ranks[mid] < before):
+                    yield self.values[mid]
+                stack.append((mid + 1, hi))
+
+    def containing(self, start, end, before=None):
+        """Yields the values of every item containing [start, end], ranked before `before` if given."""
+        stack = [(0, len(self.starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.maxEnds[mid] < end or (before is not None and self.minRanks[mid] >= before):
+                continue
+
+            stack.append((lo, mid))
+            if self.starts[mid] <= start:
+                if self.ends[mid] >= end and (before is None or self.ranks[mid] < before):
+                    yield self.values[mid]
+                stack.append((mid + 1, hi))
+
+
+SIDES = ("source", "destination")
+
+
+class ShadowIndex:
+    """
+    Indexes parsed rules (see check_rulebase.parseRuleIPs) as
+    (source, destination, service) boxes for shadow detection.
+
+    Rules are partitioned by service and by the non-IP names on each side.
+    parseRuleIPs gives every side either a single name ("any", an object
+    name) or IP intervals, never both, so rules in different partitions can
+    neither overlap nor contain each other. Inside a partition each side with
+    intervals gets an interval tree; a query goes to the side whose tree
+    matches fewer items (counted exactly by bisection before walking it) and
+    the other side is checked directly, so a source shared by every rule
+    does not make every rule a candidate.
+
+    Rule order follows Rule.seq; rules without a seq keep their position
+    after every sequenced rule.
+    """
+
+    def __init__(self, ruleIPs):
+        self.rules = ruleIPs
+
+        order = sorted(range(len(ruleIPs)), key=lambda i: (ruleIPs[i].get("seq") is None, ruleIPs[i].get("seq") or 0, i))
+        self.rank = [0] * len(ruleIPs)
+        for position, idx in enumerate(order):
+            self.rank[idx] = position
+
+        self.earliest = {}
+        partitions = {}
+        for idx in order:
+            rule = ruleIPs[idx]
+            self.earliest.setdefault(self._exact_key(rule), idx)
+            partitions.setdefault(self._partition_key(rule), []).append(idx)
+
+        self.partitions = {}
+        for key, members in partitions.items():
+            self.partitions[key] = (members, {side: self._build_tree(members, side) for side in SIDES})
+
+    @staticmethod
+    def _exact_key(rule):
+        return (rule["service"], rule["source"], rule["destination"])
+
+    @staticmethod
+    def _partition_key(rule):
+        return (rule["service"], rule["source"].names, rule["destination"].names)
+
+    def _build_tree(self, members, side):
+        items = []
+        for idx in members:
+            for start, end in self.rules[idx][side].intervals:
+                items.append((start, end, idx, self.rank[idx]))
+
+        return IntervalTree(items) if items else None
+
+    @staticmethod
+    def _query_side(trees, rule, cost):
+        # The side with a tree and the fewest matches for the rule's intervals
+        best = None
+        for side in SIDES:
+            tree = trees[side]
+            if tree is None or not rule[side].intervals:
+                continue
+            matches = cost(tree, rule[side].intervals)
+            if best is None or matches < best[0]:
+                best = (matches, side)
+        return best[1] if best else None
+
+    @staticmethod
+    def _overlap_cost(tree, intervals):
+        return sum(tree.count_overlapping(start, end) for start, end in intervals)
+
+    @staticmethod
+    def _containing_cost(tree, intervals):
+        # Items containing the first interval all overlap its start point
+        start = intervals[0][0]
+        return tree.count_overlapping(start, start)
+
+    def _candidates(self, rule, before=None):
+        """
+        Yields indexes of indexed rules (ranked before `before` if given)
+        whose source and destination both overlap the rule's and which share
+        its service. May yield an index more than once.
+        """
+        partition = self.partitions.get(self._partition_key(rule))
+        if partition is None:
+            return
+
+        members, trees = partition
+        side = self._query_side(trees, rule, self._overlap_cost)
+        if side is None:
+            if trees["source"] is None and trees["destination"] is None:
+                # Name-only sides overlap exactly when the names match
+                yield from (idx for idx in members if before is None or self.rank[idx] < before)
+            return
+
+        other = "destination" if side == "source" else "source"
+        for start, end in rule[side].intervals:
+            for idx in trees[side].overlapping(start, end, before):
+                if not rule[other].intervals or rule[other].overlaps(self.rules[idx][other]):
+                    yield idx
+
+    def overlapping(self, rule):
+        """
+        Yields indexes of indexed rules whose source and destination both
+        overlap the given rule's and which share its service.
+        """
+        seen = set()
+        for idx in self._candidates(rule):
+            if idx not in seen:
+                seen.add(idx)
+                yield idx
+
+    def _shadowed(self, rule, rank):
+        # Whether an earlier rule contains both sides of the rule
+        members, trees = self.partitions[self._partition_key(rule)]
+        side = self._query_side(trees, rule, self._containing_cost)
+        if side is None:
+            # Name-only partitions hold only equal rules, covered by the exact match
+            return False
+
+        # A containing set holds the rule's first interval inside one of its own
+        start, end = rule[side].intervals[0]
+        for idx in trees[side].containing(start, end, rank):
+            existing = self.rules[idx]
+            if rule["source"].issubset(existing["source"]) and rule["destination"].issubset(existing["destination"]):
+                return True
+        return False
+
+    def classify(self, idx):
+        """
+        Returns SHADOW when an earlier rule with the same service covers both
+        the source and destination of the rule, PARTIAL_SHADOW when earlier
+        rules only overlap it, and None otherwise. Both lookups stop at the
+        first earlier rule that qualifies.
+        """
+        rule = self.rules[idx]
+        rank = self.rank[idx]
+
+        earliest = self.earliest[self._exact_key(rule)]
+        if self.rank[earliest] < rank or self._shadowed(rule, rank):
+            return SHADOW
+
+        for _ in self._candidates(rule, rank):
+            return PARTIAL_SHADOW
+        return None
+
+
+def find_shadows(ruleIPs):
+    index = ShadowIndex(ruleIPs)
+
+    shadow, partial = set(), set()
+    for idx, rule in enumerate(ruleIPs):
+        result = index.classify(idx)
+        if result == SHADOW:
+            shadow.add(rule["id"])
+        elif result == PARTIAL_SHADOW:
+            partial.add(rule["id"])
+
+    return shadow, partial
@@ -0,0 +1,181 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+import database
+import models
+
+
+# Recorder of the report being generated in this thread, if any
+_active = ContextVar("stageRecorder", default=None)
+
+FIELDS = ("calls", "wall", "cpu", "queries", "rows")
+
+
+class Recorder:
+    """
+    Wall time, CPU time, SQL statements and rows fetched per stage of a
+    report run and per rule check. Stages are measured as the difference of
+    running totals, so a check inside a stage counts toward both.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.stages = {}
+        self.checks = {}
+        self._start = self.snapshot()
+
+    def snapshot(self):
+        return time.perf_counter(), time.thread_time(), self.queries, self.rows
+
+    def add(self, target, name, start, calls=1):
+        wall, cpu, queries, rows = start
+        stats = target.get(name)
+        if stats is None:
+            stats = target[name] = [0, 0.0, 0.0, 0, 0]
+        stats[0] += calls
+        stats[1] += time.perf_counter() - wall
+        stats[2] += time.thread_time() - cpu
+        stats[3] += self.queries - queries
+        stats[4] += self.rows - rows
+
+    def total(self):
+        wall, cpu, queries, rows = self._start
+        return [1, time.perf_counter() - wall, time.thread_time() - cpu, self.queries - queries, self.rows - rows]
+
+    def to_dict(self):
+        def entry(stats):
+            return {field: round(value, 6) if isinstance(value, float) else value for field, value in zip(FIELDS, stats)}
+        return {
+            "total": entry(self.total()),
+            "stages": {name: entry(stats) for name, stats in self.stages.items()},
+            "checks": {name: entry(stats) for name, stats in self.checks.items()},
+        }
+
+
+def current():
+    return _active.get()
+
+
+@contextmanager
+def recording(recorder=None):
+    recorder = recorder or Recorder()
+    token = _active.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def _measure(group, name, calls=1):
+    recorder = _active.get()
+    if recorder is None:
+        yield
+        return
+    start = recorder.snapshot()
+    try:
+        yield
+    finally:
+        recorder.add(getattr(recorder, group), name, start, calls)
+
+
+def stage(name):
+    return _measure("stages", name)
+
+
+def check(name, calls):
+    # One pass of a rule check over `calls` rules. Checks are timed per pass,
+    # not per call, so the clocks are read a few times per run
+    return _measure("checks", name, calls)
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    recorder = _active.get()
+    if recorder is not None:
+        recorder.queries += 1
+
+
+def _on_executed(conn, cursor, statement, parameters, context, executemany):
+    # Rows as reported by the driver: psycopg2 gives the result size of a
+    # SELECT, drivers that do not know it report -1 and are not counted
+    recorder = _active.get()
+    if recorder is not None and cursor.description is not None and cursor.rowcount > 0:
+        recorder.rows += cursor.rowcount
+
+
+def instrument(engine):
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    event.listen(engine, "after_cursor_execute", _on_executed)
+
+
+instrument(database.base_engine)
+
+
+# Totals of every finished run, kept in ag_report_metric so every API worker
+# process serves the same numbers. Job workers send their run's metrics back
+# with the result and the process that submitted the job adds them.
+GROUPS = ("total", "stages", "checks")
+
+
+def observe(db, metrics: dict):
+    # Adds a run's metrics to the totals; the caller commits
+    rows = []
+    for group in GROUPS:
+        entries = {"run": metrics[group]} if group == "total" else metrics.get(group, {})
+        for name, stats in entries.items():
+            rows.append({"kind": group, "name": name, **{field: stats.get(field, 0) for field in FIELDS}})
+    if not rows:
+        return
+
+    statement = insert(models.ReportMetric).values(rows)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.ReportMetric.kind, models.ReportMetric.name],
+        set_={field: getattr(models.ReportMetric, field) + getattr(statement.excluded, field) for field in FIELDS},
+    ))
+
+
+def totals(db) -> dict:
+    result = {group: {} for group in GROUPS}
+    for row in db.query(models.ReportMetric).all():
+        if row.kind in result:
+            result[row.kind][row.name] = {field: getattr(row, field) for field in FIELDS}
+    return result
+
+
+PROMETHEUS_METRICS = [
+    # (name, group, field, label, help)
+    ("report_generation_seconds_total", "total", "wall", None, "Wall time spent generating and storing reports"),
+    ("report_generation_cpu_seconds_total", "total", "cpu", None, "CPU time spent generating and storing reports"),
+    ("report_generation_queries_total", "total", "queries", None, "SQL statements executed while generating reports"),
+    ("report_generation_rows_total", "total", "rows", None, "Rows fetched while generating reports"),
+    ("report_stage_calls_total", "stages", "calls", "stage", "Runs of each report generation stage"),
+    ("report_stage_seconds_total", "stages", "wall", "stage", "Wall time per report generation stage"),
+    ("report_stage_cpu_seconds_total", "stages", "cpu", "stage", "CPU time per report generation stage"),
+    ("report_stage_queries_total", "stages", "queries", "stage", "SQL statements per report generation stage"),
+    ("report_stage_rows_total", "stages", "rows", "stage", "Rows fetched per report generation stage"),
+    ("report_check_calls_total", "checks", "calls", "check", "Calls of each rule check"),
+    ("report_check_seconds_total", "checks", "wall", "check", "Wall time per rule check"),
+    ("report_check_cpu_seconds_total", "checks", "cpu", "check", "CPU time per rule check"),
+    ("report_check_queries_total", "checks", "queries", "check", "SQL statements per rule check"),
+    ("report_check_rows_total", "checks", "rows", "check", "Rows fetched per rule check"),
+]
+
+
+def prometheus(db) -> str:
+    # Prometheus text exposition format (version 0.0.4)
+    current = totals(db)
+    lines = [
+        "# HELP report_generations_total Reports generated",
+        "# TYPE report_generations_total counter",
+        f"report_generations_total {current['total'].get('run', {}).get('calls', 0)}",
+    ]
+    for metric, group, field, label, help in PROMETHEUS_METRICS:
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, total in sorted(current[group].items()):
+            labels = f'{{{label}="{name}"}}' if label else ""
+            lines.append(f"{metric}{labels} {total[field]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,91 @@
+"""
+Opt-in migration for the "database" unused-objects mode: adds the
+precomputed srcip_int/dstip_int/protocol/port columns to argos_syslog,
+indexes them without blocking ingest, and fills them for existing rows.
+
+    python Report/syslog_migration.py
+
+The default "merge" mode never reads these columns, so nothing here runs on
+startup. Rows ingested since the last run are merged in Python until the
+next one fills them; rerun (e.g. from cron) to keep that tail short.
+"""
+import argparse
+import logging as log
+from sqlalchemy import text
+import database
+from unused_objects import UNUSED_OBJECTS_MODE, backfill_syslog_columns
+
+
+# Adding a nullable column without a default only touches the catalog, but
+# still waits for the table lock; give up instead of queueing ingest behind it
+LOCK_TIMEOUT = "5s"
+
+COLUMNS = [
+    "ALTER TABLE {schema}.argos_syslog ADD COLUMN IF NOT EXISTS srcip_int bigint",
+    "ALTER TABLE {schema}.argos_syslog ADD COLUMN IF NOT EXISTS dstip_int bigint",
+    "ALTER TABLE {schema}.argos_syslog ADD COLUMN IF NOT EXISTS protocol varchar",
+    "ALTER TABLE {schema}.argos_syslog ADD COLUMN IF NOT EXISTS port integer",
+]
+
+# Index name -> columns, built with CONCURRENTLY so inserts keep running
+INDEXES = {
+    "ix_argos_syslog_policy_port": "policyid, protocol, port",
+    "ix_argos_syslog_policy_srcip_int": "policyid, srcip_int",
+    "ix_argos_syslog_policy_dstip_int": "policyid, dstip_int",
+}
+
+INVALID_INDEX_SQL = text("""
+    SELECT 1 FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = :schema AND c.relname = :name AND NOT i.indisvalid
+""")
+
+
+def add_columns(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        for statement in COLUMNS:
+            conn.execute(text(statement.format(schema=schema)))
+
+
+def create_indexes(engine, schema):
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, columns in INDEXES.items():
+            # An interrupted concurrent build leaves an invalid index that
+            # IF NOT EXISTS would keep, drop it so this run builds it again
+            if conn.execute(INVALID_INDEX_SQL, {"schema": schema, "name": name}).scalar():
+                conn.execute(text(f"DROP INDEX CONCURRENTLY {schema}.{name}"))
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {schema}.argos_syslog ({columns})"))
+
+
+def migrate(backfill=True):
+    add_columns(database.base_engine, database.ARGOS_SCHEMA)
+    create_indexes(database.base_engine, database.ARGOS_SCHEMA)
+    if not backfill:
+        return 0
+
+    db = database.SessionLocal()
+    try:
+        return backfill_syslog_columns(db)
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare argos_syslog for the database unused-objects mode")
+    parser.add_argument("--force", action="store_true", help="run even when unusedObjectsMode is not \"database\"")
+    parser.add_argument("--no-backfill", dest="backfill", action="store_false", help="only add the columns and indexes")
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.INFO)
+    if UNUSED_OBJECTS_MODE != "database" and not args.force:
+        parser.exit(1, f"unusedObjectsMode is {UNUSED_OBJECTS_MODE!r}, the syslog columns are only read in \"database\" mode\n")
+
+    updated = migrate(args.backfill)
+    log.info("argos_syslog columns and indexes ready, %d rows backfilled", updated)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import ipaddress
+from collections import defaultdict
+from sqlalchemy import String, cast, and_, or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+from models import SysLog, Rule, Service, Analyze, RollupWatermark
+from database import ARGOS_SCHEMA, get_setting
+from policy_hits import ROLLUP_ID_LAG
+
+
+# "merge" streams observed syslog values per policy and joins them against the
+# argos_analyze ranges in Python; "database" runs the join in Postgres against
+# the precomputed srcip_int/dstip_int/protocol/port columns of argos_syslog,
+# which only exist after running syslog_migration.py. The columns are filled
+# up to BACKFILL_WATERMARK_NAME; newer rows still go through the merge.
+UNUSED_OBJECTS_MODE = get_setting("unusedObjectsMode", "merge")
+
+BACKFILL_BATCH_SIZE = 50000
+
+# argos_rollup_watermark row holding the last syslog id with filled columns
+BACKFILL_WATERMARK_NAME = "argos_syslog_columns"
+
+# argos_analyze ctype -> (syslog dimension, protocol)
+CTYPE_DIMENSIONS = {
+    0: ("port", "tcp"),
+    1: ("port", "udp"),
+    2: ("srcip", None),
+    3: ("dstip", None),
+}
+
+
+def retrieve_unused_objects(db, fw_id, mode=None):
+    """
+    Returns the ids of rules with at least one argos_analyze object (port,
+    source or destination range) that no syslog entry of the rule has hit.
+    """
+    mode = mode or UNUSED_OBJECTS_MODE
+
+    if mode == "database":
+        return retrieve_unused_objects_database(db, fw_id)
+
+    return retrieve_unused_objects_merge(db, fw_id)
+
+
+def ip_to_int(ip):
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except (ipaddress.AddressValueError, ValueError):
+        return None
+
+
+def split_service(service, protocol, dstport):
+    # Mirrors the old SQL: 'tcp/443' style services carry their own protocol
+    # and port, anything else falls back to argos_service and the dstport
+    if service and (service.startswith("tcp/") or service.startswith("udp/")):
+        proto, _, port = service.partition("/")
+        try:
+            return proto, int(port[:5])
+        except ValueError:
+            return proto, None
+
+    return protocol, dstport
+
+
+def observed_values(db, fw_id, after_id=None):
+    """
+    Returns {(policyid, ctype): sorted list of observed values} for the rules
+    of a firewall, from the syslog rows past after_id if given. Each dimension
+    is fetched as a DISTINCT stream so only the compact set of values actually
+    seen travels to the application.
+    """
+    policyIds = select(cast(Rule.id, String)).where(Rule.fw_id == fw_id)
+    rows = SysLog.policyid.in_(policyIds)
+    if after_id is not None:
+        rows = and_(rows, SysLog.id > after_id)
+    observed = defaultdict(set)
+
+    services = (
+        db.query(SysLog.policyid, SysLog.service, SysLog.dstport, Service.protocol)
+        .outerjoin(Service, SysLog.service == Service.name)
+        .filter(rows)
+        .distinct()
+        .yield_per(BACKFILL_BATCH_SIZE)
+    )
+    for policyid, service, dstport, protocol in services:
+        proto, port = split_service(service, protocol, dstport)
+        if port is None:
+            continue
+        if proto == "tcp":
+            observed[(policyid, 0)].add(port)
+        elif proto == "udp":
+            observed[(policyid, 1)].add(port)
+
+    for column, ctype in ((SysLog.srcip, 2), (SysLog.dstip, 3)):
+        addresses = (
+            db.query(SysLog.policyid, column)
+            .filter(rows)
+            .distinct()
+            .yield_per(BACKFILL_BATCH_SIZE)
+        )
+        for policyid, ip in addresses:
+            value = ip_to_int(ip)
+            if value is not None:
+                observed[(policyid, ctype)].add(value)
+
+    return {key: sorted(values) for key, values in observed.items()}
+
+
+def merge_join(ranges, values):
+    """
+    Sort-merge join of sorted (start, end, rulebase_id) ranges against sorted
+    observed values. Yields the rulebase ids of ranges containing no value.
+    """
+    i = 0
+    for start, end, rulebase_id in ranges:
+        # ranges are sorted by start, so values skipped here are below every later range
+        while i < len(values) and values[i] < start:
+            i += 1
+        if i == len(values) or values[i] > end:
+            yield rulebase_id
+
+
+def unhit_rules(analyses, observed):
+    # Rulebase ids of the (rulebase_id, ctype, start, end) analyses no observed value falls in
+    ranges = defaultdict(list)
+    for rulebase_id, ctype, start, end in analyses:
+        ranges[(str(rulebase_id), ctype)].append((start, end, rulebase_id))
+
+    unused = set()
+    for key, keyRanges in ranges.items():
+        if key[1] not in CTYPE_DIMENSIONS:
+            # No syslog dimension can ever match these objects
+            unused.update(rulebase_id for _, _, rulebase_id in keyRanges)
+            continue
+
+        keyRanges.sort()
+        unused.update(merge_join(keyRanges, observed.get(key, [])))
+
+    return unused
+
+
+def retrieve_unused_objects_merge(db, fw_id):
+    observed = observed_values(db, fw_id)
+    analyses = (
+        db.query(Analyze.rulebase_id, Analyze.ctype, Analyze.start_object, Analyze.end_object)
+        .filter(Analyze.fw_id == fw_id)
+        .yield_per(BACKFILL_BATCH_SIZE)
+    )
+    return list(unhit_rules(analyses, observed))
+
+
+def backfilled_id(db):
+    # Syslog rows up to this id have their precomputed columns filled
+    return db.query(RollupWatermark.last_id).filter(RollupWatermark.name == BACKFILL_WATERMARK_NAME).scalar() or 0
+
+
+def retrieve_unused_objects_database(db, fw_id):
+    """
+    Joins the analyses against the syslog rows with filled columns in the
+    database, then merges the analyses none of them hit against the rows
+    ingested since, whose columns are not filled yet.
+    """
+    filled = backfilled_id(db)
+
+    hits = db.query(SysLog.id).filter(
+        and_(
+            SysLog.id <= filled,
+            SysLog.policyid == cast(Analyze.rulebase_id, String),
+            or_(
+                and_(Analyze.ctype == 0, SysLog.protocol == "tcp", SysLog.port.between(Analyze.start_object, Analyze.end_object)),
+                and_(Analyze.ctype == 1, SysLog.protocol == "udp", SysLog.port.between(Analyze.start_object, Analyze.end_object)),
+                and_(Analyze.ctype == 2, SysLog.srcip_int.between(Analyze.start_object, Analyze.end_object)),
+                and_(Analyze.ctype == 3, SysLog.dstip_int.between(Analyze.start_object, Analyze.end_object)),
+            )
+        )
+    ).exists()
+
+    unhitAnalyses = db.query(Analyze.rulebase_id, Analyze.ctype, Analyze.start_object, Analyze.end_object).filter(
+        and_(
+            Analyze.fw_id == fw_id,
+            ~hits
+        )
+    ).all()
+
+    return list(unhit_rules(unhitAnalyses, observed_values(db, fw_id, after_id=filled)))
+
+
+BACKFILL_SQL = text(f"""
+    UPDATE {ARGOS_SCHEMA}.argos_syslog s SET
+        srcip_int = CASE WHEN s.srcip ~ '^[0-9]{{1,3}}(\\.[0-9]{{1,3}}){{3}}$' THEN s.srcip::inet - '0.0.0.0'::inet END,
+        dstip_int = CASE WHEN s.dstip ~ '^[0-9]{{1,3}}(\\.[0-9]{{1,3}}){{3}}$' THEN s.dstip::inet - '0.0.0.0'::inet END,
+        protocol = CASE
+            WHEN s.service ~ '^(tcp|udp)/' THEN split_part(s.service, '/', 1)
+            ELSE (SELECT sv.protocol FROM {ARGOS_SCHEMA}.argos_service sv WHERE sv.name = s.service LIMIT 1)
+        END,
+        port = CASE
+            WHEN s.service ~ '^(tcp|udp)/[0-9]{{1,5}}$' THEN split_part(s.service, '/', 2)::integer
+            ELSE s.dstport
+        END
+    WHERE s.id > :low AND s.id <= :high
+""")
+
+
+def backfill_syslog_columns(db, batch_size=BACKFILL_BATCH_SIZE, lag=None):
+    """
+    Fills the precomputed integer columns for syslog rows past the backfill
+    watermark, in id batches so the ingest path is never blocked for long.
+    Each batch is committed together with the watermark. Like the policy hit
+    rollup it stops short of max(id), so rows of ingest transactions still
+    in flight stay past the watermark and are merged until the next run.
+    """
+    maxId = db.query(SysLog.id).order_by(SysLog.id.desc()).limit(1).scalar()
+    if maxId is None:
+        return 0
+    maxId -= ROLLUP_ID_LAG if lag is None else lag
+
+    db.execute(insert(RollupWatermark).values(name=BACKFILL_WATERMARK_NAME, last_id=0).on_conflict_do_nothing())
+    db.commit()
+
+    # Batches are half-open on the left
+    low = backfilled_id(db)
+    updated = 0
+    while low < maxId:
+        high = min(low + batch_size, maxId)
+        updated += db.execute(BACKFILL_SQL, {"low": low, "high": high}).rowcount
+        db.query(RollupWatermark).filter(RollupWatermark.name == BACKFILL_WATERMARK_NAME).update({"last_id": high})
+        db.commit()
+        low = high
+
+    return updated
@@ -0,0 +1,212 @@
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+from openpyxl.utils import get_column_letter
+
+
+# Cell style ids, indexes into cellXfs of STYLES_XML
+STYLE_DEFAULT = 0
+STYLE_BOLD = 1
+STYLE_CENTER = 2
+STYLE_BOLD_CENTER = 3
+STYLE_BOLD_VCENTER = 4
+
+STYLES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font><font><b/><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment vertical="center"/></xf>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+ROOT_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+# Characters openpyxl refuses to write (IllegalCharacterError)
+ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+INVALID_TITLE_RE = re.compile(r"[\\*?:/\[\]]")
+
+
+class Cell:
+    __slots__ = ("value", "style")
+
+    def __init__(self, value, style=STYLE_DEFAULT):
+        self.value = value
+        self.style = style
+
+
+class _ChunkSink(io.RawIOBase):
+    # Unseekable sink, zipfile then writes data descriptors and never seeks back
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.drained = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self, min_size=0):
+        if self.position - self.drained < min_size:
+            return b""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.drained = self.position
+        return data
+
+
+class StreamingSheet:
+    def __init__(self, member, widths=None):
+        self.member = member
+        self.merges = []
+        self.lastRow = 0
+
+        self._write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">')
+        if widths:
+            self._write("<cols>")
+            for col, width in sorted(widths.items()):
+                self._write(f'<col min="{col}" max="{col}" width="{width}" customWidth="1"/>')
+            self._write("</cols>")
+        self._write("<sheetData>")
+
+    def _write(self, xml):
+        self.member.write(xml.encode("utf-8"))
+
+    def append(self, cells, row=None):
+        """
+        Writes one row. Rows must be written in increasing order; a None cell
+        is left empty, a Cell carries a style id.
+        """
+        row = row or self.lastRow + 1
+        if row <= self.lastRow:
+            raise ValueError(f"Row {row} written after row {self.lastRow}")
+        self.lastRow = row
+
+        parts = [f'<row r="{row}">']
+        for col, cell in enumerate(cells, 1):
+            if cell is None:
+                continue
+            style = STYLE_DEFAULT
+            if isinstance(cell, Cell):
+                cell, style = cell.value, cell.style
+            if cell is None:
+                continue
+
+            ref = f"{get_column_letter(col)}{row}"
+            styleAttr = f' s="{style}"' if style else ""
+            if isinstance(cell, bool):
+                parts.append(f'<c r="{ref}" t="b"{styleAttr}><v>{int(cell)}</v></c>')
+            elif isinstance(cell, (int, float)):
+                parts.append(f'<c r="{ref}"{styleAttr}><v>{cell}</v></c>')
+            else:
+                text = escape(ILLEGAL_CHARACTERS_RE.sub("", str(cell)))
+                parts.append(f'<c r="{ref}" t="inlineStr"{styleAttr}><is><t xml:space="preserve">{text}</t></is></c>')
+        parts.append("</row>")
+        self._write("".join(parts))
+
+    def merge(self, ref):
+        self.merges.append(ref)
+
+    def close(self):
+        self._write("</sheetData>")
+        if self.merges:
+            self._write(f'<mergeCells count="{len(self.merges)}">')
+            for ref in self.merges:
+                self._write(f'<mergeCell ref="{ref}"/>')
+            self._write("</mergeCells>")
+        self._write("</worksheet>")
+        self.member.close()
+
+
+class StreamingXlsxWriter:
+    """
+    Minimal XLSX writer that produces the file as a stream of byte chunks.
+
+    Sheets are written row by row straight into a deflated zip member and
+    the compressed bytes are handed out through flush(), so memory stays
+    bounded by the current row rather than the whole workbook. Sheets may be
+    written in any order; their position in the workbook is given by
+    `position` and the workbook parts are written by close().
+    """
+
+    def __init__(self):
+        self.sink = _ChunkSink()
+        self.zip = zipfile.ZipFile(self.sink, "w", compression=zipfile.ZIP_DEFLATED)
+        self.sheets = []
+        self.titles = set()
+
+    def unique_title(self, title):
+        title = INVALID_TITLE_RE.sub("_", str(title or "Sheet"))[:31] or "Sheet"
+        candidate, counter = title, 1
+        while candidate.lower() in self.titles:
+            suffix = str(counter)
+            candidate = title[:31 - len(suffix)] + suffix
+            counter += 1
+        self.titles.add(candidate.lower())
+        return candidate
+
+    def create_sheet(self, title, widths=None, position=None):
+        index = len(self.sheets) + 1
+        title = self.unique_title(title)
+        self.sheets.append((position if position is not None else index, index, title))
+
+        member = self.zip.open(f"xl/worksheets/sheet{index}.xml", "w")
+        return StreamingSheet(member, widths)
+
+    def flush(self, min_size=0):
+        # Returns the compressed bytes produced so far, or b"" while fewer than min_size are pending
+        return self.sink.drain(min_size)
+
+    def close(self):
+        sheets = sorted(self.sheets)
+
+        workbook = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>']
+        rels = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">']
+        types = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                 '<Default Extension="xml" ContentType="application/xml"/>'
+                 '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                 '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>']
+
+        for sheetId, (_, index, title) in enumerate(sheets, 1):
+            workbook.append(f'<sheet name="{escape(title, {chr(34): "&quot;"})}" sheetId="{sheetId}" r:id="rId{index}"/>')
+            rels.append(f'<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{index}.xml"/>')
+            types.append(f'<Override PartName="/xl/worksheets/sheet{index}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>')
+
+        stylesId = len(self.sheets) + 1
+        workbook.append("</sheets></workbook>")
+        rels.append(f'<Relationship Id="rId{stylesId}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>')
+        rels.append("</Relationships>")
+        types.append("</Types>")
+
+        self.zip.writestr("xl/workbook.xml", "".join(workbook))
+        self.zip.writestr("xl/_rels/workbook.xml.rels", "".join(rels))
+        self.zip.writestr("xl/styles.xml", STYLES_XML)
+        self.zip.writestr("_rels/.rels", ROOT_RELS_XML)
+        self.zip.writestr("[Content_Types].xml", "".join(types))
+        self.zip.close()
+
+        return self.flush()
@@ -0,0 +1,5 @@
+import sys
+import os
+
+# The Report modules import each other by bare name, as they do under main.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Report')))
@@ -0,0 +1,57 @@
+"""
+Compares two benchmark result files stage by stage.
+
+    python -m benchmarks.compare baseline.json results.json
+"""
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as f:
+        results = json.load(f)
+    return {run["rules"]: run["stages"] for run in results["runs"]}
+
+
+def ratio(new, old):
+    return new / old if old else float("inf") if new else 1.0
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns rows of (rules, stage, metric, baseline, current, ratio) for every
+    stage present in both runs, plus whether any wall time regressed beyond
+    the threshold.
+    """
+    rows, regressed = [], False
+    for rules in sorted(set(baseline) & set(current)):
+        for stage in baseline[rules]:
+            if stage not in current[rules]:
+                continue
+            old, new = baseline[rules][stage], current[rules][stage]
+            for metric in ("wall", "queries", "repeated_queries", "peak_bytes"):
+                if metric in old and metric in new:
+                    r = ratio(new[metric], old[metric])
+                    rows.append((rules, stage, metric, old[metric], new[metric], r))
+                    if metric == "wall" and r > threshold:
+                        regressed = True
+    return rows, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=1.2, help="wall time ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    rows, regressed = compare(load(args.baseline), load(args.current), args.threshold)
+    for rules, stage, metric, old, new, r in rows:
+        flag = "  <-- slower" if metric == "wall" and r > args.threshold else ""
+        print(f"{rules:>7} {stage:<30} {metric:<10} {old:>14.3f} {new:>14.3f} {r:7.2f}x{flag}")
+
+    raise SystemExit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
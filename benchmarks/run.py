@@ -0,0 +1,204 @@
+"""
+Times the report pipeline on synthetic firewalls.
+
+    python -m benchmarks.run --rules 1000 10000 --syslog 50000 --out results.json
+    python -m benchmarks.compare baseline.json results.json
+
+Without --url the data lives in SQLite files under --workdir; pass a
+Postgres URL (an empty scratch database, its schemas are dropped and
+recreated) to measure against the real dialect.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import sqlalchemy
+from benchmarks.synthetic import RulebaseGenerator, DEFAULT_ADDRESS_MIX
+from benchmarks.standin import StandIn
+import cache
+import check_rulebase
+import crud
+import models
+import stage_metrics
+import query_budget
+
+RESULTS_VERSION = 1
+FW_ID = 1
+# Share of rules edited before the incremental run
+CHANGED_RATIO = 0.01
+
+
+def measure(fn, repeat, memory):
+    """
+    Runs fn `repeat` times for timings, then once more under tracemalloc
+    (which slows Python down, so it is kept out of the timed runs).
+    repeated_queries counts statements whose shape already ran in the same
+    call, the signature of an N+1.
+    """
+    walls, cpus, queries, repeated = [], [], [], []
+    for _ in range(repeat):
+        with query_budget.track(mode="off") as queryLog:
+            wall, cpu = time.perf_counter(), time.process_time()
+            fn()
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+        queries.append(queryLog.count)
+        repeated.append(queryLog.count - len(queryLog.shapes))
+
+    result = {
+        "wall": min(walls),
+        "wall_median": statistics.median(walls),
+        "cpu": min(cpus),
+        "queries": max(queries),
+        "repeated_queries": max(repeated),
+    }
+    if memory:
+        tracemalloc.start()
+        fn()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def edit_rules(standin, ratio, seed):
+    # Touches a few comments so the incremental run has changed rules to re-check
+    db = standin.ArgosSession()
+    try:
+        rules = db.query(models.Rule).filter(models.Rule.fw_id == FW_ID).order_by(models.Rule.id).all()
+        step = max(1, int(1 / ratio))
+        for rule in rules[seed % step::step]:
+            rule.comment = f"edited {seed}"
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_size(args, rule_count, workdir):
+    standin = StandIn(args.url, workdir)
+    generator = RulebaseGenerator(seed=args.seed)
+    query_budget.instrument(standin.base)
+    stage_metrics.instrument(standin.base)
+
+    loadStart = time.perf_counter()
+    loaded = standin.load(FW_ID, generator, rule_count, args.syslog)
+    loaded["load_seconds"] = time.perf_counter() - loadStart
+
+    argos_db = standin.ArgosSession()
+    report_db = standin.ReportSession()
+    stages = {}
+
+    def fresh():
+        cache.invalidate()
+        argos_db.expunge_all()
+        report_db.expunge_all()
+
+    def refresh():
+        standin.reset_rollup()
+        fresh()
+        crud.refresh_policy_hits(argos_db)
+
+    def analyze():
+        fresh()
+        rules = crud.get_rules(argos_db, FW_ID)
+        analyses = crud.get_analyses(argos_db, FW_ID)
+        check_rulebase.analyze(rules, analyses, crud.get_compliance_objects(argos_db), FW_ID, argos_db)
+
+    def generate():
+        fresh()
+        return crud.generate_report(argos_db, report_db, FW_ID)
+
+    try:
+        stages["refresh_policy_hits"] = measure(refresh, args.repeat, args.memory)
+        stages["analyze"] = measure(analyze, args.repeat, args.memory)
+        stages["generate_report"] = measure(generate, args.repeat, args.memory)
+        with stage_metrics.recording() as recorder:
+            generate()
+        stages["generate_report"]["breakdown"] = recorder.to_dict()
+
+        reportData = generate()
+
+        def store():
+            standin.reset_reports()
+            crud.store_report(report_db, reportData, FW_ID)
+
+        stages["store_report"] = measure(store, args.repeat, args.memory)
+
+        edit_rules(standin, CHANGED_RATIO, args.seed)
+
+        def incremental():
+            fresh()
+            return crud.generate_report(argos_db, report_db, FW_ID, incremental=True)
+
+        stages["generate_report_incremental"] = measure(incremental, args.repeat, args.memory)
+
+        def report_file():
+            size = 0
+            for chunk in crud.generate_report_file(standin.ReportSession(), [FW_ID]):
+                size += len(chunk)
+            return size
+
+        stages["generate_report_file"] = measure(report_file, args.repeat, args.memory)
+    finally:
+        argos_db.close()
+        report_db.close()
+        standin.dispose()
+
+    return {"rules": rule_count, "loaded": loaded, "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline on synthetic firewalls")
+    parser.add_argument("--rules", type=int, nargs="+", default=[1000, 10000], help="rulebase sizes to run")
+    parser.add_argument("--syslog", type=int, default=50000, help="syslog rows per firewall")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the fastest is reported")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc pass")
+    parser.add_argument("--url", default=None, help="Postgres URL of a scratch database, SQLite files when omitted")
+    parser.add_argument("--workdir", default=None, help="directory for the SQLite files")
+    parser.add_argument("--out", default="benchmark-results.json")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="report-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "dialect": "sqlite" if args.url is None else sqlalchemy.engine.make_url(args.url).get_backend_name(),
+            "commit": git_commit(),
+        },
+        "config": {"syslog": args.syslog, "seed": args.seed, "repeat": args.repeat, "address_mix": DEFAULT_ADDRESS_MIX},
+        "runs": [],
+    }
+
+    for rule_count in args.rules:
+        run = run_size(args, rule_count, workdir)
+        results["runs"].append(run)
+        for stage, stats in run["stages"].items():
+            print(f"{rule_count:>7} rules  {stage:<30} {stats['wall']:8.3f}s  {stats['queries']:>6} queries"
+                  + (f"  {stats['peak_bytes'] / 2**20:8.1f} MiB" if "peak_bytes" in stats else ""))
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
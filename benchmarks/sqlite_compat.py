@@ -0,0 +1,37 @@
+"""
+Compiles the Postgres-only SQL of the report code for the SQLite stand-in.
+Only the "sqlite" dialect is affected; importing this changes nothing for
+Postgres. The postgresql insert().on_conflict_* constructs already compile
+on SQLite as they are.
+"""
+from sqlalchemy import Date, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import Cast
+from sqlalchemy.sql.functions import Function
+
+
+# Postgres least()/greatest() skip NULL arguments, SQLite's scalar min()/max() do not
+SCALAR_FUNCTIONS = {"least": func.min, "greatest": func.max}
+
+# Same arguments and result under another name
+RENAMED_FUNCTIONS = {"json_build_object": func.json_object}
+
+
+@compiles(Cast, "sqlite")
+def compile_cast(element, compiler, **kw):
+    # CAST(x AS DATE) is a numeric cast in SQLite, date() truncates a timestamp
+    if isinstance(element.type, Date):
+        return compiler.process(func.date(element.clause, type_=Date), **kw)
+    return compiler.visit_cast(element, **kw)
+
+
+@compiles(Function, "sqlite")
+def compile_function(element, compiler, **kw):
+    renamed = RENAMED_FUNCTIONS.get(element.name.lower())
+    if renamed is not None:
+        return compiler.process(renamed(*element.clauses), **kw)
+    scalar = SCALAR_FUNCTIONS.get(element.name.lower())
+    if scalar is None:
+        return compiler.visit_function(element, **kw)
+    args = list(element.clauses)
+    return compiler.process(scalar(*(func.coalesce(*args[i:], *args[:i]) for i in range(len(args)))), **kw)
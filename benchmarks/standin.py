@@ -0,0 +1,103 @@
+import os
+from sqlalchemy import MetaData, CheckConstraint, create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+import database
+import models
+from benchmarks import sqlite_compat  # noqa: F401, registers the SQLite compilation of Postgres SQL
+
+
+ARGOS_TABLES = [
+    models.Firewall, models.Rule, models.Analyze, models.ComplianceObject, models.Service,
+    models.SysLog, models.PolicyHit, models.PolicyHitDaily, models.RollupWatermark,
+]
+REPORT_TABLES = [models.Report, models.Weights, models.ReportJob, models.ReportMetric, models.CacheGeneration]
+
+INSERT_BATCH_SIZE = 10000
+
+
+def benchmark_metadata():
+    # A copy of the model tables without their CHECK constraints, which are
+    # written in a syntax neither Postgres nor SQLite accepts
+    metadata = MetaData()
+    for model in ARGOS_TABLES + REPORT_TABLES:
+        table = model.__table__.to_metadata(metadata)
+        for constraint in [c for c in table.constraints if isinstance(c, CheckConstraint)]:
+            table.constraints.discard(constraint)
+        for column in table.columns:
+            column.constraints = {c for c in column.constraints if not isinstance(c, CheckConstraint)}
+    return metadata
+
+
+class StandIn:
+    """
+    Local database laid out like production: the argos and report tables in
+    their own schemas, reached through the same schema_translate_map routing
+    as database.engine and database.report_engine. Without a URL it is a set
+    of SQLite files in `directory`, one ATTACHed per schema.
+    """
+
+    def __init__(self, url=None, directory="."):
+        self.schemas = (database.ARGOS_SCHEMA, database.REPORT_SCHEMA)
+
+        if url is None:
+            path = os.path.join(directory, "benchmark.sqlite")
+            for name in ("benchmark",) + self.schemas:
+                candidate = os.path.join(directory, f"{name}.sqlite")
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+            self.base = create_engine(f"sqlite:///{path}")
+
+            @event.listens_for(self.base, "connect")
+            def attach(dbapi_connection, _):
+                for schema in self.schemas:
+                    dbapi_connection.execute(f"ATTACH DATABASE '{os.path.join(directory, schema + '.sqlite')}' AS {schema}")
+        else:
+            self.base = create_engine(url)
+            with self.base.begin() as conn:
+                for schema in self.schemas:
+                    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+
+        self.argos = self.base.execution_options(schema_translate_map={None: database.ARGOS_SCHEMA})
+        self.report = self.base.execution_options(schema_translate_map={None: database.REPORT_SCHEMA})
+        self.ArgosSession = sessionmaker(autocommit=False, autoflush=False, bind=self.argos)
+        self.ReportSession = sessionmaker(autocommit=False, autoflush=False, bind=self.report)
+
+        metadata = benchmark_metadata()
+        self.argosTables = [metadata.tables[model.__tablename__] for model in ARGOS_TABLES]
+        self.reportTables = [metadata.tables[model.__tablename__] for model in REPORT_TABLES]
+        metadata.drop_all(self.argos, tables=self.argosTables)
+        metadata.drop_all(self.report, tables=self.reportTables)
+        metadata.create_all(self.argos, tables=self.argosTables)
+        metadata.create_all(self.report, tables=self.reportTables)
+
+    def insert(self, engine, model, rows):
+        with engine.begin() as conn:
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                conn.execute(model.__table__.insert(), rows[start:start + INSERT_BATCH_SIZE])
+
+    def load(self, fw_id, generator, rule_count, syslog_volume):
+        rules, analyses = generator.rulebase(fw_id, rule_count)
+        syslog = generator.syslog(rules, analyses, syslog_volume)
+
+        self.insert(self.argos, models.Firewall, [{"id": fw_id, "fw_name": f"fw{fw_id}", "name": f"firewall-{fw_id}", "ipaddr": f"192.0.2.{fw_id % 250}"}])
+        self.insert(self.argos, models.Rule, rules)
+        self.insert(self.argos, models.Analyze, analyses)
+        self.insert(self.argos, models.Service, generator.services())
+        self.insert(self.argos, models.ComplianceObject, generator.compliance_objects())
+        self.insert(self.argos, models.SysLog, syslog)
+        self.insert(self.report, models.Weights, [{"id": 1, **{c.name: 1 for c in models.Weights.__table__.columns if c.name != "id"}}])
+
+        return {"rules": len(rules), "analyses": len(analyses), "syslog": len(syslog)}
+
+    def reset_rollup(self):
+        # Lets the policy hit refresh be measured from scratch again
+        with self.argos.begin() as conn:
+            for model in (models.PolicyHit, models.PolicyHitDaily, models.RollupWatermark):
+                conn.execute(model.__table__.delete())
+
+    def reset_reports(self):
+        with self.report.begin() as conn:
+            conn.execute(models.Report.__table__.delete())
+
+    def dispose(self):
+        self.base.dispose()
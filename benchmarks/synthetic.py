@@ -0,0 +1,174 @@
+import ipaddress
+import random
+from datetime import datetime, timedelta
+
+
+# Share of each address form in rule sources and destinations
+DEFAULT_ADDRESS_MIX = {"cidr": 0.4, "range": 0.2, "list": 0.2, "name": 0.1, "any": 0.1}
+
+SERVICES = ["tcp/80", "tcp/443", "tcp/22", "tcp/3389", "udp/53", "udp/123", "svc_web", "svc_db", "svc_mgmt", "any"]
+NAMED_SERVICES = {
+    "svc_web": ("tcp", 8000, 8099),
+    "svc_db": ("tcp", 5432, 5439),
+    "svc_mgmt": ("tcp", 20, 23),
+}
+
+MAX_ADDRESS = 4294836225
+MAX_PORT = 65535
+
+# Share of rules that are exact copies of an earlier rule (redundant)
+DUPLICATE_RATIO = 0.03
+# Share of rules that never show up in the syslog (unused)
+SILENT_RATIO = 0.3
+
+
+def ip(value):
+    return str(ipaddress.IPv4Address(value))
+
+
+class RulebaseGenerator:
+    """
+    Builds the rows of a synthetic firewall: rules with a mix of CIDR, range,
+    list, object-name and any addresses, their argos_analyze objects,
+    syslog traffic, services and compliance objects. The same seed always
+    produces the same rows, relative to the `now` passed in.
+    """
+
+    def __init__(self, seed=0, address_mix=None, now=None):
+        self.rng = random.Random(seed)
+        self.addressMix = address_mix or DEFAULT_ADDRESS_MIX
+        self.now = now or datetime.now().replace(microsecond=0)
+
+    def address(self):
+        # Returns (rule address string, [(start, end)] intervals for argos_analyze)
+        kind = self.rng.choices(list(self.addressMix), weights=list(self.addressMix.values()))[0]
+        base = (10 << 24) | (self.rng.randrange(256) << 16) | (self.rng.randrange(256) << 8)
+
+        if kind == "cidr":
+            prefix = self.rng.choice([16, 20, 24, 24, 28, 32])
+            network = ipaddress.IPv4Network((base, prefix), strict=False)
+            return f"IP_{network}", [(int(network.network_address), int(network.broadcast_address))]
+        if kind == "range":
+            start = base + self.rng.randrange(128)
+            end = start + self.rng.randrange(1, 512)
+            return f"IP_{ip(start)}-{ip(end)}", [(start, end)]
+        if kind == "list":
+            values = sorted({base + self.rng.randrange(256) for _ in range(self.rng.randint(2, 6))})
+            return ",".join(f"IP_{ip(v)}" for v in values), [(v, v) for v in values]
+        if kind == "name":
+            group = self.rng.randrange(50)
+            start = (172 << 24) | (group << 12)
+            return f"grp_{group}", [(start, start + 4095)]
+        return "any", [(0, MAX_ADDRESS)]
+
+    def service_ports(self, service):
+        # [(ctype, start, end)] port objects of a service
+        if service == "any":
+            return [(0, 0, MAX_PORT), (1, 0, MAX_PORT)]
+        if service in NAMED_SERVICES:
+            proto, start, end = NAMED_SERVICES[service]
+            return [(0 if proto == "tcp" else 1, start, end)]
+        proto, _, port = service.partition("/")
+        return [(0 if proto == "tcp" else 1, int(port), int(port))]
+
+    def expire(self):
+        roll = self.rng.random()
+        if roll < 0.15:
+            date = self.now - timedelta(days=self.rng.randint(1, 700))
+        elif roll < 0.35:
+            return "DT_99991231"
+        else:
+            date = self.now + timedelta(days=self.rng.randint(1, 700))
+        return "DT_" + date.strftime("%Y%m%d")
+
+    def rulebase(self, fw_id, rule_count, first_rule_id=1):
+        """
+        Returns (rules, analyses) as lists of column dicts. The intervals of
+        every rule address are mirrored into argos_analyze rows the same way
+        the collector writes them (ctype 0/1 ports, 2 source, 3 destination).
+        """
+        rules, analyses = [], []
+        intervals = {}
+
+        for i in range(rule_count):
+            rule_id = first_rule_id + i
+            if rules and self.rng.random() < DUPLICATE_RATIO:
+                original = self.rng.choice(rules)
+                source, destination, service = original["source"], original["destination"], original["service"]
+                sourceRanges, destRanges = intervals[original["id"]]
+            else:
+                (source, sourceRanges), (destination, destRanges) = self.address(), self.address()
+                service = self.rng.choice(SERVICES)
+            intervals[rule_id] = (sourceRanges, destRanges)
+
+            rules.append({
+                "id": rule_id,
+                "fw_id": fw_id,
+                "name": f"fw{fw_id}_rule{rule_id}",
+                "rivision": -1 if self.rng.random() < 0.05 else 0,
+                "from_ip": self.rng.choice(["internal", "dmz", "external"]),
+                "to_ip": self.rng.choice(["internal", "dmz", "external"]),
+                "source": source,
+                "destination": destination,
+                "action": "deny" if self.rng.random() < 0.1 else "allow",
+                "comment": "" if self.rng.random() < 0.2 else f"ticket {self.rng.randrange(100000)}",
+                "seq": i + 1,
+                "expire": self.expire(),
+                "apply_id": None if self.rng.random() < 0.05 else f"apply{self.rng.randrange(1000)}",
+                "deleted": 0,
+                "sync": 1,
+                "ts": self.now,
+                "service": service,
+            })
+
+            for ctype, start, end in self.service_ports(service):
+                analyses.append({"fw_id": fw_id, "rivision": 0, "rulebase_id": rule_id, "ctype": ctype, "start_object": start, "end_object": end, "sync": 1, "action": 0})
+            for ctype, ranges in ((2, sourceRanges), (3, destRanges)):
+                for start, end in ranges:
+                    analyses.append({"fw_id": fw_id, "rivision": 0, "rulebase_id": rule_id, "ctype": ctype, "start_object": start, "end_object": end, "sync": 1, "action": 0})
+
+        return rules, analyses
+
+    def syslog(self, rules, analyses, volume, first_id=1):
+        # Traffic for the non-silent rules, spread over the last 60 days
+        ranges = {}
+        for analysis in analyses:
+            ranges.setdefault((analysis["rulebase_id"], analysis["ctype"]), []).append((analysis["start_object"], analysis["end_object"]))
+
+        active = [rule for rule in rules if self.rng.random() >= SILENT_RATIO] or rules[:1]
+        rows = []
+        for n in range(volume):
+            rule = self.rng.choice(active)
+            src = self.rng.choice(ranges.get((rule["id"], 2), [(0, MAX_ADDRESS)]))
+            dst = self.rng.choice(ranges.get((rule["id"], 3), [(0, MAX_ADDRESS)]))
+            ports = ranges.get((rule["id"], 0)) or ranges.get((rule["id"], 1)) or [(443, 443)]
+            start, end = self.rng.choice(ports)
+            port = self.rng.randint(start, min(end, start + 1024))
+            service = rule["service"] if rule["service"] != "any" else f"tcp/{port}"
+
+            rows.append({
+                "id": first_id + n,
+                "eventtime": self.now - timedelta(days=self.rng.random() * 60),
+                "srcip": ip(self.rng.randint(src[0], src[1])),
+                "dstip": ip(self.rng.randint(dst[0], dst[1])),
+                "dstport": port,
+                "srcport": self.rng.randint(1024, MAX_PORT),
+                "policyid": str(rule["id"]),
+                "service": service,
+                "action": "accept",
+            })
+        return rows
+
+    def services(self):
+        rows = [{"name": name, "protocol": proto, "member": f"{start}-{end}"} for name, (proto, start, end) in NAMED_SERVICES.items()]
+        return [dict(row, id=i + 1) for i, row in enumerate(rows)]
+
+    def compliance_objects(self):
+        rows = []
+        for port in sorted(self.rng.sample(range(1, 1024), 40)):
+            rows.append(("wn", port, port))
+        for port in (135, 139, 445, 4444, 6667):
+            rows.append(("vi", port, port))
+        for start, end in ((22, 23), (3389, 3389), (5900, 5910)):
+            rows.append(("mn", start, end))
+        return [{"id": i + 1, "type": t, "name": f"{t}_{i}", "start_object": start, "end_object": end} for i, (t, start, end) in enumerate(rows)]
@@ -5,15 +5,28 @@ import logging as log
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '.', 'Report')))
 
-from fastapi import FastAPI,Depends,Query,Body # type: ignore
-from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI,Depends,Query,Body,Header,Response,HTTPException # type: ignore
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing  import Annotated, Union
+from typing  import Annotated, Union, Literal
+import orjson
 from pydantic import BaseModel # type: ignore
-import database, crud
+import database, schemas, crud, crud_async, migrations, jobs, http_cache, cache, stage_metrics, query_budget
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    migrations.upgrade()
+    yield
+    jobs.shutdown()
+    await database.async_base_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
 log_level = log.INFO
 
 
@@ -24,51 +37,160 @@ def generate_report_file(report_db: Session = Depends(database.get_report_db), f
 
 
 @app.get("/firewalls/get-comprehensive-report")
-def get_comprehensive_report(argos_db: Session = Depends(database.get_argos_db), report_db: Session = Depends(database.get_report_db), fw_ids: Annotated[Union[list[int], None], Query()] = None):
-    report_data = crud.get_reports(argos_db=argos_db, report_db=report_db, fw_ids=fw_ids)
+async def get_comprehensive_report(db: AsyncSession = Depends(database.get_async_report_db), fw_ids: Annotated[Union[list[int], None], Query()] = None):
+    report_data = await crud_async.get_reports(db=db, fw_ids=fw_ids)
 
     return report_data
 
-@app.get("/firewalls/{report_id}/get-individual-report")
-def generate_individual_report(report_id: int, db: Session = Depends(database.get_report_db)):
-    report_data = crud.get_report(db=db, report_id=report_id, type="individual")
-
-    return report_data
-
-
-@app.get("/firewalls/{report_id}/get-security-report")
-def get_security_report(report_id: int, db: Session = Depends(database.get_report_db)):
-    report_data = crud.get_report(db=db, report_id=report_id, type="security")
-
-    return report_data
+# Largest page of the paginated individual report
+MAX_PAGE_SIZE = 5000
+
+
+@app.get("/firewalls/{report_id}/get-individual-report", response_model=Union[schemas.IndividualReport, schemas.IndividualReportPage])
+async def generate_individual_report(
+    report_id: int,
+    db: AsyncSession = Depends(database.get_async_report_db),
+    after_rule_id: Union[int, None] = None,
+    limit: Annotated[Union[int, None], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    type: Union[str, None] = None,
+    format: Literal["json", "ndjson"] = "json",
+    accept: Annotated[Union[str, None], Header()] = None,
+    if_none_match: Annotated[Union[str, None], Header()] = None,
+    if_modified_since: Annotated[Union[str, None], Header()] = None,
+):
+    """
+    Without paging parameters the whole report is returned as before. With
+    after_rule_id, limit or type the rules are served ordered by id, one page
+    at a time, with the cursor of the next page in next_after_rule_id.
+    format=ndjson (or Accept: application/x-ndjson) streams one rule per line,
+    in stored order when not paged.
+    """
+    ndjson = format == "ndjson" or (accept is not None and "application/x-ndjson" in accept)
+    paged = after_rule_id is not None or limit is not None or type is not None
+
+    meta = await crud_async.get_report_meta(db=db, report_id=report_id)
+    etag = http_cache.make_etag("individual", meta.id, meta.update_ts, after_rule_id, limit, type, ndjson)
+    # Accept switches between JSON and NDJSON, caches must key on it
+    headers = http_cache.cache_headers(etag, http_cache.IMMUTABLE, meta.update_ts, vary="Accept")
+    if http_cache.is_fresh(etag, meta.update_ts, if_none_match, if_modified_since):
+        return http_cache.not_modified(headers)
+
+    if not ndjson and not paged:
+        # Already serialized JSON, returned as is so FastAPI does not re-encode it
+        body = await crud_async.get_report_json(db=db, report_id=report_id, type="individual")
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    if ndjson and not paged:
+        report, base = await crud_async.get_stored_rules(db=db, report_id=report_id)
+        return StreamingResponse(crud_async.stream_report_ndjson(report, base), media_type="application/x-ndjson", headers=headers)
+
+    rules = await crud_async.get_individual_rules(db=db, report_id=report_id)
+    page, nextCursor = rules.page(after_rule_id=after_rule_id, limit=limit, type=type)
+
+    if ndjson:
+        if nextCursor is not None:
+            headers["X-Next-After-Rule-Id"] = str(nextCursor)
+        return StreamingResponse(crud_async.stream_rules_ndjson(page), media_type="application/x-ndjson", headers=headers)
+
+    body = orjson.dumps({"fw_name": rules.fw_name, "rules": page, "next_after_rule_id": nextCursor})
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/firewalls/{report_id}/get-security-report", response_model=schemas.SecurityReport)
+async def get_security_report(report_id: int, db: AsyncSession = Depends(database.get_async_report_db), if_none_match: Annotated[Union[str, None], Header()] = None, if_modified_since: Annotated[Union[str, None], Header()] = None):
+    meta = await crud_async.get_report_meta(db=db, report_id=report_id)
+    etag = http_cache.make_etag("security", meta.id, meta.update_ts)
+    headers = http_cache.cache_headers(etag, http_cache.IMMUTABLE, meta.update_ts)
+    if http_cache.is_fresh(etag, meta.update_ts, if_none_match, if_modified_since):
+        return http_cache.not_modified(headers)
+
+    # Already serialized JSON, returned as is so FastAPI does not re-encode it
+    body = await crud_async.get_report_json(db=db, report_id=report_id, type="security")
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/firewalls/{firewall_id}/get-report-history")
-def get_report_history(firewall_id: int, db: Session = Depends(database.get_report_db)):
-    report_history = crud.get_report_history(db=db, fw_id=firewall_id)
+async def get_report_history(firewall_id: int, response: Response, db: AsyncSession = Depends(database.get_async_report_db), if_none_match: Annotated[Union[str, None], Header()] = None):
+    # The history grows with every new report, so clients revalidate each time
+    meta = await crud_async.get_report_history_meta(db=db, fw_id=firewall_id)
+    etag = http_cache.make_etag("history", firewall_id, meta.count, meta.last_id, meta.update_ts)
+    headers = http_cache.cache_headers(etag, http_cache.REVALIDATE, meta.update_ts)
+    if http_cache.is_fresh(etag, if_none_match=if_none_match):
+        return http_cache.not_modified(headers)
+
+    report_history = await crud_async.get_report_history(db=db, fw_id=firewall_id)
+    response.headers.update(headers)
 
     return report_history
 
 
 @app.get("/firewalls/get-reports-info")
-def get_reports_info(db: Session = Depends(database.get_report_db)):
-    report_info = crud.get_reports_info(db=db)
+async def get_reports_info(db: AsyncSession = Depends(database.get_async_report_db)):
+    report_info = await crud_async.get_reports_info(db=db)
     
     return report_info
 
 @app.get("/firewalls/get-report-weights")
 def get_report_weights(db: Session = Depends(database.get_report_db)):
-    report_info = crud.get_weights(db=db)
+    report_info = crud.get_weights_dict(db=db)
     
     return report_info
 
 
 
-@app.post("/firewalls/{firewall_id}/generate-report")
-def generate_report(firewall_id: int, argos_db: Session = Depends(database.get_argos_db), report_db: Session = Depends(database.get_report_db)):
-    report_data = crud.generate_report(argos_db=argos_db, report_db=report_db, firewall_id=firewall_id)
-    report = crud.store_report(report_db, report_data, firewall_id)
+@app.post("/firewalls/{firewall_id}/generate-report", status_code=202)
+def generate_report(firewall_id: int, incremental: bool = False):
+    # Analysis runs in the job process pool, poll /jobs/{job_id} for the report id
+    return jobs.submit_report_job(firewall_id, incremental=incremental)
+
+
+@app.post("/firewalls/generate-reports", status_code=202)
+def generate_reports(argos_db: Session = Depends(database.get_argos_db), report_db: Session = Depends(database.get_report_db), fw_ids: Annotated[Union[list[int], None], Query()] = None, incremental: bool = False):
+    # Returns at once, poll /batches/{batch_id} for the report ids
+    return jobs.generate_reports(argos_db=argos_db, report_db=report_db, fw_ids=fw_ids, incremental=incremental)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, report_db: Session = Depends(database.get_report_db)):
+    return jobs.get_job(report_db, job_id)
+
+
+@app.get("/batches/{batch_id}")
+def get_batch(batch_id: str, report_db: Session = Depends(database.get_report_db)):
+    return jobs.get_batch(report_db, batch_id)
+
+
+@app.post("/syslog/refresh-policy-hits")
+def refresh_policy_hits(db: Session = Depends(database.get_argos_db)):
+    return crud.refresh_policy_hits(db=db)
+
+
+@app.get("/database/pool")
+def get_pool_stats():
+    # Checkout wait and saturation of this process's connection pools
+    return database.pool_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(report_db: Session = Depends(database.get_report_db)):
+    # Report generation stage and check totals of every worker, in Prometheus text format
+    return PlainTextResponse(stage_metrics.prometheus(report_db), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return cache.stats()
+
 
-    return report
+@app.post("/cache/invalidate")
+def invalidate_cache(name: Union[str, None] = None, report_db: Session = Depends(database.get_report_db)):
+    # Drops one named cache, or all of them when no name is given, in every worker process
+    try:
+        cache.invalidate(name, report_db)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Cache {name} not found")
+    report_db.commit()
+    return cache.stats()
 
 
 @app.post("/firewalls/update-report-weights")
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+
+# The report modules import each other by bare name, as main.py runs them
+# from Report/; the benchmarks package is imported from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "Report")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+# The stand-in firewall every report test runs against
+FW_ID = 1
+RULES = 400
+SYSLOG = 4000
+
+
+@pytest.fixture(scope="session")
+def standin_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("standin"))
+
+
+@pytest.fixture(scope="session")
+def standin(standin_dir):
+    """
+    SQLite stand-in of the argos and report databases (benchmarks.standin)
+    loaded with one synthetic firewall. Needs the Config module, like the app.
+    """
+    import query_budget
+    import stage_metrics
+    from benchmarks.standin import StandIn
+    from benchmarks.synthetic import RulebaseGenerator
+
+    stand = StandIn(directory=standin_dir)
+    query_budget.instrument(stand.base)
+    stage_metrics.instrument(stand.base)
+    stand.load(FW_ID, RulebaseGenerator(seed=0), RULES, SYSLOG)
+    yield stand
+    stand.dispose()
+
+
+@pytest.fixture
+def sessions(standin):
+    import cache
+
+    cache.invalidate()
+    argos_db, report_db = standin.ArgosSession(), standin.ReportSession()
+    yield argos_db, report_db
+    argos_db.close()
+    report_db.close()
@@ -0,0 +1,59 @@
+import ipaddress
+import random
+
+from address_set import AddressSet, merge_intervals
+
+
+def random_set(rand, base=int(ipaddress.IPv4Address("10.0.0.0"))):
+    # A few small ranges in one /24, so sets overlap often enough
+    ranges = []
+    for _ in range(rand.randint(0, 4)):
+        start = base + rand.randint(0, 250)
+        ranges.append((start, start + rand.randint(0, 5)))
+    return AddressSet(ranges), {address for start, end in ranges for address in range(start, end + 1)}
+
+
+def test_merge_intervals():
+    assert merge_intervals([(5, 9), (1, 3), (4, 4), (20, 30), (25, 26)]) == ((1, 9), (20, 30))
+    assert merge_intervals([]) == ()
+
+
+def test_constructors():
+    assert AddressSet.from_cidr("10.0.0.0/30") == AddressSet.from_range("10.0.0.0", "10.0.0.3")
+    assert AddressSet.from_cidr("10.0.0.1/30") == AddressSet.from_cidr("10.0.0.0/30")
+    assert AddressSet.from_ips(["10.0.0.1", "10.0.0.2", "10.0.0.2"]) == AddressSet.from_range("10.0.0.1", "10.0.0.2")
+    assert len(AddressSet.from_cidr("10.0.0.0/8")) == 2 ** 24
+    assert not AddressSet()
+
+
+def test_contains():
+    addresses = AddressSet.from_cidr("192.168.1.0/24").union(AddressSet.from_name("any"))
+    assert "192.168.1.255" in addresses
+    assert "192.168.2.0" not in addresses
+    assert "any" in addresses
+    assert "other" not in addresses
+
+
+def test_names_compare_by_name():
+    named = AddressSet.from_name("web-servers")
+    assert named.issubset(AddressSet.from_name("web-servers").union(AddressSet.from_cidr("10.0.0.0/8")))
+    assert not named.issubset(AddressSet.from_cidr("0.0.0.0/0"))
+    assert named.overlaps(AddressSet.from_name("web-servers"))
+    assert not named.overlaps(AddressSet.from_name("db-servers"))
+
+
+def test_matches_address_sets():
+    rand = random.Random(0)
+    for _ in range(2000):
+        first, firstAddresses = random_set(rand)
+        second, secondAddresses = random_set(rand)
+        assert first.issubset(second) == (firstAddresses <= secondAddresses)
+        assert first.overlaps(second) == bool(firstAddresses & secondAddresses)
+        assert len(first.union(second)) == len(firstAddresses | secondAddresses)
+
+
+def test_fingerprint_is_normalized():
+    first = AddressSet([(1, 5), (6, 9)], ["any"])
+    second = AddressSet([(1, 9)], ["any"])
+    assert first.fingerprint() == second.fingerprint()
+    assert first.fingerprint() != AddressSet([(1, 9)]).fingerprint()
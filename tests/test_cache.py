@@ -0,0 +1,26 @@
+import cache
+
+
+def test_invalidation_reaches_other_processes(sessions):
+    # Two caches of one name stand for the copies held by two worker processes
+    argos_db, report_db = sessions
+    here, there = cache.TTLCache("weights"), cache.TTLCache("weights")
+    assert here.get(lambda: "old", report_db) == "old"
+    assert there.get(lambda: "old", argos_db) == "old"
+
+    cache.invalidate("weights", report_db)
+    assert there.get(lambda: "new", argos_db) == "old"
+    report_db.commit()
+
+    assert there.get(lambda: "new", argos_db) == "new"
+    assert here.get(lambda: "new", report_db) == "new"
+    assert there.get(lambda: "newer", argos_db) == "new"
+
+
+def test_local_invalidation_stays_local(sessions):
+    argos_db, _ = sessions
+    other = cache.TTLCache("compliance_objects")
+    assert other.get(lambda: "old", argos_db) == "old"
+
+    cache.invalidate("compliance_objects")
+    assert other.get(lambda: "new", argos_db) == "old"
@@ -0,0 +1,130 @@
+import os
+
+import orjson
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("aiosqlite")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import database
+import query_budget
+from conftest import FW_ID, RULES
+
+
+@pytest.fixture(scope="module")
+def client(standin, standin_dir):
+    """
+    The app with its sessions on the stand-in. Every request is checked
+    against its query budget by the middleware, with overruns raised.
+    """
+    import main
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(standin_dir, 'benchmark.sqlite')}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def attach(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for schema in standin.schemas:
+            cursor.execute(f"ATTACH DATABASE '{os.path.join(standin_dir, schema + '.sqlite')}' AS {schema}")
+        cursor.close()
+
+    query_budget.instrument(engine.sync_engine)
+    AsyncReportSession = sessionmaker(
+        bind=engine.execution_options(schema_translate_map={None: database.REPORT_SCHEMA}),
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+
+    async def get_async_report_db():
+        async with AsyncReportSession() as db:
+            yield db
+
+    def get_session(Session):
+        def get_db():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+        return get_db
+
+    main.app.dependency_overrides.update({
+        database.get_async_report_db: get_async_report_db,
+        database.get_report_db: get_session(standin.ReportSession),
+        database.get_argos_db: get_session(standin.ArgosSession),
+    })
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(query_budget, "MODE", "raise")
+        yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+    engine.sync_engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def report_id(client, standin):
+    import cache
+
+    cache.invalidate()
+    standin.reset_reports()
+    argos_db, report_db = standin.ArgosSession(), standin.ReportSession()
+    try:
+        return crud.store_report(report_db, crud.generate_report(argos_db, report_db, FW_ID), FW_ID)
+    finally:
+        argos_db.close()
+        report_db.close()
+
+
+def test_individual_report(client, report_id):
+    response = client.get(f"/firewalls/{report_id}/get-individual-report")
+    assert response.status_code == 200
+    assert len(response.json()["rules"]) == RULES
+
+
+def test_security_report(client, report_id):
+    response = client.get(f"/firewalls/{report_id}/get-security-report")
+    assert response.status_code == 200
+    assert set(response.json()) == set(crud.SECURITY_KEYS)
+
+
+def test_lists(client, report_id):
+    assert client.get(f"/firewalls/{FW_ID}/get-report-history").status_code == 200
+    assert client.get("/firewalls/get-comprehensive-report", params={"fw_ids": [FW_ID]}).status_code == 200
+    assert client.get("/firewalls/get-reports-info").status_code == 200
+    assert client.get("/firewalls/get-report-weights").status_code == 200
+
+
+def test_conditional_requests(client, report_id):
+    response = client.get(f"/firewalls/{report_id}/get-individual-report")
+    assert response.headers["Vary"] == "Accept"
+    assert client.get(f"/firewalls/{report_id}/get-individual-report", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    history = client.get(f"/firewalls/{FW_ID}/get-report-history")
+    assert client.get(f"/firewalls/{FW_ID}/get-report-history", headers={"If-None-Match": history.headers["ETag"]}).status_code == 304
+
+
+def test_individual_report_pages(client, report_id):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 150} if cursor is None else {"limit": 150, "after_rule_id": cursor}
+        page = client.get(f"/firewalls/{report_id}/get-individual-report", params=params).json()
+        ids += [rule["id"] for rule in page["rules"]]
+        cursor = page["next_after_rule_id"]
+        if cursor is None:
+            break
+
+    assert ids == sorted(ids)
+    assert len(ids) == RULES
+
+
+def test_individual_report_ndjson(client, report_id):
+    whole = client.get(f"/firewalls/{report_id}/get-individual-report").json()
+    response = client.get(f"/firewalls/{report_id}/get-individual-report", headers={"Accept": "application/x-ndjson"})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [orjson.loads(line) for line in response.text.splitlines()] == whole["rules"]
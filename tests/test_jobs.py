@@ -0,0 +1,23 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import database
+import jobs
+
+
+class BrokenExecutor:
+    def submit(self, *args):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_job_fails_when_no_pool_starts(standin, monkeypatch):
+    monkeypatch.setattr(database, "ReportSession", standin.ReportSession)
+    monkeypatch.setattr(jobs, "get_executor", BrokenExecutor)
+
+    job = jobs.submit_report_job(1)
+
+    assert job["status"] == "failed"
+    assert job["error"] == "worker died"
+    assert job["finished"] is not None
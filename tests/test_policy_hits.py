@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import String, cast, func
+
+import models
+import policy_hits
+from conftest import FW_ID, SYSLOG
+
+
+def syslog_hits(db):
+    # {rule id: last hit} straight from argos_syslog
+    rows = (
+        db.query(models.Rule.id, func.max(models.SysLog.eventtime))
+        .join(models.SysLog, cast(models.Rule.id, String) == models.SysLog.policyid)
+        .filter(models.Rule.fw_id == FW_ID)
+        .group_by(models.Rule.id)
+    )
+    return dict(rows.all())
+
+
+# No rows, part of the rows and every row folded into the rollup
+@pytest.mark.parametrize("lag", [SYSLOG * 2, SYSLOG // 2, 0])
+def test_readers_count_rows_behind_the_watermark(sessions, standin, lag):
+    argos_db, _ = sessions
+    standin.reset_rollup()
+    policy_hits.refresh_policy_hits(argos_db, batch_size=SYSLOG // 7, lag=lag)
+
+    hits = syslog_hits(argos_db)
+    ruleIds = {rule_id for rule_id, in argos_db.query(models.Rule.id).filter(models.Rule.fw_id == FW_ID)}
+    assert hits and ruleIds - set(hits)
+    assert set(policy_hits.retrieve_unused(argos_db, FW_ID)) == ruleIds - set(hits)
+
+    # A cutoff at the median last hit, so about half of the hit rules are idle
+    days = (datetime.now() - sorted(hits.values())[len(hits) // 2]).total_seconds() / 86400
+    cutoff = datetime.now() - timedelta(days=days)
+    idle = set(policy_hits.retrieve_idle(argos_db, FW_ID, days=days))
+    assert idle and idle == {rule_id for rule_id, last in hits.items() if last < cutoff}
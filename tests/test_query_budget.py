@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+import query_budget
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    query_budget.instrument(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_statement_shape():
+    first = query_budget.statement_shape("SELECT id\n  FROM rules WHERE id IN (?, ?, ?)")
+    second = query_budget.statement_shape("SELECT id FROM rules WHERE id IN (?)")
+    assert first == second == "SELECT id FROM rules WHERE id IN (?)"
+
+
+def test_track_counts_and_raises(engine):
+    with engine.connect() as conn:
+        with query_budget.track(budget=3, mode="raise") as queryLog:
+            for value in range(3):
+                conn.execute(text("SELECT :value"), {"value": value})
+        assert queryLog.count == 3
+
+        with pytest.raises(query_budget.QueryBudgetExceeded, match="ran 4 queries"):
+            with query_budget.track(budget=3, mode="raise"):
+                for value in range(4):
+                    conn.execute(text("SELECT :value"), {"value": value})
+
+
+def test_duplicates(engine):
+    with engine.connect() as conn:
+        with query_budget.track(mode="off") as queryLog:
+            conn.execute(text("SELECT 1"))
+            for value in range(3):
+                conn.execute(text("SELECT :value"), {"value": value})
+
+    assert queryLog.duplicates() == [("SELECT ?", 3)]
+
+
+def test_nested_tracks_both_count(engine):
+    with engine.connect() as conn:
+        with query_budget.track(mode="off") as outer:
+            conn.execute(text("SELECT 1"))
+            with query_budget.track(mode="off") as inner:
+                conn.execute(text("SELECT 2"))
+
+    assert (outer.count, inner.count) == (2, 1)
+
+
+def test_refresh_budget_grows_per_batch(sessions, standin, monkeypatch):
+    import policy_hits
+    from conftest import SYSLOG
+
+    monkeypatch.setattr(query_budget, "MODE", "raise")
+    argos_db, _ = sessions
+    standin.reset_rollup()
+
+    with query_budget.track("run_report_job", mode="raise") as job:
+        assert policy_hits.refresh_policy_hits(argos_db, batch_size=SYSLOG // 50, lag=0) > 0
+
+    # The refresh is counted by the job but checked against its own budget
+    assert job.count > 0
+    assert job.budgeted() == 0
+    assert job.duplicates() == []
@@ -0,0 +1,159 @@
+import io
+
+import openpyxl
+import orjson
+import pytest
+from sqlalchemy import func
+
+import check_rulebase
+import crud
+import models
+import query_budget
+import report_store
+from conftest import FW_ID, RULES
+
+
+def plain(data):
+    # Decoded reports may be lazy mappings; compare them as plain JSON values
+    return orjson.loads(orjson.dumps(dict(data)))
+
+
+def edited(data):
+    # A later report of the same firewall: one comment changed, one rule gone
+    data = plain(data)
+    data["rules"][0]["comment"] = "edited"
+    removed = data["rules"].pop()["id"]
+    data["types"] = {name: [rule_id for rule_id in ids if rule_id != removed] for name, ids in data["types"].items()}
+    data["ruleTypes"] = check_rulebase.invert_rule_types(data["types"])
+    data["ruleStamps"].pop(str(removed), None)
+    return data
+
+
+# A service no generated rule uses, which moves a rule out of every overlap
+UNUSED_SERVICE = "tcp/65001"
+
+
+def shadowers(rules):
+    # {shadowed rule id: ids of the earlier rules covering it}, by comparing every pair
+    ruleIPs = sorted(check_rulebase.parseRuleIPs(rules), key=lambda rule: rule["seq"])
+    result = {}
+    for position, rule in enumerate(ruleIPs):
+        covering = [
+            earlier["id"] for earlier in ruleIPs[:position]
+            if earlier["service"] == rule["service"]
+            and rule["source"].issubset(earlier["source"])
+            and rule["destination"].issubset(earlier["destination"])
+        ]
+        if covering:
+            result[rule["id"]] = covering
+    return result
+
+
+def copy_rule(db, rule, seq):
+    values = {column.name: getattr(rule, column.name) for column in models.Rule.__table__.columns}
+    ruleId = db.query(func.max(models.Rule.id)).scalar() + 1
+    db.add(models.Rule(**{**values, "id": ruleId, "name": f"{rule.name}_copy", "seq": seq}))
+
+
+# Edits of a shadowed rule and of the only earlier rule shadowing it
+EDITS = {
+    "modify_shadowing": lambda db, shadowed, shadowing: setattr(shadowing, "service", UNUSED_SERVICE),
+    "modify_shadowed": lambda db, shadowed, shadowing: setattr(shadowed, "service", UNUSED_SERVICE),
+    "add_shadowing": lambda db, shadowed, shadowing: copy_rule(db, shadowing, shadowing.seq - 1),
+    "add_shadowed": lambda db, shadowed, shadowing: copy_rule(db, shadowed, shadowed.seq + 1),
+    "delete_shadowing": lambda db, shadowed, shadowing: db.delete(shadowing),
+    "delete_shadowed": lambda db, shadowed, shadowing: db.delete(shadowed),
+}
+
+
+@pytest.fixture
+def rulebase(sessions):
+    # The stand-in rulebase, restored after a test edits it
+    argos_db, _ = sessions
+    table = models.Rule.__table__
+    rows = [dict(row._mapping) for row in argos_db.execute(table.select())]
+    argos_db.commit()
+    yield
+    argos_db.rollback()
+    argos_db.execute(table.delete())
+    argos_db.execute(table.insert(), rows)
+    argos_db.commit()
+
+
+def test_generate_report_within_budget(sessions):
+    argos_db, report_db = sessions
+
+    with query_budget.track("run_report_job", mode="raise") as queryLog:
+        data = crud.generate_report(argos_db, report_db, FW_ID)
+        crud.store_report(report_db, data, FW_ID)
+
+    assert len(data["rules"]) == RULES
+    # Every cache read checks its generation, anything else running twice is a per-rule query
+    assert [shape for shape, count in queryLog.duplicates() if "ag_cache_generation" not in shape] == []
+
+
+@pytest.mark.parametrize("mode, encoding", [("full", "json"), ("full", "columnar"), ("delta", "json"), ("delta", "columnar")])
+def test_round_trip(sessions, standin, monkeypatch, mode, encoding):
+    # delta + columnar stores a columnar snapshot with JSON deltas on top
+    monkeypatch.setattr(report_store, "REPORT_STORAGE_MODE", mode)
+    monkeypatch.setattr(report_store, "REPORT_ENCODING", encoding)
+    argos_db, report_db = sessions
+    standin.reset_reports()
+
+    first = crud.generate_report(argos_db, report_db, FW_ID)
+    second = edited(first)
+    firstId = crud.store_report(report_db, first, FW_ID)
+    secondId = crud.store_report(report_db, second, FW_ID)
+
+    assert plain(report_store.load_report_data(report_db, firstId)) == plain(first)
+    assert plain(report_store.load_report_data(report_db, secondId)) == plain(second)
+
+    rows = {row.id: row for row in report_db.query(models.Report.id, models.Report.base_id, models.Report.payload)}
+    assert rows[secondId].base_id == (firstId if mode == "delta" else None)
+    assert (rows[firstId].payload is not None) == (encoding == "columnar")
+
+
+def test_security_view_has_public_keys_only(sessions, standin):
+    argos_db, report_db = sessions
+    standin.reset_reports()
+    reportId = crud.store_report(report_db, crud.generate_report(argos_db, report_db, FW_ID), FW_ID)
+
+    assert set(crud.get_report(report_db, reportId, "security")) == set(crud.SECURITY_KEYS)
+
+
+def test_report_file_opens_in_openpyxl(sessions, standin):
+    argos_db, report_db = sessions
+    standin.reset_reports()
+    data = crud.generate_report(argos_db, report_db, FW_ID)
+    crud.store_report(report_db, data, FW_ID)
+
+    body = b"".join(crud.generate_report_file(report_db, [FW_ID]))
+    workbook = openpyxl.load_workbook(io.BytesIO(body))
+
+    assert data["fw_name"] in workbook.sheetnames
+    sheet = workbook[data["fw_name"]]
+    ids = {row[0] for row in sheet.iter_rows(values_only=True)}
+    assert {rule["id"] for rule in data["rules"]} <= ids
+
+
+@pytest.mark.parametrize("edit", EDITS)
+def test_incremental_report_matches_full(sessions, standin, rulebase, monkeypatch, edit):
+    argos_db, report_db = sessions
+    standin.reset_reports()
+    before = crud.generate_report(argos_db, report_db, FW_ID)
+    crud.store_report(report_db, before, FW_ID)
+
+    rules = {rule.id: rule for rule in crud.get_rules(argos_db, FW_ID)}
+    shadowedId, shadowingIds = next((ruleId, ids) for ruleId, ids in shadowers(rules.values()).items() if len(ids) == 1)
+    EDITS[edit](argos_db, rules[shadowedId], rules[shadowingIds[0]])
+    argos_db.commit()
+
+    with monkeypatch.context() as patch:
+        # The incremental run must classify only the rules around the edit
+        patch.setattr(check_rulebase, "check_shadow", None)
+        with query_budget.track("run_report_job", mode="raise"):
+            incremental = crud.generate_report(argos_db, report_db, FW_ID, incremental=True)
+
+    full = crud.generate_report(argos_db, report_db, FW_ID)
+    assert full["ruleTypes"] != before["ruleTypes"]
+    assert incremental["ruleTypes"] == full["ruleTypes"]
@@ -0,0 +1,66 @@
+import random
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+
+import rule_columns
+from rule_columns import RuleColumns, SCALAR_TYPES, SENTINEL_TYPES, date_int
+
+
+Rule = namedtuple("Rule", ["id", "expire", "comment", "apply_id", "rivision", "service", "source", "destination"])
+
+
+# The per-rule checks RuleColumns replaced, kept as the reference definition
+def parse_expiration(expiration):
+    return datetime.strptime(expiration[3:], "%Y%m%d")
+
+
+REFERENCE = {
+    "expired": lambda rule, now: bool(rule.expire) and parse_expiration(rule.expire) < now,
+    "permanent": lambda rule, now: bool(rule.expire) and parse_expiration(rule.expire) >= datetime(9999, 1, 1),
+    "noevidence": lambda rule, now: not rule.comment.strip(),
+    "disabled": lambda rule, now: not rule.apply_id,
+    "manual": lambda rule, now: rule.rivision == -1,
+    "dst_excessiveopen": lambda rule, now: rule.service == "any",
+    "src_anyopen": lambda rule, now: rule.source == "any",
+    "dst_anyopen": lambda rule, now: rule.destination == "any",
+}
+
+
+def random_rules(count, seed=0):
+    rng = random.Random(seed)
+    expiries = [None, "", "DT_99991231", "DT_99990101", "DT_20200101", "DT_20991231", datetime.now().strftime("DT_%Y%m%d")]
+    return [
+        Rule(
+            id=i,
+            expire=rng.choice(expiries),
+            comment=rng.choice(["", "  ", "ticket 42"]),
+            apply_id=rng.choice([None, 0, 7]),
+            rivision=rng.choice([-1, 0, 3]),
+            service=rng.choice(["any", "tcp/443"]),
+            source=rng.choice(["any", "IP_10.0.0.0/8"]),
+            destination=rng.choice(["any", "IP_192.168.1.1"]),
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_matches_reference(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(rule_columns, "numpy", None)
+    elif rule_columns.numpy is None:
+        pytest.skip("numpy is not installed")
+
+    rules = random_rules(500)
+    now = datetime.now()
+    result = RuleColumns(rules).evaluate(date_int(now))
+
+    assert set(result) == set(SCALAR_TYPES) | set(SENTINEL_TYPES)
+    for type_name, check in REFERENCE.items():
+        assert result[type_name] == {rule.id for rule in rules if check(rule, now)}, type_name
+
+
+def test_empty_rulebase():
+    assert all(ids == set() for ids in RuleColumns([]).evaluate().values())
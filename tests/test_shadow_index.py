@@ -0,0 +1,69 @@
+import time
+
+from address_set import AddressSet
+from shadow_index import PARTIAL_SHADOW, SHADOW, ShadowIndex, find_shadows
+
+
+def rule(id, source, destination, seq=None, service="tcp/443"):
+    return {"id": id, "seq": id if seq is None else seq, "source": source, "destination": destination, "service": service}
+
+
+def test_classify():
+    rules = [
+        rule(1, AddressSet.from_cidr("10.0.0.0/8"), AddressSet.from_cidr("192.168.0.0/16")),
+        rule(2, AddressSet.from_cidr("10.1.0.0/16"), AddressSet.from_cidr("192.168.1.0/24")),
+        rule(3, AddressSet.from_cidr("10.1.0.0/16"), AddressSet.from_cidr("192.168.0.0/15")),
+        rule(4, AddressSet.from_cidr("11.0.0.0/8"), AddressSet.from_cidr("192.168.0.0/16")),
+        rule(5, AddressSet.from_cidr("10.1.0.0/16"), AddressSet.from_cidr("192.168.1.0/24"), service="udp/53"),
+        rule(6, AddressSet.from_name("any"), AddressSet.from_name("any")),
+        rule(7, AddressSet.from_name("any"), AddressSet.from_name("any")),
+    ]
+    index = ShadowIndex(rules)
+
+    assert [index.classify(idx) for idx in range(len(rules))] == [None, SHADOW, PARTIAL_SHADOW, None, None, None, SHADOW]
+
+
+def test_rule_order_follows_seq():
+    rules = [
+        rule(1, AddressSet.from_cidr("10.1.0.0/16"), AddressSet.from_cidr("192.168.1.0/24"), seq=2),
+        rule(2, AddressSet.from_cidr("10.0.0.0/8"), AddressSet.from_cidr("192.168.0.0/16"), seq=1),
+    ]
+
+    assert find_shadows(rules) == ({1}, set())
+
+
+def test_overlapping():
+    rules = [
+        rule(1, AddressSet.from_cidr("10.0.0.0/8"), AddressSet.from_cidr("192.168.0.0/16")),
+        rule(2, AddressSet.from_cidr("10.0.0.0/8"), AddressSet.from_cidr("172.16.0.0/12")),
+        rule(3, AddressSet.from_cidr("11.0.0.0/8"), AddressSet.from_cidr("192.168.0.0/16")),
+    ]
+    index = ShadowIndex(rules)
+
+    probe = rule(4, AddressSet.from_cidr("10.2.0.0/16"), AddressSet.from_cidr("192.168.3.0/24"))
+    assert set(index.overlapping(probe)) == {0}
+
+
+def scaling_rules(count, shared):
+    # Every rule shares one /8 on one side and has its own /32 on the other
+    broad = AddressSet.from_cidr("10.0.0.0/8")
+    rules = []
+    for i in range(count):
+        own = AddressSet([(0xC0A80000 + i, 0xC0A80000 + i)])
+        rules.append(rule(i, broad, own) if shared == "source" else rule(i, own, broad))
+    return rules
+
+
+def test_shared_side_scales():
+    # Querying the shared side made every earlier rule a candidate, 8k rules took minutes
+    for shared in ("source", "destination"):
+        rules = scaling_rules(20000, shared)
+        narrow, own = AddressSet.from_cidr("10.1.0.0/16"), AddressSet([(0xC0A80005, 0xC0A80005)])
+        rules.append(rule(20000, narrow, own) if shared == "source" else rule(20000, own, narrow))
+
+        started = time.perf_counter()
+        shadow, partial = find_shadows(rules)
+        assert time.perf_counter() - started < 10
+
+        assert shadow == {20000}
+        assert partial == set()
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import bindparam
+
+import models
+import unused_objects
+from conftest import FW_ID, SYSLOG
+
+
+def fill_columns(db, last_id):
+    # What syslog_migration.py's backfill stores, computed in Python for the rows up to last_id
+    rows = (
+        db.query(models.SysLog.id, models.SysLog.service, models.SysLog.dstport, models.SysLog.srcip, models.SysLog.dstip, models.Service.protocol)
+        .outerjoin(models.Service, models.SysLog.service == models.Service.name)
+        .filter(models.SysLog.id <= last_id)
+    )
+    values = []
+    for rowId, service, dstport, srcip, dstip, protocol in rows:
+        protocol, port = unused_objects.split_service(service, protocol, dstport)
+        values.append({
+            "row_id": rowId, "protocol": protocol, "port": port,
+            "srcip_int": unused_objects.ip_to_int(srcip), "dstip_int": unused_objects.ip_to_int(dstip),
+        })
+
+    table = models.SysLog.__table__
+    db.execute(table.update().values(srcip_int=None, dstip_int=None, protocol=None, port=None))
+    if values:
+        db.execute(
+            table.update().where(table.c.id == bindparam("row_id")).values(
+                protocol=bindparam("protocol"), port=bindparam("port"),
+                srcip_int=bindparam("srcip_int"), dstip_int=bindparam("dstip_int"),
+            ),
+            values,
+        )
+    db.query(models.RollupWatermark).filter(models.RollupWatermark.name == unused_objects.BACKFILL_WATERMARK_NAME).delete()
+    db.add(models.RollupWatermark(name=unused_objects.BACKFILL_WATERMARK_NAME, last_id=last_id))
+    db.commit()
+
+
+# Rows past the backfill watermark have no columns and must still count as hits
+@pytest.mark.parametrize("filled", [0, SYSLOG // 3, SYSLOG])
+def test_database_mode_matches_merge(sessions, filled):
+    argos_db, _ = sessions
+    fill_columns(argos_db, filled)
+
+    merged = set(unused_objects.retrieve_unused_objects(argos_db, FW_ID, mode="merge"))
+    assert merged
+    assert set(unused_objects.retrieve_unused_objects(argos_db, FW_ID, mode="database")) == merged